@@ -1,14 +1,33 @@
 import os
+import atexit
 import sqlite3
 import json
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from functools import wraps
-from flask import Flask, request, jsonify, send_from_directory, session, redirect, url_for, send_file
+from flask import Flask, request, jsonify, send_from_directory, session, redirect, url_for, send_file, g, has_request_context, stream_with_context
 from werkzeug.utils import secure_filename
 import subprocess
 from typing import cast
 import glob
 import re
+import threading
+import itertools
+import math
+import socket
+import struct
+import sys
+import heapq
+import hashlib
+import importlib
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+try:
+    import fcntl
+except ImportError:  # Windows: sem flock, vale só a trava entre threads do processo
+    fcntl = None
 
 app = Flask(__name__, static_url_path='/static')
 app.secret_key = 'sua_chave_secreta_aqui'
@@ -36,28 +55,712 @@ def _empresa_dir_from_db(db_file):
     # fallback: sanitiza o nome base
     return re.sub(r'[^A-Za-z0-9_-]+', '_', raw)
 
+_diretorios_criados = set()
+
 def _empresa_data_dir(db_file):
     base = os.path.join(os.path.dirname(__file__), 'static', 'data', 'empresas')
     empresa_dir = _empresa_dir_from_db(db_file)
     path = os.path.join(base, empresa_dir)
-    os.makedirs(path, exist_ok=True)
+    if path not in _diretorios_criados:
+        os.makedirs(path, exist_ok=True)
+        _diretorios_criados.add(path)
     return path
 
 def _json_table_path(db_file, table_name):
-    return os.path.join(_empresa_data_dir(db_file), f'{table_name}.json')
-
-def _json_read_table(db_file, table_name):
-    path = _json_table_path(db_file, table_name)
-    if not os.path.exists(path):
-        return []
+    return _json_snapshot(_empresa_data_dir(db_file), table_name)[0]
+
+# Política de durabilidade das gravações JSON (JSON_FSYNC):
+#   'nenhum'    - sem fsync; o rename continua atômico, mas uma queda de energia
+#                 pode perder as últimas gravações
+#   'arquivo'   - fsync do arquivo temporário antes do rename (padrão)
+#   'diretorio' - fsync do arquivo e também do diretório depois do rename
+JSON_FSYNC = os.environ.get('JSON_FSYNC', 'arquivo')
+
+def _gravar_arquivo_atomico(path, conteudo):
+    """Grava bytes num temporário do mesmo diretório e troca com os.replace.
+    Leitores veem sempre o arquivo antigo ou o novo, nunca um arquivo pela metade.
+    Retorna a assinatura (mtime, tamanho, inode) do arquivo gravado."""
+    diretorio = os.path.dirname(path)
+    os.makedirs(diretorio, exist_ok=True)
     try:
-        with open(path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            if isinstance(data, list):
-                return data
-            return []
+        modo = os.stat(path).st_mode & 0o777
+    except OSError:
+        modo = 0o644
+    fd, tmp = tempfile.mkstemp(prefix=f'.{os.path.basename(path)}.', suffix='.tmp', dir=diretorio)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(conteudo)
+            f.flush()
+            if JSON_FSYNC in ('arquivo', 'diretorio'):
+                os.fsync(f.fileno())
+            st = os.fstat(f.fileno())
+        os.chmod(tmp, modo)
+        for tentativa in range(5):
+            try:
+                os.replace(tmp, path)
+                break
+            except PermissionError:
+                # No Windows o replace falha se outro processo estiver com o arquivo aberto
+                if tentativa == 4:
+                    raise
+                time.sleep(0.05 * (tentativa + 1))
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    if JSON_FSYNC == 'diretorio' and hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(diretorio, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+# Codecs do datastore. O texto JSON (snapshots .json e o journal) usa orjson
+# quando instalado e o json da biblioteca padrão caso contrário. Com
+# JSON_CODEC=msgpack os snapshots passam a ser gravados em <tabela>.msgpack
+# (binário, sem pickle). A leitura aceita os dois formatos, então trocar de
+# codec não exige parar o sistema; para converter tudo de uma vez:
+#     python server.py --migrar-codec msgpack
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_CODEC = os.environ.get('JSON_CODEC', 'auto')  # auto | json | orjson | msgpack
+
+def _texto_dumps(obj):
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass  # tipos que o orjson recusa (ex.: int > 64 bits) ficam com o json padrão
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def _texto_loads(dados):
+    if orjson is not None:
+        return orjson.loads(dados)
+    return json.loads(dados)
+
+def _msgpack_dumps(obj):
+    return msgpack.packb(obj, use_bin_type=True)
+
+def _msgpack_loads(dados):
+    return msgpack.unpackb(dados, raw=False, strict_map_key=False)
+
+# nome -> (extensão do snapshot, serializar, desserializar)
+_CODECS = {
+    'json': ('.json', lambda obj: json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), json.loads),
+    'orjson': ('.json', _texto_dumps, _texto_loads),
+    'msgpack': ('.msgpack', _msgpack_dumps, _msgpack_loads),
+}
+_EXTENSOES_SNAPSHOT = ('.json', '.msgpack')
+
+def _codec_disponivel(nome):
+    return nome == 'json' or (nome == 'orjson' and orjson is not None) or (nome == 'msgpack' and msgpack is not None)
+
+def _resolver_codec():
+    if JSON_CODEC in _CODECS and _codec_disponivel(JSON_CODEC):
+        return JSON_CODEC
+    if JSON_CODEC not in ('auto', 'orjson'):
+        print(f"DEBUG: Codec JSON_CODEC={JSON_CODEC!r} indisponível; usando o padrão")
+    return 'orjson' if orjson is not None else 'json'
+
+# Resolvido uma vez: o aviso de codec indisponível sai só na carga do módulo
+_CODEC_ATIVO = _resolver_codec()
+
+def _codec_ativo():
+    return _CODEC_ATIVO
+
+def _json_serializar(rows):
+    return _CODECS[_codec_ativo()][1](rows)
+
+def _json_decodificar(path, dados):
+    if path.endswith('.msgpack'):
+        if msgpack is None:
+            raise RuntimeError(f'{os.path.basename(path)} está em msgpack, mas o pacote msgpack não está instalado')
+        return _msgpack_loads(dados)
+    return _texto_loads(dados)
+
+def _json_snapshot(empresa_dir, table_name):
+    """(caminho, assinatura) do snapshot da tabela: o arquivo do codec ativo ou,
+    enquanto ele não existir, o de outro formato."""
+    preferido = os.path.join(empresa_dir, table_name + _CODECS[_codec_ativo()][0])
+    assinatura = _json_assinatura(preferido)
+    if assinatura is None:
+        for ext in _EXTENSOES_SNAPSHOT:
+            alternativo = os.path.join(empresa_dir, table_name + ext)
+            if alternativo != preferido:
+                assinatura = _json_assinatura(alternativo)
+                if assinatura is not None:
+                    return alternativo, assinatura
+    return preferido, assinatura
+
+def _json_gravar_snapshot(empresa_dir, table_name, rows):
+    """Grava o snapshot com o codec ativo e remove o de outro formato, se houver."""
+    conteudo = _json_serializar(rows)
+    path = os.path.join(empresa_dir, table_name + _CODECS[_codec_ativo()][0])
+    assinatura = _gravar_arquivo_atomico(path, conteudo)
+    for ext in _EXTENSOES_SNAPSHOT:
+        antigo = os.path.join(empresa_dir, table_name + ext)
+        if antigo != path and os.path.exists(antigo):
+            os.remove(antigo)
+    return path, assinatura, len(conteudo)
+
+# Cache em memória das tabelas JSON, por empresa e por tabela.
+# Cada entrada guarda as linhas já parseadas junto com a assinatura do arquivo
+# (mtime, tamanho e inode) e a posição até onde o journal da empresa já foi
+# aplicado; se outro processo/worker alterar o snapshot a tabela é recarregada,
+# e se só o journal crescer aplicamos apenas o trecho novo. As empresas ficam
+# num LRU limitado.
+JSON_CACHE_MAX_EMPRESAS = int(os.environ.get('JSON_CACHE_MAX_EMPRESAS', '32'))
+
+_json_cache = OrderedDict()  # empresa_dir -> {'tabelas': {...}, 'trava': RLock, contadores}
+_json_cache_lock = threading.RLock()
+_json_cache_contadores = {'hits': 0, 'incrementais': 0, 'misses': 0, 'despejos': 0}
+
+_TIPOS_ANINHADOS = (dict, list)
+
+def _json_clonar(valor):
+    if type(valor) is dict:
+        return {k: (_json_clonar(v) if type(v) in _TIPOS_ANINHADOS else v) for k, v in valor.items()}
+    return [_json_clonar(v) if type(v) in _TIPOS_ANINHADOS else v for v in valor]
+
+def _json_tem_aninhados(rows):
+    for r in rows:
+        if type(r) is not dict:
+            return True
+        for v in r.values():
+            if type(v) in _TIPOS_ANINHADOS:
+                return True
+    return False
+
+def _json_copiar_linhas(entrada):
+    # Os handlers alteram as linhas lidas antes de gravar, então o cache nunca
+    # entrega os próprios objetos. Tabelas sem campos aninhados (a maioria)
+    # só precisam de cópia rasa, que é bem mais barata.
+    rows = entrada['rows']
+    if entrada['aninhado']:
+        return [_json_clonar(r) if type(r) in _TIPOS_ANINHADOS else r for r in rows]
+    return [r.copy() for r in rows]
+
+def _json_assinatura(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def _json_cache_empresa(empresa_dir):
+    with _json_cache_lock:
+        cache = _json_cache.get(empresa_dir)
+        if cache is None:
+            cache = {'tabelas': {}, 'trava': threading.RLock(), 'hits': 0, 'incrementais': 0, 'misses': 0}
+            _json_cache[empresa_dir] = cache
+            while len(_json_cache) > JSON_CACHE_MAX_EMPRESAS:
+                _json_cache.popitem(last=False)
+                _json_cache_contadores['despejos'] += 1
+        else:
+            _json_cache.move_to_end(empresa_dir)
+        return cache
+
+def _json_cache_contar(cache, tipo):
+    with _json_cache_lock:
+        _json_cache_contadores[tipo] += 1
+        cache[tipo] += 1
+
+def _json_cache_invalidar(db_file=None, table_name=None):
+    with _json_cache_lock:
+        if db_file is None:
+            _json_cache.clear()
+            return
+        cache = _json_cache.get(_empresa_data_dir(db_file))
+    if cache is None:
+        return
+    with cache['trava']:
+        if table_name is None:
+            cache['tabelas'].clear()
+        else:
+            cache['tabelas'].pop(table_name, None)
+
+def _json_cache_estatisticas():
+    with _json_cache_lock:
+        total = _json_cache_contadores['hits'] + _json_cache_contadores['incrementais'] + _json_cache_contadores['misses']
+        empresas = list(_json_cache.items())
+        resumo = {
+            'hits': _json_cache_contadores['hits'],
+            'incrementais': _json_cache_contadores['incrementais'],
+            'misses': _json_cache_contadores['misses'],
+            'despejos': _json_cache_contadores['despejos'],
+            'compactacoes': _jornal_contadores['compactacoes'],
+            'taxa_acerto': round((total - _json_cache_contadores['misses']) / total, 4) if total else None,
+            'max_empresas': JSON_CACHE_MAX_EMPRESAS,
+            'codec': _codec_ativo(),
+        }
+    resumo['empresas'] = []
+    for empresa_dir, cache in empresas:
+        with cache['trava']:
+            tabelas = cache['tabelas']
+            resumo['empresas'].append({
+                'empresa': os.path.basename(empresa_dir),
+                'tabelas': sorted(tabelas.keys()),
+                'linhas': sum(len(e['rows']) for e in tabelas.values()),
+                'journal_bytes': (_json_assinatura(os.path.join(empresa_dir, _JORNAL_ARQUIVO)) or (0, 0, 0))[1],
+                'hits': cache['hits'],
+                'incrementais': cache['incrementais'],
+                'misses': cache['misses'],
+            })
+    return resumo
+
+# Journal (write-ahead) por empresa: em vez de regravar a tabela inteira a cada
+# alteração, _json_write_table anexa em _journal.jsonl uma linha com as operações
+# (insert/update/delete por id, ou replace da tabela inteira para tabelas sem id).
+# A leitura aplica o journal sobre o snapshot <tabela>.json e a compactação
+# periódica incorpora as operações nos snapshots e recomeça o journal.
+# A primeira linha do journal identifica a geração, para que um leitor nunca
+# confunda um journal recriado com a continuação do anterior.
+JSON_JOURNAL = os.environ.get('JSON_JOURNAL', '1') != '0'
+JSON_JOURNAL_MAX_BYTES = int(os.environ.get('JSON_JOURNAL_MAX_BYTES', str(4 * 1024 * 1024)))
+JSON_JOURNAL_INTERVALO = int(os.environ.get('JSON_JOURNAL_INTERVALO', '60'))
+
+_JORNAL_ARQUIVO = '_journal.jsonl'
+_JORNAL_TRAVA = '_journal.lock'
+_jornal_contadores = {'compactacoes': 0}
+
+class _TravaEmpresa:
+    """Trava exclusiva e reentrante por empresa: RLock para as threads do
+    processo e flock em _journal.lock para os demais workers."""
+
+    def __init__(self, empresa_dir):
+        self.caminho = os.path.join(empresa_dir, _JORNAL_TRAVA)
+        self._rlock = threading.RLock()
+        self._profundidade = 0
+        self._fd = None
+
+    def __enter__(self):
+        self._rlock.acquire()
+        if self._profundidade == 0 and fcntl is not None:
+            try:
+                # Abre a cada aquisição: um fd herdado via fork compartilharia o lock
+                self._fd = os.open(self.caminho, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except BaseException:
+                if self._fd is not None:
+                    os.close(self._fd)
+                    self._fd = None
+                self._rlock.release()
+                raise
+        self._profundidade += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._profundidade -= 1
+        if self._profundidade == 0 and self._fd is not None:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            finally:
+                os.close(self._fd)
+                self._fd = None
+        self._rlock.release()
+        return False
+
+_travas_empresa = {}
+_travas_empresa_lock = threading.Lock()
+
+def _json_trava(empresa_dir):
+    with _travas_empresa_lock:
+        trava = _travas_empresa.get(empresa_dir)
+        if trava is None:
+            trava = _TravaEmpresa(empresa_dir)
+            _travas_empresa[empresa_dir] = trava
+        return trava
+
+def _json_chave(valor):
+    # Ids aparecem ora como int, ora como string ("7"); normaliza para comparar.
+    # Isso vale para todas as buscas por índice (_json_get/_json_buscar): "7" e 7
+    # são a mesma chave, ao contrário do == estrito das varreduras antigas
+    if isinstance(valor, bool):
+        return valor
+    if isinstance(valor, int):
+        return valor
+    if isinstance(valor, str):
+        try:
+            return int(valor)
+        except ValueError:
+            return valor
+    return valor
+
+def _jornal_ler(f, ino=None, geracao=None, offset=0):
+    """Lê os registros completos do journal aberto em f a partir de offset.
+    Se o arquivo não for a mesma geração (ino + geração do cabeçalho), lê desde
+    o início. Retorna (ino, geracao, offset_final, registros, mesma_geracao)."""
+    st = os.fstat(f.fileno())
+    cabecalho = f.readline()
+    try:
+        geracao_atual = _texto_loads(cabecalho).get('geracao') if cabecalho.endswith(b'\n') else None
     except Exception:
-        return []
+        geracao_atual = None
+    if geracao_atual is None:
+        return (st.st_ino, None, 0, [], False)
+    mesma = st.st_ino == ino and geracao_atual == geracao and len(cabecalho) <= offset <= st.st_size
+    inicio = offset if mesma else len(cabecalho)
+    f.seek(inicio)
+    dados = f.read()
+    fim = dados.rfind(b'\n') + 1  # ignora uma linha final ainda incompleta
+    registros = []
+    for linha in dados[:fim].splitlines():
+        if not linha.strip():
+            continue
+        try:
+            registros.append(_texto_loads(linha))
+        except Exception:
+            print(f"DEBUG: Linha inválida ignorada no journal: {linha[:80]!r}")
+    return (st.st_ino, geracao_atual, inicio + fim, registros, mesma)
+
+def _jornal_posicoes(entrada):
+    pos = entrada.get('pos')
+    if pos is None:
+        pos = {}
+        for i, r in enumerate(entrada['rows']):
+            if type(r) is dict and 'id' in r:
+                pos[_json_chave(r['id'])] = i
+        entrada['pos'] = pos
+    return pos
+
+def _json_chave_indice(row, campo):
+    if isinstance(campo, tuple):
+        return tuple(_json_chave(row.get(c)) for c in campo)
+    return _json_chave(row.get(campo))
+
+# Ids alterados pelo journal em cada entrada do cache, para quem acompanha a
+# tabela incrementalmente (ex.: a topologia) sem relê-la inteira. Cada entrada
+# nova ganha uma série; a lista guarda as últimas JSON_MUDANCAS_MAX chaves
+# (None = troca completa da tabela).
+JSON_MUDANCAS_MAX = 4096
+_json_series = itertools.count(1)
+
+def _json_registrar_mudanca(entrada, chave):
+    mudancas = entrada['mudancas']
+    mudancas.append(chave)
+    if len(mudancas) > JSON_MUDANCAS_MAX:
+        descartadas = len(mudancas) // 2
+        del mudancas[:descartadas]
+        entrada['mudancas_base'] += descartadas
+
+def _json_mudancas_desde(entrada, marca):
+    """(ids alterados desde marca, marca atual), com marca vinda de uma chamada
+    anterior. No lugar dos ids vem None quando não dá para saber (entrada
+    recarregada, troca completa, histórico já descartado): relê a tabela toda."""
+    atual = (entrada['serie'], entrada['mudancas_base'] + len(entrada['mudancas']))
+    if marca is None or marca[0] != atual[0] or marca[1] < entrada['mudancas_base']:
+        return None, atual
+    novas = entrada['mudancas'][marca[1] - entrada['mudancas_base']:]
+    if None in novas:
+        return None, atual
+    return set(novas), atual
+
+def _jornal_aplicar(entrada, registros, table_name):
+    rows = entrada['rows']
+    for registro in registros:
+        for op in registro.get('ops') or []:
+            if op.get('t') != table_name:
+                continue
+            tipo = op.get('op')
+            if tipo == 'replace':
+                _json_registrar_mudanca(entrada, None)
+                rows = list(op.get('rows') or [])
+                entrada['rows'] = rows
+                entrada['pos'] = None
+                entrada['indices'] = {}
+                entrada['max_id'] = None
+                entrada['aninhado'] = _json_tem_aninhados(rows)
+                continue
+            pos = _jornal_posicoes(entrada)
+            chave = _json_chave(op.get('id'))
+            _json_registrar_mudanca(entrada, chave)
+            if tipo == 'delete':
+                if chave in pos:
+                    del rows[pos[chave]]
+                    # As posições mudaram: índices são reconstruídos na próxima consulta
+                    entrada['pos'] = None
+                    entrada['indices'] = {}
+                continue
+            row = op.get('row')
+            if not isinstance(row, dict):
+                continue
+            i = pos.get(chave)
+            if i is not None:
+                antiga = rows[i]
+                rows[i] = row
+                for campo, indice in entrada['indices'].items():
+                    chave_antiga = _json_chave_indice(antiga, campo)
+                    chave_nova = _json_chave_indice(row, campo)
+                    if chave_antiga != chave_nova:
+                        posicoes = indice.get(chave_antiga)
+                        if posicoes is not None and i in posicoes:
+                            posicoes.remove(i)
+                            if not posicoes:
+                                del indice[chave_antiga]
+                        indice.setdefault(chave_nova, []).append(i)
+            else:
+                i = len(rows)
+                pos[chave] = i
+                rows.append(row)
+                for campo, indice in entrada['indices'].items():
+                    indice.setdefault(_json_chave_indice(row, campo), []).append(i)
+            if entrada.get('max_id') is not None and isinstance(chave, int) and chave > entrada['max_id']:
+                entrada['max_id'] = chave
+            if not entrada['aninhado'] and _json_tem_aninhados([row]):
+                entrada['aninhado'] = True
+
+def _jornal_diferenca(entrada, table_name, rows):
+    """Operações que levam o estado atual da tabela até rows."""
+    novas = {}
+    for r in rows:
+        if type(r) is not dict or 'id' not in r:
+            novas = None
+            break
+        chave = _json_chave(r['id'])
+        if chave in novas:
+            novas = None
+            break
+        novas[chave] = r
+    if novas is None:
+        return [{'t': table_name, 'op': 'replace', 'rows': rows}]
+    atuais = entrada['rows']
+    pos = _jornal_posicoes(entrada)
+    ops = []
+    for chave, i in pos.items():
+        if chave not in novas:
+            ops.append({'t': table_name, 'op': 'delete', 'id': atuais[i].get('id')})
+    for chave, r in novas.items():
+        i = pos.get(chave)
+        if i is None:
+            ops.append({'t': table_name, 'op': 'insert', 'id': r['id'], 'row': r})
+        elif atuais[i] != r:
+            ops.append({'t': table_name, 'op': 'update', 'id': r['id'], 'row': r})
+    # Se quase tudo mudou, uma troca completa é menor que as operações
+    if len(ops) > 1 and len(ops) * 2 > len(rows) + len(atuais):
+        return [{'t': table_name, 'op': 'replace', 'rows': rows}]
+    return ops
+
+def _jornal_anexar(empresa_dir, registro):
+    """Anexa um registro ao journal (chamar com a trava da empresa)."""
+    jpath = os.path.join(empresa_dir, _JORNAL_ARQUIVO)
+    linha = _texto_dumps(registro) + b'\n'
+    fd = os.open(jpath, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        tamanho = os.fstat(fd).st_size
+        if tamanho == 0:
+            cabecalho = json.dumps({'journal': 1, 'geracao': os.urandom(8).hex()}).encode('utf-8') + b'\n'
+            linha = cabecalho + linha
+        else:
+            # Uma gravação interrompida pode ter deixado a última linha sem '\n'
+            os.lseek(fd, tamanho - 1, os.SEEK_SET)
+            if os.read(fd, 1) != b'\n':
+                linha = b'\n' + linha
+        os.write(fd, linha)
+        if JSON_FSYNC in ('arquivo', 'diretorio'):
+            os.fsync(fd)
+        return tamanho + len(linha)
+    finally:
+        os.close(fd)
+
+def _json_tabela_atual(empresa_dir, table_name):
+    """Entrada do cache com o estado atual da tabela (snapshot + journal).
+    As linhas pertencem ao cache: quem chama não pode alterá-las."""
+    cache = _json_cache_empresa(empresa_dir)
+    jpath = os.path.join(empresa_dir, _JORNAL_ARQUIVO)
+    with cache['trava']:
+        entrada = cache['tabelas'].get(table_name)
+        # O journal é consultado antes do snapshot: se uma compactação acontecer
+        # no meio, o pior caso é reaplicar operações já incorporadas (idempotente)
+        try:
+            jf = open(jpath, 'rb')
+        except FileNotFoundError:
+            jf = None
+        try:
+            jst = os.fstat(jf.fileno()) if jf else None
+            path, assinatura = _json_snapshot(empresa_dir, table_name)
+            if entrada is not None and entrada['assinatura'] == assinatura:
+                if jst is None and entrada['jornal'] is None:
+                    _json_cache_contar(cache, 'hits')
+                    return entrada
+                if jst is not None and entrada['jornal'] is not None:
+                    ino, geracao, offset = entrada['jornal']
+                    if jst.st_ino == ino and jst.st_size == offset:
+                        _json_cache_contar(cache, 'hits')
+                        return entrada
+                    ino, geracao, offset, registros, _ = _jornal_ler(jf, ino, geracao, offset)
+                else:
+                    ino, geracao, offset, registros, _ = _jornal_ler(jf) if jf else (None, None, 0, [], True)
+                # Snapshot inalterado: basta aplicar o que é novo no journal
+                _jornal_aplicar(entrada, registros, table_name)
+                entrada['jornal'] = (ino, geracao, offset) if jf else None
+                _json_cache_contar(cache, 'incrementais')
+                return entrada
+
+            _json_cache_contar(cache, 'misses')
+            rows = []
+            if assinatura is not None:
+                try:
+                    with open(path, 'rb') as f:
+                        data = _json_decodificar(path, f.read())
+                    if isinstance(data, list):
+                        rows = data
+                except Exception as e:
+                    print(f"DEBUG: Falha ao ler tabela JSON '{table_name}': {e}")
+                    assinatura = ('erro',)  # nunca confere: tenta de novo na próxima leitura
+            entrada = {'assinatura': assinatura, 'rows': rows, 'pos': None,
+                       'indices': {}, 'aninhado': _json_tem_aninhados(rows), 'jornal': None,
+                       'serie': next(_json_series), 'mudancas': [], 'mudancas_base': 0}
+            if jf is not None:
+                ino, geracao, offset, registros, _ = _jornal_ler(jf)
+                _jornal_aplicar(entrada, registros, table_name)
+                entrada['jornal'] = (ino, geracao, offset)
+            cache['tabelas'][table_name] = entrada
+            return entrada
+        finally:
+            if jf is not None:
+                jf.close()
+
+def _jornal_compactar(empresa_dir):
+    """Incorpora o journal nos snapshots e recomeça um journal vazio."""
+    jpath = os.path.join(empresa_dir, _JORNAL_ARQUIVO)
+    with _json_trava(empresa_dir):
+        try:
+            with open(jpath, 'rb') as jf:
+                _, _, _, registros, _ = _jornal_ler(jf)
+        except FileNotFoundError:
+            return
+        tabelas = []
+        for registro in registros:
+            for op in registro.get('ops') or []:
+                if op.get('t') and op['t'] not in tabelas:
+                    tabelas.append(op['t'])
+        if not tabelas and os.path.getsize(jpath) <= JSON_JOURNAL_MAX_BYTES:
+            return
+        cache = _json_cache_empresa(empresa_dir)
+        with cache['trava']:
+            gravadas = {}
+            for table_name in tabelas:
+                entrada = _json_tabela_atual(empresa_dir, table_name)
+                gravadas[table_name] = _json_gravar_snapshot(empresa_dir, table_name, entrada['rows'])[1]
+            cabecalho = json.dumps({'journal': 1, 'geracao': os.urandom(8).hex()}).encode('utf-8') + b'\n'
+            _gravar_arquivo_atomico(jpath, cabecalho)
+            # O journal novo só tem o cabeçalho; as entradas do cache já refletem tudo
+            st = os.stat(jpath)
+            jornal = (st.st_ino, json.loads(cabecalho)['geracao'], len(cabecalho))
+            for table_name, entrada in cache['tabelas'].items():
+                if table_name in gravadas:
+                    entrada['assinatura'] = gravadas[table_name]
+                    entrada['jornal'] = jornal
+        with _json_cache_lock:
+            _jornal_contadores['compactacoes'] += 1
+        print(f"DEBUG: Journal compactado em {empresa_dir} ({len(tabelas)} tabelas, {len(registros)} registros)")
+
+_jornal_pendentes = set()
+_jornal_evento = threading.Event()
+_jornal_thread = None
+
+def _jornal_loop():
+    while True:
+        _jornal_evento.wait(JSON_JOURNAL_INTERVALO)
+        _jornal_evento.clear()
+        with _travas_empresa_lock:
+            pendentes = list(_jornal_pendentes)
+            _jornal_pendentes.clear()
+        for empresa_dir in pendentes:
+            try:
+                _jornal_compactar(empresa_dir)
+            except Exception as e:
+                print(f"Erro ao compactar journal de {empresa_dir}: {e}")
+
+def _jornal_agendar_compactacao(empresa_dir, urgente=False):
+    global _jornal_thread
+    with _travas_empresa_lock:
+        _jornal_pendentes.add(empresa_dir)
+        # Threads não sobrevivem ao fork dos workers: cria uma por processo
+        if _jornal_thread is None or not _jornal_thread.is_alive():
+            _jornal_thread = threading.Thread(target=_jornal_loop, name='compactacao-journal', daemon=True)
+            _jornal_thread.start()
+    if urgente:
+        _jornal_evento.set()
+
+def _json_read_table(db_file, table_name):
+    empresa_dir = _empresa_data_dir(db_file)
+    cache = _json_cache_empresa(empresa_dir)
+    with cache['trava']:
+        return _json_copiar_linhas(_json_tabela_atual(empresa_dir, table_name))
+
+# Índices das tabelas JSON: além do 'id', as chaves declaradas aqui ficam
+# indexadas em memória (hash chave -> posições). Cada índice é montado na
+# primeira consulta e depois mantido incrementalmente conforme o journal é
+# aplicado. Consultas por campos não declarados caem numa varredura simples.
+_JSON_INDICES = {
+    'switch_portas': ['switch_id', ('switch_id', 'numero_porta')],
+    'conexoes': ['porta_id', 'equipamento_id'],
+    'patch_panel_portas': ['patch_panel_id', ('switch_id', 'porta_switch'), 'equipamento_id'],
+    'equipamentos': ['sala_id'],
+    'conexoes_cabos': ['sala_id', 'cabo_id'],
+    'andar_switches': ['switch_id', 'andar_id'],
+}
+
+def _json_copiar_linha(entrada, row):
+    return _json_clonar(row) if entrada['aninhado'] else row.copy()
+
+def _json_indice(entrada, table_name, campo):
+    """Índice campo -> posições da entrada, ou None se o campo não for declarado."""
+    if campo not in _JSON_INDICES.get(table_name, ()):
+        return None
+    indice = entrada['indices'].get(campo)
+    if indice is None:
+        indice = {}
+        for i, r in enumerate(entrada['rows']):
+            if type(r) is dict:
+                indice.setdefault(_json_chave_indice(r, campo), []).append(i)
+        entrada['indices'][campo] = indice
+    return indice
+
+def _json_get(db_file, table_name, row_id):
+    """Linha com o id informado (cópia) ou None, sem varrer a tabela."""
+    empresa_dir = _empresa_data_dir(db_file)
+    cache = _json_cache_empresa(empresa_dir)
+    with cache['trava']:
+        entrada = _json_tabela_atual(empresa_dir, table_name)
+        i = _jornal_posicoes(entrada).get(_json_chave(row_id))
+        if i is None:
+            return None
+        return _json_copiar_linha(entrada, entrada['rows'][i])
+
+def _json_buscar(db_file, table_name, campo, valor):
+    """Linhas (cópias, na ordem da tabela) em que campo == valor.
+    campo pode ser uma tupla de campos, com valor sendo a tupla correspondente."""
+    empresa_dir = _empresa_data_dir(db_file)
+    cache = _json_cache_empresa(empresa_dir)
+    if isinstance(campo, tuple):
+        chave = tuple(_json_chave(v) for v in valor)
+    else:
+        chave = _json_chave(valor)
+    with cache['trava']:
+        entrada = _json_tabela_atual(empresa_dir, table_name)
+        rows = entrada['rows']
+        indice = _json_indice(entrada, table_name, campo)
+        if indice is None:
+            encontrados = [r for r in rows if type(r) is dict and _json_chave_indice(r, campo) == chave]
+        else:
+            encontrados = [rows[i] for i in sorted(indice.get(chave, ()))]
+        return [_json_copiar_linha(entrada, r) for r in encontrados]
+
+def _json_buscar_um(db_file, table_name, campo, valor):
+    encontrados = _json_buscar(db_file, table_name, campo, valor)
+    return encontrados[0] if encontrados else None
 
 def is_patch_panel(equipamento):
     """Verifica se um equipamento é um patch panel baseado no tipo ou nome"""
@@ -72,28 +775,593 @@ def is_patch_panel(equipamento):
     
     return any(keyword in tipo or keyword in nome for keyword in patch_panel_keywords)
 
+def _json_gravar_operacoes(db_file, geradores):
+    """Anexa ao journal, num único registro, as operações de uma ou mais tabelas.
+    geradores mapeia tabela -> função que recebe a entrada do cache (somente
+    leitura) e devolve a lista de ops. Como o registro é uma linha só, as
+    tabelas mudam juntas ou não mudam."""
+    empresa_dir = _empresa_data_dir(db_file)
+    cache = _json_cache_empresa(empresa_dir)
+    with _json_trava(empresa_dir):
+        with cache['trava']:
+            ops = []
+            for table_name, gerar_ops in geradores.items():
+                ops.extend(gerar_ops(_json_tabela_atual(empresa_dir, table_name)))
+            if not ops:
+                print(f"DEBUG: Tabelas {list(geradores)} sem alterações; nada a gravar.")
+                return
+            tamanho = _jornal_anexar(empresa_dir, {'ops': ops})
+            # Relê só o trecho novo do journal, o que também desacopla o cache
+            # dos objetos do chamador
+            for table_name in geradores:
+                _json_tabela_atual(empresa_dir, table_name)
+    print(f"DEBUG: Tabelas {list(geradores)}: {len(ops)} operação(ões) anexadas ao journal ({tamanho} bytes) em: {empresa_dir}")
+    _jornal_agendar_compactacao(empresa_dir, urgente=tamanho > JSON_JOURNAL_MAX_BYTES)
+
 def _json_write_table(db_file, table_name, rows):
-    path = _json_table_path(db_file, table_name)
-    # Debug de escrita
-    try:
-        print(f"DEBUG: Escrevendo tabela JSON '{table_name}' em: {path}")
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-    except Exception as e:
-        print(f"DEBUG: Falha ao preparar diretório para '{table_name}': {e}")
-    with open(path, 'w', encoding='utf-8') as f:
-        json.dump(rows, f, ensure_ascii=False, indent=2)
-    print(f"DEBUG: Tabela '{table_name}' escrita com {len(rows)} registros.")
+    if JSON_JOURNAL:
+        _json_gravar_operacoes(db_file, {table_name: lambda entrada: _jornal_diferenca(entrada, table_name, rows)})
+        return
+    # Sem journal: incorpora o que houver pendente e regrava o snapshot
+    empresa_dir = _empresa_data_dir(db_file)
+    cache = _json_cache_empresa(empresa_dir)
+    with _json_trava(empresa_dir):
+        _jornal_compactar(empresa_dir)
+        path, _, tamanho = _json_gravar_snapshot(empresa_dir, table_name, rows)
+        with cache['trava']:
+            cache['tabelas'].pop(table_name, None)
+    print(f"DEBUG: Tabela '{table_name}' escrita com {len(rows)} registros ({tamanho} bytes) em: {path}")
+
+def _json_atualizar_linhas(db_file, table_name, rows):
+    """Grava só as linhas informadas (inclui ou substitui pelo id), sem
+    reescrever nem reler a tabela inteira."""
+    if not JSON_JOURNAL:
+        tabela = _json_read_table(db_file, table_name)
+        pos = {_json_chave(r.get('id')): i for i, r in enumerate(tabela)}
+        for r in rows:
+            i = pos.get(_json_chave(r.get('id')))
+            if i is None:
+                tabela.append(r)
+            else:
+                tabela[i] = r
+        _json_write_table(db_file, table_name, tabela)
+        return
 
-def _json_next_id(rows):
-    max_id = 0
-    for r in rows:
+    def gerar_ops(entrada):
+        pos = _jornal_posicoes(entrada)
+        ops = []
+        for r in rows:
+            i = pos.get(_json_chave(r.get('id')))
+            if i is None:
+                ops.append({'t': table_name, 'op': 'insert', 'id': r.get('id'), 'row': r})
+            elif entrada['rows'][i] != r:
+                ops.append({'t': table_name, 'op': 'update', 'id': r.get('id'), 'row': r})
+        return ops
+    _json_gravar_operacoes(db_file, {table_name: gerar_ops})
+
+class _JsonTransacao:
+    """Transação sobre várias tabelas JSON de uma empresa.
+
+    Segura a trava da empresa (threads e workers) do início ao fim, então o
+    read-modify-write do bloco não se mistura com o de outros processos.
+    As gravações ficam em memória e, ao sair do bloco sem exceção, são
+    confirmadas num único registro do journal; com exceção, são descartadas.
+
+        with _json_transacao(db_file) as tx:
+            portas = tx.ler('switch_portas')
+            ...
+            tx.gravar('switch_portas', portas)
+    """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.empresa_dir = _empresa_data_dir(db_file)
+        self._trava = _json_trava(self.empresa_dir)
+        self._pendentes = {}
+
+    def ler(self, table_name):
+        if table_name in self._pendentes:
+            rows = self._pendentes[table_name]
+            return _json_copiar_linhas({'rows': rows, 'aninhado': _json_tem_aninhados(rows)})
+        return _json_read_table(self.db_file, table_name)
+
+    def gravar(self, table_name, rows):
+        self._pendentes[table_name] = rows
+
+    def confirmar(self):
+        pendentes, self._pendentes = self._pendentes, {}
+        if not pendentes:
+            return
+        if not JSON_JOURNAL:
+            # Sem journal cada tabela é um arquivo: a confirmação é sequencial
+            for table_name, rows in pendentes.items():
+                _json_write_table(self.db_file, table_name, rows)
+            return
+        _json_gravar_operacoes(self.db_file, {
+            table_name: (lambda entrada, t=table_name, r=rows: _jornal_diferenca(entrada, t, r))
+            for table_name, rows in pendentes.items()
+        })
+
+    def __enter__(self):
+        self._trava.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.confirmar()
+            else:
+                self._pendentes = {}
+        finally:
+            self._trava.__exit__(exc_type, exc, tb)
+        return False
+
+def _json_transacao(db_file):
+    return _JsonTransacao(db_file)
+
+# Sequências de id por tabela, persistidas em _sequencias.json no diretório da
+# empresa e atualizadas sob a trava da empresa: workers diferentes nunca
+# entregam o mesmo id. A sequência nunca fica abaixo do maior id já presente
+# na tabela, então dados importados ou editados à mão continuam seguros.
+_SEQUENCIAS_ARQUIVO = '_sequencias.json'
+
+def _json_max_id(entrada):
+    max_id = entrada.get('max_id')
+    if max_id is None:
+        max_id = 0
+        for r in entrada['rows']:
+            try:
+                rid = int(r.get('id', 0))
+                if rid > max_id:
+                    max_id = rid
+            except Exception:
+                continue
+        entrada['max_id'] = max_id
+    return max_id
+
+def _json_reservar_ids(db_file, table_name, quantidade=1):
+    """Reserva ids consecutivos para a tabela em O(1) e devolve um range."""
+    empresa_dir = _empresa_data_dir(db_file)
+    path = os.path.join(empresa_dir, _SEQUENCIAS_ARQUIVO)
+    cache = _json_cache_empresa(empresa_dir)
+    with _json_trava(empresa_dir):
         try:
-            rid = int(r.get('id', 0))
-            if rid > max_id:
-                max_id = rid
+            with open(path, 'r', encoding='utf-8') as f:
+                sequencias = json.load(f)
+            if not isinstance(sequencias, dict):
+                sequencias = {}
+        except (OSError, ValueError):
+            sequencias = {}
+        with cache['trava']:
+            maior = _json_max_id(_json_tabela_atual(empresa_dir, table_name))
+        inicio = max(int(sequencias.get(table_name) or 0), maior) + 1
+        sequencias[table_name] = inicio + quantidade - 1
+        _gravar_arquivo_atomico(path, json.dumps(sequencias, sort_keys=True).encode('utf-8'))
+    return range(inicio, inicio + quantidade)
+
+def _json_proximo_id(db_file, table_name):
+    return _json_reservar_ids(db_file, table_name, 1)[0]
+
+# Pool de conexões SQLite, uma fila por arquivo de banco (session['db']).
+# Abrir a conexão a cada requisição custa abrir o arquivo, ler o schema e
+# reconfigurar tudo; aqui as conexões já saem configuradas (WAL,
+# synchronous=NORMAL, cache, mmap, busy_timeout) e voltam ao pool no close().
+# Conexões ociosas há mais de SQLITE_POOL_OCIOSO segundos são fechadas.
+SQLITE_POOL_MAX = int(os.environ.get('SQLITE_POOL_MAX', '8'))  # ociosas por banco
+SQLITE_POOL_OCIOSO = float(os.environ.get('SQLITE_POOL_OCIOSO', '300'))
+SQLITE_CACHE_KB = int(os.environ.get('SQLITE_CACHE_KB', '16384'))
+SQLITE_MMAP_BYTES = int(os.environ.get('SQLITE_MMAP_BYTES', str(64 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+
+_sqlite_pool = {}  # db_file -> [(conexão, instante em que voltou ao pool)]
+_sqlite_pool_lock = threading.Lock()
+_sqlite_pool_pid = os.getpid()
+_sqlite_pool_herdadas = []  # conexões de antes de um fork: nunca usadas nem fechadas no filho
+_sqlite_pool_contadores = {'abertas': 0, 'reusadas': 0, 'devolvidas': 0, 'fechadas': 0, 'expiradas': 0, 'emprestadas': 0}
+
+def _sqlite_abrir(db_file):
+    conn = sqlite3.connect(db_file, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+    try:
+        conn.execute('PRAGMA journal_mode=WAL')
+    except sqlite3.OperationalError as e:
+        # Ex.: banco somente leitura ou em compartilhamento de rede
+        print(f"DEBUG: WAL indisponível para {db_file}: {e}")
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA cache_size=-{SQLITE_CACHE_KB}')
+    conn.execute(f'PRAGMA mmap_size={SQLITE_MMAP_BYTES}')
+    conn.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    if db_file not in _sqlite_migrados:
+        try:
+            _sqlite_migrar(conn, db_file)
         except Exception:
+            conn.close()
+            raise
+        _sqlite_migrados.add(db_file)
+    return conn
+
+def _sqlite_expirar(agora):
+    """Fecha as conexões ociosas há mais de SQLITE_POOL_OCIOSO (chamar com _sqlite_pool_lock)."""
+    fechar = []
+    for db_file in list(_sqlite_pool):
+        fila = _sqlite_pool[db_file]
+        vivas = [(c, t) for c, t in fila if agora - t <= SQLITE_POOL_OCIOSO]
+        fechar.extend(c for c, t in fila if agora - t > SQLITE_POOL_OCIOSO)
+        if vivas:
+            _sqlite_pool[db_file] = vivas
+        else:
+            del _sqlite_pool[db_file]
+    _sqlite_pool_contadores['expiradas'] += len(fechar)
+    return fechar
+
+class _ConexaoPool:
+    """Conexão emprestada do pool. Funciona como um sqlite3.Connection, mas
+    close() devolve a conexão ao pool em vez de fechá-la."""
+
+    def __init__(self, db_file, conn):
+        object.__setattr__(self, '_db_file', db_file)
+        object.__setattr__(self, '_conn', conn)
+
+    def __getattr__(self, nome):
+        conn = object.__getattribute__(self, '_conn')
+        if conn is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a closed database.')
+        return getattr(conn, nome)
+
+    def __setattr__(self, nome, valor):
+        # row_factory, text_factory etc. vão para a conexão real
+        setattr(self._conn, nome, valor)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._conn.__exit__(exc_type, exc, tb)
+
+    def close(self):
+        conn = object.__getattribute__(self, '_conn')
+        if conn is None:
+            return
+        object.__setattr__(self, '_conn', None)
+        _sqlite_devolver(self._db_file, conn)
+
+def _sqlite_connect(db_file):
+    """Substitui sqlite3.connect(db_file) nos handlers: empresta uma conexão do pool."""
+    global _sqlite_pool_pid
+    agora = time.monotonic()
+    conn = None
+    with _sqlite_pool_lock:
+        if _sqlite_pool_pid != os.getpid():
+            # Processo filho (fork): as conexões herdadas são do pai
+            for fila in _sqlite_pool.values():
+                _sqlite_pool_herdadas.extend(c for c, _ in fila)
+            _sqlite_pool.clear()
+            _sqlite_pool_pid = os.getpid()
+        fechar = _sqlite_expirar(agora)
+        fila = _sqlite_pool.get(db_file)
+        if fila:
+            conn = fila.pop()[0]
+            _sqlite_pool_contadores['reusadas'] += 1
+        _sqlite_pool_contadores['emprestadas'] += 1
+    for c in fechar:
+        c.close()
+    if conn is None:
+        conn = _sqlite_abrir(db_file)
+        with _sqlite_pool_lock:
+            _sqlite_pool_contadores['abertas'] += 1
+    emprestada = _ConexaoPool(db_file, conn)
+    if has_request_context():
+        # Handlers que saem por exceção antes do close() não vazam a conexão
+        g.setdefault('sqlite_emprestadas', []).append(emprestada)
+    return emprestada
+
+def _sqlite_devolver(db_file, conn):
+    try:
+        if conn.in_transaction:
+            # Mesmo comportamento de fechar sem commit: descarta a transação
+            conn.rollback()
+        conn.row_factory = None
+        conn.text_factory = str
+    except sqlite3.Error:
+        with _sqlite_pool_lock:
+            _sqlite_pool_contadores['emprestadas'] -= 1
+            _sqlite_pool_contadores['fechadas'] += 1
+        conn.close()
+        return
+    with _sqlite_pool_lock:
+        _sqlite_pool_contadores['emprestadas'] -= 1
+        fila = _sqlite_pool.setdefault(db_file, [])
+        if len(fila) < SQLITE_POOL_MAX:
+            fila.append((conn, time.monotonic()))
+            _sqlite_pool_contadores['devolvidas'] += 1
+            return
+        _sqlite_pool_contadores['fechadas'] += 1
+    conn.close()
+
+class _sqlite_conexao:
+    """Conexão do pool como gerenciador de contexto: commit ao sair sem erro,
+    rollback se houver exceção e devolução ao pool nos dois casos.
+
+        with _sqlite_conexao(db_file) as conn:
+            conn.execute('UPDATE ...')
+    """
+
+    def __init__(self, db_file):
+        self.conn = _sqlite_connect(db_file)
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+        finally:
+            self.conn.close()
+        return False
+
+def _sqlite_pool_estatisticas():
+    with _sqlite_pool_lock:
+        fechar = _sqlite_expirar(time.monotonic())
+        estatisticas = {
+            'contadores': dict(_sqlite_pool_contadores),
+            'ociosas': {db_file: len(fila) for db_file, fila in _sqlite_pool.items()},
+            'max_por_banco': SQLITE_POOL_MAX,
+            'ocioso_segundos': SQLITE_POOL_OCIOSO,
+        }
+    for c in fechar:
+        c.close()
+    return estatisticas
+
+# Migrações do schema SQLite. Cada banco de empresa guarda em PRAGMA
+# user_version a última migração aplicada; na primeira conexão de cada
+# processo as pendentes rodam numa transação BEGIN IMMEDIATE (um worker
+# migra, os outros esperam e encontram a versão já atualizada). As rotas não
+# executam DDL. Mudança de schema = nova versão no fim da lista; migração
+# já publicada não se edita. Passos podem ser SQL ou funções que recebem o cursor.
+def _migracao_andar_switches_unico(cur):
+    # Bancos antigos podem ter andar_switches sem UNIQUE (vinha da rota de IDFs);
+    # as rotas dependem do IntegrityError para o upsert
+    try:
+        cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS ux_andar_switches_andar_switch ON andar_switches (andar_id, switch_id)')
+    except sqlite3.IntegrityError:
+        print("DEBUG: andar_switches tem vínculos duplicados; criando índice sem UNIQUE")
+        cur.execute('CREATE INDEX IF NOT EXISTS ix_andar_switches_andar_switch ON andar_switches (andar_id, switch_id)')
+
+def _migracao_indice(nome, tabela, colunas):
+    """Passo que cria um índice numa tabela do schema original, que bancos
+    muito antigos podem não ter."""
+    def passo(cur):
+        cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (tabela,))
+        if cur.fetchone() is None:
+            print(f"DEBUG: Tabela {tabela} inexistente; índice {nome} não criado")
+            return
+        cur.execute(f'CREATE INDEX IF NOT EXISTS {nome} ON {tabela} ({colunas})')
+    return passo
+
+def _migracao_coluna(tabela, coluna, tipo):
+    """Passo que acrescenta uma coluna, se a tabela existir e ainda não a tiver."""
+    def passo(cur):
+        cur.execute(f'PRAGMA table_info({tabela})')
+        colunas = [linha[1] for linha in cur.fetchall()]
+        if not colunas:
+            print(f"DEBUG: Tabela {tabela} inexistente; coluna {coluna} não criada")
+        elif coluna not in colunas:
+            cur.execute(f'ALTER TABLE {tabela} ADD COLUMN {coluna} {tipo}')
+    return passo
+
+_SQLITE_MIGRACOES = [
+    (1, 'tabelas antes criadas pelas rotas', [
+        '''CREATE TABLE IF NOT EXISTS switches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome TEXT NOT NULL,
+            marca TEXT NOT NULL,
+            modelo TEXT NOT NULL,
+            data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        '''CREATE TABLE IF NOT EXISTS switch_portas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            switch_id INTEGER NOT NULL,
+            numero_porta INTEGER NOT NULL,
+            descricao TEXT,
+            status TEXT DEFAULT 'livre',
+            FOREIGN KEY (switch_id) REFERENCES switches (id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS conexoes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            porta_id INTEGER NOT NULL,
+            equipamento_id INTEGER NOT NULL,
+            data_conexao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'ativa',
+            FOREIGN KEY (porta_id) REFERENCES switch_portas (id),
+            FOREIGN KEY (equipamento_id) REFERENCES equipamentos (id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS sala_layouts (
+            sala_id INTEGER PRIMARY KEY,
+            layout_json TEXT,
+            atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        '''CREATE TABLE IF NOT EXISTS idfs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome TEXT NOT NULL,
+            andar_id INTEGER NOT NULL,
+            descricao TEXT,
+            foto TEXT,
+            status TEXT DEFAULT 'ativo',
+            data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (andar_id) REFERENCES andares (id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS idf_equipamentos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idf_id INTEGER NOT NULL,
+            equipamento_id INTEGER NOT NULL,
+            funcao TEXT,
+            posicao_rack TEXT,
+            tipo_alocacao TEXT DEFAULT 'exclusivo',
+            sala_origem_id INTEGER,
+            FOREIGN KEY (idf_id) REFERENCES idfs (id),
+            FOREIGN KEY (equipamento_id) REFERENCES equipamentos (id),
+            FOREIGN KEY (sala_origem_id) REFERENCES salas (id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS idf_sala_conexoes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idf_id INTEGER NOT NULL,
+            sala_id INTEGER NOT NULL,
+            tipo_conexao TEXT,
+            capacidade TEXT,
+            status TEXT DEFAULT 'ativo',
+            FOREIGN KEY (idf_id) REFERENCES idfs (id),
+            FOREIGN KEY (sala_id) REFERENCES salas (id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS andar_switches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            andar_id INTEGER NOT NULL,
+            switch_id INTEGER NOT NULL,
+            idf_responsavel_id INTEGER,
+            UNIQUE(andar_id, switch_id),
+            FOREIGN KEY (andar_id) REFERENCES andares (id),
+            FOREIGN KEY (switch_id) REFERENCES switches (id),
+            FOREIGN KEY (idf_responsavel_id) REFERENCES idfs (id)
+        )''',
+    ]),
+    (2, 'índices das rotas de switches, portas e IDFs', [
+        _migracao_andar_switches_unico,
+        'CREATE INDEX IF NOT EXISTS ix_andar_switches_switch ON andar_switches (switch_id)',
+        'CREATE INDEX IF NOT EXISTS ix_andar_switches_idf ON andar_switches (idf_responsavel_id)',
+        'CREATE INDEX IF NOT EXISTS ix_switch_portas_switch_numero ON switch_portas (switch_id, numero_porta)',
+        'CREATE INDEX IF NOT EXISTS ix_conexoes_porta_status ON conexoes (porta_id, status)',
+        'CREATE INDEX IF NOT EXISTS ix_idf_equipamentos_idf ON idf_equipamentos (idf_id)',
+        'CREATE INDEX IF NOT EXISTS ix_idf_sala_conexoes_idf ON idf_sala_conexoes (idf_id)',
+    ]),
+    (3, 'índices de junção e filtro das tabelas principais', [
+        _migracao_indice('ix_equipamento_dados_equip_chave', 'equipamento_dados', 'equipamento_id, chave, valor'),
+        _migracao_indice('ix_conexoes_equipamento_status', 'conexoes', 'equipamento_id, status, porta_id'),
+        _migracao_indice('ix_patch_panel_portas_switch_porta', 'patch_panel_portas', 'switch_id, porta_switch'),
+        _migracao_indice('ix_patch_panel_portas_equipamento', 'patch_panel_portas', 'equipamento_id'),
+        _migracao_indice('ix_conexoes_cabos_sala_ativa', 'conexoes_cabos', 'sala_id, data_desconexao'),
+    ]),
+    (4, 'índice da listagem paginada de ping_logs', [
+        _migracao_indice('ix_ping_logs_timestamp', 'ping_logs', 'timestamp, id'),
+    ]),
+    (5, 'latência nos logs de ping', [
+        _migracao_coluna('ping_logs', 'latencia_ms', 'REAL'),
+    ]),
+]
+SQLITE_VERSAO_SCHEMA = _SQLITE_MIGRACOES[-1][0]
+
+_sqlite_migrados = set()  # bancos já conferidos neste processo
+_sqlite_esquemas = {}  # banco auxiliar -> sua própria lista de migrações (ex.: telemetria)
+
+def _sqlite_migrar(conn, db_file):
+    """Aplica as migrações pendentes; devolve a versão final do schema."""
+    migracoes = _sqlite_esquemas.get(db_file, _SQLITE_MIGRACOES)
+    versao = conn.execute('PRAGMA user_version').fetchone()[0]
+    if versao >= migracoes[-1][0]:
+        return versao
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # Outro processo pode ter migrado enquanto esperávamos a trava
+        versao = conn.execute('PRAGMA user_version').fetchone()[0]
+        cur = conn.cursor()
+        for numero, descricao, passos in migracoes:
+            if numero <= versao:
+                continue
+            for passo in passos:
+                if callable(passo):
+                    passo(cur)
+                else:
+                    cur.execute(passo)
+            cur.execute(f'PRAGMA user_version = {numero}')
+            print(f"DEBUG: {db_file}: migração {numero} aplicada ({descricao})")
+            versao = numero
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return versao
+
+# Consultas mais frequentes das rotas e os apelidos que precisam ser lidos por
+# índice permanente (SEARCH). SCAN ou índice automático em algum deles no
+# EXPLAIN QUERY PLAN indica que um índice sumiu ou que a consulta deixou de usá-lo.
+_SQLITE_CONSULTAS_QUENTES = [
+    ('portas do switch', '''
+        SELECT sp.id, c.id, e.nome, s.nome, pp.nome, ppp.id, pe.nome, ps.nome
+        FROM switch_portas sp
+        LEFT JOIN conexoes c ON sp.id = c.porta_id AND c.status = 'ativa'
+        LEFT JOIN equipamentos e ON c.equipamento_id = e.id
+        LEFT JOIN salas s ON e.sala_id = s.id
+        LEFT JOIN patch_panel_portas ppp ON ppp.switch_id = sp.switch_id AND ppp.porta_switch = sp.numero_porta
+        LEFT JOIN patch_panels pp ON ppp.patch_panel_id = pp.id
+        LEFT JOIN equipamentos pe ON ppp.equipamento_id = pe.id
+        LEFT JOIN salas ps ON pe.sala_id = ps.id
+        WHERE sp.switch_id = ?
+        ORDER BY sp.numero_porta
+    ''', (1,), {'sp', 'c', 'e', 's', 'ppp', 'pp', 'pe', 'ps'}),
+    ('dados do equipamento', '''
+        SELECT chave, valor FROM equipamento_dados d
+        WHERE d.equipamento_id = ? AND d.chave IN ('ip1', 'ip2', 'mac1', 'mac2')
+    ''', (1,), {'d'}),
+    ('conexão ativa do equipamento', '''
+        SELECT s.nome, sp.numero_porta
+        FROM conexoes c
+        JOIN switch_portas sp ON c.porta_id = sp.id
+        JOIN switches s ON sp.switch_id = s.id
+        WHERE c.equipamento_id = ? AND c.status = 'ativa' LIMIT 1
+    ''', (1,), {'c', 'sp', 's'}),
+    ('porta de patch panel do equipamento', '''
+        SELECT ppp.id FROM patch_panel_portas ppp WHERE ppp.equipamento_id = ?
+    ''', (1,), {'ppp'}),
+    ('cabos ativos da sala', '''
+        SELECT cc.id, c.codigo_unico, eo.nome, ed.nome
+        FROM conexoes_cabos cc
+        JOIN cabos c ON cc.cabo_id = c.id
+        LEFT JOIN equipamentos eo ON cc.equipamento_origem_id = eo.id
+        LEFT JOIN equipamentos ed ON cc.equipamento_destino_id = ed.id
+        WHERE cc.sala_id = ? AND cc.data_desconexao IS NULL
+    ''', (1,), {'cc', 'c', 'eo', 'ed'}),
+]
+
+def _sqlite_verificar_planos(conn):
+    """Roda EXPLAIN QUERY PLAN nas consultas quentes. Devolve a lista de
+    (consulta, detalhe) com varreduras completas onde se esperava índice;
+    consulta que nem compila (tabela ou coluna faltando) também é problema."""
+    problemas = []
+    for nome, sql, parametros, indexados in _SQLITE_CONSULTAS_QUENTES:
+        try:
+            plano = conn.execute('EXPLAIN QUERY PLAN ' + sql, parametros).fetchall()
+        except sqlite3.OperationalError as e:
+            problemas.append((nome, f'plano não verificado: {e}'))
             continue
-    return max_id + 1
+        for linha in plano:
+            detalhe = linha[-1]
+            partes = detalhe.split()
+            # Índice automático = o SQLite montando um índice temporário a cada execução
+            if len(partes) >= 2 and partes[1] in indexados and (partes[0] == 'SCAN' or 'AUTOMATIC' in partes):
+                problemas.append((nome, detalhe))
+    return problemas
+
+_SQLITE_LOTE_IN = 500  # abaixo do limite de parâmetros das versões antigas do SQLite
+
+def _sqlite_dados_equipamentos(cur, ids, chaves=None):
+    """Atributos (equipamento_dados) de vários equipamentos em lotes de IN (...):
+    {equipamento_id: {chave: valor}}. Com chave repetida vale a última gravada,
+    como no dicionário montado linha a linha."""
+    ids = list(dict.fromkeys(i for i in ids if i is not None))
+    dados = {i: {} for i in ids}
+    filtro_chaves = ''
+    if chaves:
+        filtro_chaves = f" AND chave IN ({','.join('?' * len(chaves))})"
+    for inicio in range(0, len(ids), _SQLITE_LOTE_IN):
+        lote = ids[inicio:inicio + _SQLITE_LOTE_IN]
+        cur.execute(
+            f"SELECT equipamento_id, chave, valor FROM equipamento_dados "
+            f"WHERE equipamento_id IN ({','.join('?' * len(lote))}){filtro_chaves} ORDER BY id",
+            (*lote, *(chaves or ())))
+        for equipamento_id, chave, valor in cur.fetchall():
+            dados[equipamento_id][chave] = valor
+    return dados
 
 def get_log_file(empresa_db=None):
     """
@@ -285,6 +1553,35 @@ def tecnico_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Em modo JSON, requisições que alteram dados seguram a trava da empresa do
+# começo ao fim: o read-modify-write dos handlers fica serializado entre
+# threads e workers do gunicorn. Rotas demoradas ficam de fora e gravam por
+# conta própria (cada gravação já é atômica); as buscas em lote são POST,
+# mas só leem.
+_JSON_ROTAS_SEM_TRAVA = {'ping_equipamentos', 'buscar_lote', 'buscar_lote_varios'}
+
+@app.before_request
+def _json_travar_requisicao():
+    if request.method in ('GET', 'HEAD', 'OPTIONS') or request.endpoint in _JSON_ROTAS_SEM_TRAVA:
+        return
+    db_file = session.get('db')
+    if not _is_json_mode(db_file):
+        return
+    trava = _json_trava(_empresa_data_dir(db_file))
+    trava.__enter__()
+    g.json_trava = trava
+
+@app.teardown_request
+def _json_liberar_requisicao(exc=None):
+    trava = g.pop('json_trava', None)
+    if trava is not None:
+        trava.__exit__(None, None, None)
+
+@app.teardown_request
+def _sqlite_devolver_requisicao(exc=None):
+    for conn in g.pop('sqlite_emprestadas', []):
+        conn.close()
+
 @app.route('/painel.html')
 @login_required
 def painel_html():
@@ -405,7 +1702,7 @@ def listar_salas():
             })
         return jsonify(result)
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         cur.execute('''
             SELECT s.id, s.nome, s.tipo, s.descricao, s.foto, s.fotos, s.andar_id, a.titulo as andar
@@ -435,7 +1732,7 @@ def criar_sala():
         if nome and any((s.get('nome') or '').lower() == nome.lower() for s in salas):
             return jsonify({'status': 'erro', 'mensagem': 'Já existe uma sala com esse nome!'}), 400
 
-        sala_id = _json_next_id(salas)
+        sala_id = _json_proximo_id(db_file, 'salas')
         nova_sala = {
             'id': sala_id,
             'nome': dados.get('nome'),
@@ -457,7 +1754,7 @@ def criar_sala():
                     e['sala_id'] = sala_id
             _json_write_table(db_file, 'equipamentos', equipamentos)
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         # Verificação de nome duplicado (case-insensitive)
         nome = dados['nome']
@@ -494,21 +1791,12 @@ def get_sala(id):
     if not db_file:
         return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
     if _is_json_mode(db_file):
-        salas = _json_read_table(db_file, 'salas')
-        sala = next((s for s in salas if s.get('id') == id), None)
+        sala = _json_get(db_file, 'salas', id)
         if sala:
-            return jsonify({
-                'id': sala.get('id'),
-                'nome': sala.get('nome'),
-                'tipo': sala.get('tipo'),
-                'descricao': sala.get('descricao'),
-                'foto': sala.get('foto'),
-                'fotos': sala.get('fotos'),
-                'andar_id': sala.get('andar_id')
-            })
+            return jsonify(_sala_registro(sala))
         return jsonify({'erro': 'Sala não encontrada'}), 404
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         cur.execute('SELECT id, nome, tipo, descricao, foto, fotos, andar_id FROM salas WHERE id=?', (id,))
         row = cur.fetchone()
@@ -528,34 +1816,35 @@ def atualizar_sala(id):
     if not db_file:
         return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
     if _is_json_mode(db_file):
-        salas = _json_read_table(db_file, 'salas')
-        sala = next((s for s in salas if s.get('id') == id), None)
-        if not sala:
-            return jsonify({'status': 'erro', 'mensagem': 'Sala não encontrada'}), 404
-        sala['nome'] = dados.get('nome')
-        sala['tipo'] = dados.get('tipo')
-        sala['descricao'] = dados.get('descricao')
-        sala['foto'] = dados.get('foto')
-        sala['fotos'] = dados.get('fotos')
-        sala['andar_id'] = dados.get('andar_id')
-        _json_write_table(db_file, 'salas', salas)
-
-        equipamentos_ids = [str(x) for x in dados.get('equipamentos_ids', [])]
-        equipamentos = _json_read_table(db_file, 'equipamentos')
-        equipamentos_atuais = [e.get('id') for e in equipamentos if e.get('sala_id') == id]
-        equipamentos_desatrelados = [eq for eq in equipamentos_atuais if str(eq) not in equipamentos_ids]
-        for e in equipamentos:
-            if str(e.get('id')) in equipamentos_ids:
-                e['sala_id'] = id
-            elif e.get('sala_id') == id and str(e.get('id')) not in equipamentos_ids:
-                e['sala_id'] = None
-        _json_write_table(db_file, 'equipamentos', equipamentos)
-
-        detalhes = f"Sala atualizada: ID={id}, Nome={dados.get('nome')}, Equipamentos desatrelados={len(equipamentos_desatrelados)}, Equipamentos vinculados={len(equipamentos_ids)}"
-        registrar_log(session.get('username', 'desconhecido'), 'ATUALIZAR_SALA', detalhes, 'sucesso', db_file)
-        return jsonify({'status': 'ok'})
+        with _json_transacao(db_file) as tx:
+            salas = tx.ler('salas')
+            sala = next((s for s in salas if s.get('id') == id), None)
+            if not sala:
+                return jsonify({'status': 'erro', 'mensagem': 'Sala não encontrada'}), 404
+            sala['nome'] = dados.get('nome')
+            sala['tipo'] = dados.get('tipo')
+            sala['descricao'] = dados.get('descricao')
+            sala['foto'] = dados.get('foto')
+            sala['fotos'] = dados.get('fotos')
+            sala['andar_id'] = dados.get('andar_id')
+            tx.gravar('salas', salas)
+
+            equipamentos_ids = [str(x) for x in dados.get('equipamentos_ids', [])]
+            equipamentos = tx.ler('equipamentos')
+            equipamentos_atuais = [e.get('id') for e in equipamentos if e.get('sala_id') == id]
+            equipamentos_desatrelados = [eq for eq in equipamentos_atuais if str(eq) not in equipamentos_ids]
+            for e in equipamentos:
+                if str(e.get('id')) in equipamentos_ids:
+                    e['sala_id'] = id
+                elif e.get('sala_id') == id and str(e.get('id')) not in equipamentos_ids:
+                    e['sala_id'] = None
+            tx.gravar('equipamentos', equipamentos)
+
+            detalhes = f"Sala atualizada: ID={id}, Nome={dados.get('nome')}, Equipamentos desatrelados={len(equipamentos_desatrelados)}, Equipamentos vinculados={len(equipamentos_ids)}"
+            registrar_log(session.get('username', 'desconhecido'), 'ATUALIZAR_SALA', detalhes, 'sucesso', db_file)
+            return jsonify({'status': 'ok'})
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         
         # Busca equipamentos atualmente vinculados à sala
@@ -631,23 +1920,24 @@ def excluir_sala(id):
     if not db_file:
         return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
     if _is_json_mode(db_file):
-        salas = _json_read_table(db_file, 'salas')
-        sala = next((s for s in salas if s.get('id') == id), None)
-        nome_sala = sala.get('nome') if sala else ''
-        salas = [s for s in salas if s.get('id') != id]
-        _json_write_table(db_file, 'salas', salas)
-
-        equipamentos = _json_read_table(db_file, 'equipamentos')
-        for e in equipamentos:
-            if e.get('sala_id') == id:
-                e['sala_id'] = None
-        _json_write_table(db_file, 'equipamentos', equipamentos)
+        with _json_transacao(db_file) as tx:
+            salas = tx.ler('salas')
+            sala = next((s for s in salas if s.get('id') == id), None)
+            nome_sala = sala.get('nome') if sala else ''
+            salas = [s for s in salas if s.get('id') != id]
+            tx.gravar('salas', salas)
+
+            equipamentos = tx.ler('equipamentos')
+            for e in equipamentos:
+                if e.get('sala_id') == id:
+                    e['sala_id'] = None
+            tx.gravar('equipamentos', equipamentos)
 
-        detalhes = f"Sala excluída: ID={id}, Nome={nome_sala}"
-        registrar_log(session.get('username', 'desconhecido'), 'EXCLUIR_SALA', detalhes, 'sucesso', db_file)
-        return jsonify({'status': 'ok'})
+            detalhes = f"Sala excluída: ID={id}, Nome={nome_sala}"
+            registrar_log(session.get('username', 'desconhecido'), 'EXCLUIR_SALA', detalhes, 'sucesso', db_file)
+            return jsonify({'status': 'ok'})
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         cur.execute('SELECT nome FROM salas WHERE id=?', (id,))
         row = cur.fetchone()
@@ -713,7 +2003,7 @@ def criar_sala_com_equipamentos():
         if any((s.get('nome') or '').lower() == (nome or '').lower() for s in salas):
             return jsonify({'status': 'erro', 'mensagem': 'Já existe uma sala com esse nome!'}), 400
         # Cria a sala
-        sala_id = _json_next_id(salas)
+        sala_id = _json_proximo_id(db_file, 'salas')
         salas.append({
             'id': sala_id,
             'nome': nome,
@@ -728,13 +2018,14 @@ def criar_sala_com_equipamentos():
         
         # Cria os equipamentos
         equipamentos_data = _json_read_table(db_file, 'equipamentos')
+        ids_equipamentos = iter(_json_reservar_ids(db_file, 'equipamentos', len(equipamentos)))
         for eq in equipamentos:
             # Gera caminho da foto automaticamente
             tipo_eq = (eq.get('tipo') or '').strip().lower().replace(' ', '-').replace('ç','c').replace('ã','a').replace('á','a').replace('é','e').replace('í','i').replace('ó','o').replace('ú','u').replace('â','a').replace('ê','e').replace('ô','o').replace('õ','o').replace('ü','u').replace('ñ','n')
             marca = (eq.get('marca') or '').strip().lower().replace(' ', '-').replace('ç','c').replace('ã','a').replace('á','a').replace('é','e').replace('í','i').replace('ó','o').replace('ú','u').replace('â','a').replace('ê','e').replace('ô','o').replace('õ','o').replace('ü','u').replace('ñ','n')
             modelo = (eq.get('modelo') or '').strip().lower().replace(' ', '-').replace('ç','c').replace('ã','a').replace('á','a').replace('é','e').replace('í','i').replace('ó','o').replace('ú','u').replace('â','a').replace('ê','e').replace('ô','o').replace('õ','o').replace('ü','u').replace('ñ','n')
             caminho_foto_eq = f'img/{tipo_eq}-{marca}-{modelo}.png' if tipo_eq and marca and modelo else None
-            equipamento_id = _json_next_id(equipamentos_data)
+            equipamento_id = next(ids_equipamentos)
             equipamentos_data.append({
                 'id': equipamento_id,
                 'nome': eq.get('nome'),
@@ -750,7 +2041,7 @@ def criar_sala_com_equipamentos():
             })
         _json_write_table(db_file, 'equipamentos', equipamentos_data)
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         # Verificação de nome duplicado (case-insensitive)
         cur.execute('SELECT 1 FROM salas WHERE LOWER(nome) = LOWER(?)', (nome,))
@@ -837,7 +2128,7 @@ def criar_equipamento():
     if _is_json_mode(db_file):
         print('DEBUG: Criar equipamento em JSON mode para db:', db_file)
         equipamentos = _json_read_table(db_file, 'equipamentos')
-        equipamento_id = _json_next_id(equipamentos)
+        equipamento_id = _json_proximo_id(db_file, 'equipamentos')
         registro = {
             'id': equipamento_id,
             'nome': dados.get('nome'),
@@ -855,7 +2146,7 @@ def criar_equipamento():
         _json_write_table(db_file, 'equipamentos', equipamentos)
         print('DEBUG: Equipamento criado com ID:', equipamento_id)
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         cur.execute('''
             INSERT INTO equipamentos (nome, tipo, marca, modelo, descricao, foto, icone, sala_id)
@@ -887,6 +2178,9 @@ def criar_equipamento():
 @app.route('/equipamentos', methods=['GET'])
 @login_required
 def listar_equipamentos():
+    if request.args.get('ids') is not None:
+        # Busca por ids (?ids=1,2,3&fields=id,nome), no formato de /equipamentos/<id>
+        return _lote_resposta('equipamentos', request.args.get('ids'), request.args.get('fields'))
     sala_id = request.args.get('sala_id')
     conectaveis = request.args.get('conectaveis')
     disponiveis = request.args.get('disponiveis')
@@ -950,7 +2244,7 @@ def listar_equipamentos():
         lista = [r for r in lista if not is_patch_panel(r)]
         return jsonify(lista)
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         conn.row_factory = sqlite3.Row
         cur = conn.cursor()
         if conectaveis == '1':
@@ -1026,11 +2320,13 @@ def listar_equipamentos():
                 FROM equipamentos e
                 LEFT JOIN salas s ON e.sala_id = s.id
             ''')
+        rows = cur.fetchall()
+        # Atributos de todos os equipamentos em poucas consultas, não uma por linha
+        dados_por_equipamento = _sqlite_dados_equipamentos(cur, [row['id'] for row in rows])
         equipamentos = []
-        for row in cur.fetchall():
+        for row in rows:
             eq_id = row['id']
-            cur.execute('SELECT chave, valor FROM equipamento_dados WHERE equipamento_id=?', (eq_id,))
-            dados = {chave: valor for chave, valor in cur.fetchall()}
+            dados = dados_por_equipamento.get(eq_id, {})
             defeito_val = int(row['defeito']) if row['defeito'] is not None else 0
             equipamentos.append({
                 'id': eq_id,
@@ -1078,7 +2374,7 @@ def listar_equipamentos_disponiveis():
                 })
         return jsonify(resultado)
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         conn.row_factory = sqlite3.Row
         cur = conn.cursor()
         cur.execute('''
@@ -1099,11 +2395,13 @@ def listar_equipamentos_disponiveis():
               AND LOWER(e.nome) NOT LIKE '%patchpanel%'
               AND LOWER(e.nome) NOT LIKE '%keystone%'
         ''')
+        rows = cur.fetchall()
+        # Atributos de todos os equipamentos em poucas consultas, não uma por linha
+        dados_por_equipamento = _sqlite_dados_equipamentos(cur, [row['id'] for row in rows])
         equipamentos = []
-        for row in cur.fetchall():
+        for row in rows:
             eq_id = row['id']
-            cur.execute('SELECT chave, valor FROM equipamento_dados WHERE equipamento_id=?', (eq_id,))
-            dados = {chave: valor for chave, valor in cur.fetchall()}
+            dados = dados_por_equipamento.get(eq_id, {})
             defeito_val = int(row['defeito']) if row['defeito'] is not None else 0
             equipamentos.append({
                 'id': eq_id,
@@ -1156,7 +2454,7 @@ def atualizar_equipamento(id):
         alvo['dados'] = existentes
         _json_write_table(db_file, 'equipamentos', equipamentos)
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         cur.execute('''
             UPDATE equipamentos SET nome=?, tipo=?, marca=?, modelo=?, descricao=?, foto=?, icone=?, defeito=?
@@ -1193,24 +2491,12 @@ def get_equipamento(id):
     if not db_file:
         return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
     if _is_json_mode(db_file):
-        equipamentos = _json_read_table(db_file, 'equipamentos')
-        e = next((x for x in equipamentos if x.get('id') == id), None)
+        e = _json_get(db_file, 'equipamentos', id)
         if not e:
             return jsonify({'erro': 'Equipamento não encontrado'}), 404
-        return jsonify({
-            'id': e.get('id'),
-            'nome': e.get('nome'),
-            'tipo': e.get('tipo'),
-            'marca': e.get('marca'),
-            'modelo': e.get('modelo'),
-            'descricao': e.get('descricao'),
-            'foto': e.get('foto'),
-            'icone': e.get('icone'),
-            'sala_id': e.get('sala_id'),
-            'dados': e.get('dados') or {}
-        })
+        return jsonify(_equipamento_registro(e))
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         cur.execute('SELECT id, nome, tipo, marca, modelo, descricao, foto, icone, sala_id FROM equipamentos WHERE id=?', (id,))
         row = cur.fetchone()
@@ -1234,6 +2520,182 @@ def get_equipamento(id):
         conn.close()
         return jsonify(equipamento)
 
+# Busca em lote por id: equipamentos, salas, patch panels e cabos, no mesmo
+# formato das rotas /<recurso>/<id>. No modo JSON cada id vai direto ao índice
+# de ids da tabela; no SQLite, uma consulta por lote de IN (...).
+def _equipamento_registro(e):
+    return {
+        'id': e.get('id'),
+        'nome': e.get('nome'),
+        'tipo': e.get('tipo'),
+        'marca': e.get('marca'),
+        'modelo': e.get('modelo'),
+        'descricao': e.get('descricao'),
+        'foto': e.get('foto'),
+        'icone': e.get('icone'),
+        'sala_id': e.get('sala_id'),
+        'dados': e.get('dados') or {}
+    }
+
+def _sala_registro(sala):
+    return {
+        'id': sala.get('id'),
+        'nome': sala.get('nome'),
+        'tipo': sala.get('tipo'),
+        'descricao': sala.get('descricao'),
+        'foto': sala.get('foto'),
+        'fotos': sala.get('fotos'),
+        'andar_id': sala.get('andar_id')
+    }
+
+def _patch_panel_registro(pp):
+    porta_inicial = int(pp.get('porta_inicial') or 1)
+    num_portas = int(pp.get('num_portas') or 0)
+    return {
+        'id': pp.get('id'),
+        'codigo': pp.get('codigo'),
+        'nome': pp.get('nome'),
+        'andar': pp.get('andar'),
+        'porta_inicial': porta_inicial,
+        'num_portas': num_portas,
+        'status': pp.get('status'),
+        'descricao': pp.get('descricao'),
+        'data_criacao': pp.get('data_criacao'),
+        'porta_final': porta_inicial + num_portas - 1 if num_portas else porta_inicial
+    }
+
+def _sqlite_por_ids(cur, sql, ids):
+    """Linhas de sql (com {marcadores} no IN) para todos os ids, em lotes."""
+    rows = []
+    for inicio in range(0, len(ids), _SQLITE_LOTE_IN):
+        lote = ids[inicio:inicio + _SQLITE_LOTE_IN]
+        cur.execute(sql.format(marcadores=','.join('?' * len(lote))), lote)
+        rows.extend(cur.fetchall())
+    return rows
+
+def _equipamentos_lote_sqlite(cur, ids):
+    rows = _sqlite_por_ids(cur, 'SELECT id, nome, tipo, marca, modelo, descricao, foto, icone, sala_id '
+                                'FROM equipamentos WHERE id IN ({marcadores})', ids)
+    dados_por_equipamento = _sqlite_dados_equipamentos(cur, [row[0] for row in rows])
+    return {row[0]: dict(id=row[0], nome=row[1], tipo=row[2], marca=row[3], modelo=row[4], descricao=row[5],
+                         foto=row[6], icone=row[7], sala_id=row[8], dados=dados_por_equipamento.get(row[0], {}))
+            for row in rows}
+
+def _salas_lote_sqlite(cur, ids):
+    rows = _sqlite_por_ids(cur, 'SELECT id, nome, tipo, descricao, foto, fotos, andar_id '
+                                'FROM salas WHERE id IN ({marcadores})', ids)
+    return {row[0]: dict(id=row[0], nome=row[1], tipo=row[2], descricao=row[3], foto=row[4], fotos=row[5], andar_id=row[6])
+            for row in rows}
+
+def _patch_panels_lote_sqlite(cur, ids):
+    rows = _sqlite_por_ids(cur, 'SELECT id, codigo, nome, andar, porta_inicial, num_portas, status, descricao, data_criacao '
+                                'FROM patch_panels WHERE id IN ({marcadores})', ids)
+    return {row[0]: _patch_panel_registro(dict(zip(
+                ('id', 'codigo', 'nome', 'andar', 'porta_inicial', 'num_portas', 'status', 'descricao', 'data_criacao'), row)))
+            for row in rows}
+
+# recurso -> (formatação da linha JSON, carga em lote no SQLite ou None se o
+# recurso só existe no modo JSON)
+_LOTE_RECURSOS = {
+    'equipamentos': (_equipamento_registro, _equipamentos_lote_sqlite),
+    'salas': (_sala_registro, _salas_lote_sqlite),
+    'patch_panels': (_patch_panel_registro, _patch_panels_lote_sqlite),
+    'cabos': (dict, None),
+}
+LOTE_MAX_IDS = int(os.environ.get('LOTE_MAX_IDS', '5000'))
+
+def _lote_lista(valor):
+    """Aceita lista JSON ou texto separado por vírgulas."""
+    if valor is None:
+        return []
+    if isinstance(valor, str):
+        return [v.strip() for v in valor.split(',') if v.strip()]
+    if isinstance(valor, (list, tuple)):
+        return list(valor)
+    raise ValueError(valor)
+
+def _lote_ids(valor):
+    ids = list(dict.fromkeys(int(v) for v in _lote_lista(valor)))
+    if len(ids) > LOTE_MAX_IDS:
+        raise ValueError(f'no máximo {LOTE_MAX_IDS} ids por requisição')
+    return ids
+
+def _lote_buscar(db_file, recurso, ids, campos=None):
+    """Registros com os ids pedidos, na ordem pedida; ids inexistentes ficam de fora.
+    Com campos, cada registro traz só esses campos (e sempre o id)."""
+    formatar, carregar = _LOTE_RECURSOS[recurso]
+    if _is_json_mode(db_file):
+        # um só snapshot da tabela; copia só as linhas pedidas
+        empresa_dir = _empresa_data_dir(db_file)
+        cache = _json_cache_empresa(empresa_dir)
+        with cache['trava']:
+            entrada = _json_tabela_atual(empresa_dir, recurso)
+            pos = _jornal_posicoes(entrada)
+            linhas = {}
+            for i in ids:
+                p = pos.get(_json_chave(i))
+                if p is not None:
+                    linhas[i] = _json_copiar_linha(entrada, entrada['rows'][p])
+        registros = {i: formatar(row) for i, row in linhas.items()}
+    elif carregar is None or not ids:
+        registros = {}
+    else:
+        conn = _sqlite_connect(db_file)
+        registros = carregar(conn.cursor(), ids)
+        conn.close()
+    resultado = [registros[i] for i in ids if i in registros]
+    if campos:
+        campos = set(campos) | {'id'}
+        resultado = [{k: v for k, v in r.items() if k in campos} for r in resultado]
+    return resultado
+
+def _lote_resposta(recurso, ids, campos):
+    db_file = session.get('db')
+    if not db_file:
+        return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
+    try:
+        ids = _lote_ids(ids)
+        campos = _lote_lista(campos)
+    except (TypeError, ValueError) as e:
+        return jsonify({'status': 'erro', 'mensagem': f'ids/fields inválidos: {e}'}), 400
+    return jsonify(_lote_buscar(db_file, recurso, ids, campos))
+
+@app.route('/<any(equipamentos, salas, cabos, "patch-panels"):recurso>/batch', methods=['POST'])
+@login_required
+def buscar_lote(recurso):
+    """{"ids": [...], "fields": [...]} -> registros do recurso, na ordem dos ids."""
+    dados = request.get_json(silent=True)
+    if not isinstance(dados, dict):
+        return jsonify({'status': 'erro', 'mensagem': 'JSON ausente ou inválido'}), 400
+    return _lote_resposta(recurso.replace('-', '_'), dados.get('ids'), dados.get('fields'))
+
+@app.route('/api/batch', methods=['POST'])
+@login_required
+def buscar_lote_varios():
+    """Vários recursos numa só ida ao servidor, por exemplo
+    {"equipamentos": {"ids": [1, 2], "fields": ["id", "nome"]}, "salas": [3]}
+    -> {"equipamentos": [...], "salas": [...]}."""
+    db_file = session.get('db')
+    if not db_file:
+        return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
+    dados = request.get_json(silent=True)
+    if not isinstance(dados, dict):
+        return jsonify({'status': 'erro', 'mensagem': 'JSON ausente ou inválido'}), 400
+    resposta = {}
+    for chave, pedido in dados.items():
+        recurso = chave.replace('-', '_')
+        if recurso not in _LOTE_RECURSOS:
+            return jsonify({'status': 'erro', 'mensagem': f'Recurso desconhecido: {chave}'}), 400
+        if not isinstance(pedido, dict):
+            pedido = {'ids': pedido}
+        try:
+            ids = _lote_ids(pedido.get('ids'))
+            campos = _lote_lista(pedido.get('fields'))
+        except (TypeError, ValueError) as e:
+            return jsonify({'status': 'erro', 'mensagem': f'{chave}: ids/fields inválidos: {e}'}), 400
+        resposta[chave] = _lote_buscar(db_file, recurso, ids, campos)
+    return jsonify(resposta)
+
 @app.route('/equipamentos/<int:id>', methods=['DELETE'])
 @admin_required
 def excluir_equipamento(id):
@@ -1250,7 +2712,7 @@ def excluir_equipamento(id):
         equipamentos = [e for e in equipamentos if e.get('id') != id]
         _json_write_table(db_file, 'equipamentos', equipamentos)
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         cur.execute('SELECT nome, tipo, marca, modelo FROM equipamentos WHERE id=?', (id,))
         row = cur.fetchone()
@@ -1288,7 +2750,7 @@ def tipos_equipamento():
         
         return jsonify(tipos)
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         cur.execute('SELECT DISTINCT tipo FROM equipamentos WHERE tipo IS NOT NULL AND tipo != ""')
         tipos = [row[0] for row in cur.fetchall()]
@@ -1307,7 +2769,7 @@ def marcas_equipamento():
         marcas = sorted({(e.get('marca') or '') for e in equipamentos if (e.get('tipo') or '') == (tipo or '') and (e.get('marca') or '') != ''})
         return jsonify(list(marcas))
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         cur.execute('SELECT DISTINCT marca FROM equipamentos WHERE tipo=? AND marca IS NOT NULL AND marca != ""', (tipo,))
         marcas = [row[0] for row in cur.fetchall()]
@@ -1327,7 +2789,7 @@ def modelos_equipamento():
         modelos = sorted({(e.get('modelo') or '') for e in equipamentos if (e.get('tipo') or '') == (tipo or '') and (e.get('marca') or '') == (marca or '') and (e.get('modelo') or '') != ''})
         return jsonify(list(modelos))
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         cur.execute('SELECT DISTINCT modelo FROM equipamentos WHERE tipo=? AND marca=? AND modelo IS NOT NULL AND modelo != ""', (tipo, marca))
         modelos = [row[0] for row in cur.fetchall()]
@@ -1364,82 +2826,61 @@ def criar_switch():
     if not db_file:
         return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
     if _is_json_mode(db_file):
-        switches = _json_read_table(db_file, 'switches')
-        switch_id = _json_next_id(switches)
-        registro = {
-            'id': switch_id,
-            'nome': dados.get('nome'),
-            'marca': dados.get('marca'),
-            'modelo': dados.get('modelo'),
-            'data_criacao': datetime.now().isoformat()
-        }
-        switches.append(registro)
-        _json_write_table(db_file, 'switches', switches)
-
-        # criar portas padrão
-        modelo = (dados.get('modelo') or '').lower()
-        # Sempre criar 48 portas para novos switches
-        num_portas = 48
-        portas = _json_read_table(db_file, 'switch_portas')
-        for porta_num in range(1, num_portas + 1):
-            descricao = f"Porta {porta_num}"
-            if porta_num <= 4:
-                descricao += " (Uplink/Gerenciamento)"
-            elif porta_num <= 8:
-                descricao += " (PoE)"
-            else:
-                descricao += " (Acesso)"
-            portas.append({
-                'id': _json_next_id(portas),
-                'switch_id': switch_id,
-                'numero_porta': porta_num,
-                'descricao': descricao,
-                'status': 'livre'
-            })
-        _json_write_table(db_file, 'switch_portas', portas)
-
-        # vínculo opcional com andar/idf
-        andar_id = dados.get('andar_id')
-        idf_responsavel_id = dados.get('idf_responsavel_id')
-        if andar_id is not None and str(andar_id) != '':
-            andar_switches = _json_read_table(db_file, 'andar_switches')
-            # remove duplicados do mesmo switch
-            andar_switches = [x for x in andar_switches if x.get('switch_id') != switch_id]
-            andar_switches.append({
-                'id': _json_next_id(andar_switches),
-                'andar_id': andar_id,
-                'switch_id': switch_id,
-                'idf_responsavel_id': idf_responsavel_id
-            })
-            _json_write_table(db_file, 'andar_switches', andar_switches)
-        num_portas = num_portas
+        with _json_transacao(db_file) as tx:
+            switches = tx.ler('switches')
+            switch_id = _json_proximo_id(db_file, 'switches')
+            registro = {
+                'id': switch_id,
+                'nome': dados.get('nome'),
+                'marca': dados.get('marca'),
+                'modelo': dados.get('modelo'),
+                'data_criacao': datetime.now().isoformat()
+            }
+            switches.append(registro)
+            tx.gravar('switches', switches)
+
+            # criar portas padrão
+            modelo = (dados.get('modelo') or '').lower()
+            # Sempre criar 48 portas para novos switches
+            num_portas = 48
+            portas = tx.ler('switch_portas')
+            ids_portas = iter(_json_reservar_ids(db_file, 'switch_portas', num_portas))
+            for porta_num in range(1, num_portas + 1):
+                descricao = f"Porta {porta_num}"
+                if porta_num <= 4:
+                    descricao += " (Uplink/Gerenciamento)"
+                elif porta_num <= 8:
+                    descricao += " (PoE)"
+                else:
+                    descricao += " (Acesso)"
+                portas.append({
+                    'id': next(ids_portas),
+                    'switch_id': switch_id,
+                    'numero_porta': porta_num,
+                    'descricao': descricao,
+                    'status': 'livre'
+                })
+            tx.gravar('switch_portas', portas)
+
+            # vínculo opcional com andar/idf
+            andar_id = dados.get('andar_id')
+            idf_responsavel_id = dados.get('idf_responsavel_id')
+            if andar_id is not None and str(andar_id) != '':
+                andar_switches = tx.ler('andar_switches')
+                # remove duplicados do mesmo switch
+                andar_switches = [x for x in andar_switches if x.get('switch_id') != switch_id]
+                andar_switches.append({
+                    'id': _json_proximo_id(db_file, 'andar_switches'),
+                    'andar_id': andar_id,
+                    'switch_id': switch_id,
+                    'idf_responsavel_id': idf_responsavel_id
+                })
+                tx.gravar('andar_switches', andar_switches)
+            num_portas = num_portas
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         
-        # Criar tabela de switches se não existir
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS switches (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                nome TEXT NOT NULL,
-                marca TEXT NOT NULL,
-                modelo TEXT NOT NULL,
-                data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Criar tabela de portas de switches se não existir
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS switch_portas (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                switch_id INTEGER NOT NULL,
-                numero_porta INTEGER NOT NULL,
-                descricao TEXT,
-                status TEXT DEFAULT 'livre',
-                FOREIGN KEY (switch_id) REFERENCES switches (id)
-            )
-        ''')
-        
         cur.execute('''
             INSERT INTO switches (nome, marca, modelo)
             VALUES (?, ?, ?)
@@ -1471,16 +2912,6 @@ def criar_switch():
         andar_id = dados.get('andar_id')
         idf_responsavel_id = dados.get('idf_responsavel_id')
         if andar_id is not None and str(andar_id) != '':
-            # Garantir tabela
-            cur.execute('''
-                CREATE TABLE IF NOT EXISTS andar_switches (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    andar_id INTEGER NOT NULL,
-                    switch_id INTEGER NOT NULL,
-                    idf_responsavel_id INTEGER,
-                    UNIQUE(andar_id, switch_id)
-                )
-            ''')
             try:
                 cur.execute('''
                     INSERT INTO andar_switches (andar_id, switch_id, idf_responsavel_id)
@@ -1509,11 +2940,10 @@ def listar_switches():
         return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
     if _is_json_mode(db_file):
         switches = _json_read_table(db_file, 'switches')
-        andar_links = _json_read_table(db_file, 'andar_switches')
         idfs = {i.get('id'): i for i in _json_read_table(db_file, 'idfs')}
         resultado = []
         for s in switches:
-            link = next((l for l in andar_links if l.get('switch_id') == s.get('id')), None)
+            link = _json_buscar_um(db_file, 'andar_switches', 'switch_id', s.get('id'))
             andar_id = link.get('andar_id') if link else None
             idf_responsavel_id = link.get('idf_responsavel_id') if link else None
             if andar_id == 0:
@@ -1537,20 +2967,9 @@ def listar_switches():
         resultado.sort(key=lambda x: x.get('data_criacao') or '', reverse=True)
         return jsonify(resultado)
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         
-        # Verificar se a tabela switches existe, se não, criar
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS switches (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                nome TEXT NOT NULL,
-                marca TEXT NOT NULL,
-                modelo TEXT NOT NULL,
-                data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
         cur.execute('''
             SELECT s.id, s.nome, s.marca, s.modelo, s.data_criacao,
                    asw.andar_id, asw.idf_responsavel_id,
@@ -1617,7 +3036,7 @@ def get_switch(id):
         }
         return jsonify(retorno)
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         
         cur.execute('''
@@ -1683,14 +3102,14 @@ def atualizar_switch(id):
         links = [l for l in links if l.get('switch_id') != id]
         if andar_id is not None and str(andar_id) != '':
             links.append({
-                'id': _json_next_id(links),
+                'id': _json_proximo_id(db_file, 'andar_switches'),
                 'andar_id': andar_id,
                 'switch_id': id,
                 'idf_responsavel_id': idf_responsavel_id
             })
         _json_write_table(db_file, 'andar_switches', links)
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         
         # Verificar se o switch existe
@@ -1715,17 +3134,6 @@ def atualizar_switch(id):
         andar_id = dados.get('andar_id')
         idf_responsavel_id = dados.get('idf_responsavel_id')
         
-        # Garantir que a tabela andar_switches existe
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS andar_switches (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                andar_id INTEGER NOT NULL,
-                switch_id INTEGER NOT NULL,
-                idf_responsavel_id INTEGER,
-                UNIQUE(andar_id, switch_id)
-            )
-        ''')
-        
         # Remover vínculos existentes
         cur.execute('DELETE FROM andar_switches WHERE switch_id = ?', (id,))
         
@@ -1776,7 +3184,7 @@ def criar_porta_switch():
         if any(p.get('switch_id') == dados.get('switch_id') and int(p.get('numero_porta')) == int(dados.get('numero_porta')) for p in portas):
             return jsonify({'status': 'erro', 'mensagem': 'Porta já existe para este switch'}), 400
         porta = {
-            'id': _json_next_id(portas),
+            'id': _json_proximo_id(db_file, 'switch_portas'),
             'switch_id': dados.get('switch_id'),
             'numero_porta': dados.get('numero_porta'),
             'descricao': dados.get('descricao', ''),
@@ -1786,21 +3194,9 @@ def criar_porta_switch():
         _json_write_table(db_file, 'switch_portas', portas)
         return jsonify({'status': 'ok', 'id': porta['id']})
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         
-        # Criar tabela de portas se não existir
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS switch_portas (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                switch_id INTEGER NOT NULL,
-                numero_porta INTEGER NOT NULL,
-                descricao TEXT,
-                status TEXT DEFAULT 'livre',
-                FOREIGN KEY (switch_id) REFERENCES switches (id)
-            )
-        ''')
-        
         # Verificar se a porta já existe para este switch
         cur.execute('SELECT id FROM switch_portas WHERE switch_id=? AND numero_porta=?', 
                     (dados['switch_id'], dados['numero_porta']))
@@ -1844,6 +3240,7 @@ def criar_portas_padrao_switch(switch_id):
         modelo = (s.get('modelo') or '').lower()
         # Sempre criar 48 portas para switches sem portas
         num_portas = 48
+        ids_portas = iter(_json_reservar_ids(db_file, 'switch_portas', num_portas))
         for porta_num in range(1, num_portas + 1):
             descricao = f"Porta {porta_num}"
             if porta_num <= 4:
@@ -1853,7 +3250,7 @@ def criar_portas_padrao_switch(switch_id):
             else:
                 descricao += " (Acesso)"
             portas.append({
-                'id': _json_next_id(portas),
+                'id': next(ids_portas),
                 'switch_id': switch_id,
                 'numero_porta': porta_num,
                 'descricao': descricao,
@@ -1864,7 +3261,7 @@ def criar_portas_padrao_switch(switch_id):
         registrar_log(session.get('username', 'desconhecido'), 'CRIAR_PORTAS_PADRAO_SWITCH', detalhes, 'sucesso', db_file)
         return jsonify({'status': 'ok', 'portas_criadas': num_portas, 'mensagem': f'{num_portas} portas criadas com sucesso para o switch {s.get("nome")}'})
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         
         # Verificar se o switch existe
@@ -1922,51 +3319,53 @@ def recriar_portas_switch(switch_id):
         return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
     
     if _is_json_mode(db_file):
-        switches = _json_read_table(db_file, 'switches')
-        s = next((x for x in switches if x.get('id') == switch_id), None)
-        if not s:
-            return jsonify({'status': 'erro', 'mensagem': 'Switch não encontrado'}), 404
-        numero_portas = dados.get('numero_portas', 24)
-        if numero_portas < 1 or numero_portas > 100:
-            return jsonify({'status': 'erro', 'mensagem': 'Número de portas deve estar entre 1 e 100'}), 400
-        portas = _json_read_table(db_file, 'switch_portas')
-        # remover portas existentes
-        portas = [p for p in portas if p.get('switch_id') != switch_id]
-        _json_write_table(db_file, 'switch_portas', portas)
-        # remover mapeamentos de patch panel
-        ppp = _json_read_table(db_file, 'patch_panel_portas')
-        ppp = [m for m in ppp if m.get('switch_id') != switch_id]
-        _json_write_table(db_file, 'patch_panel_portas', ppp)
-        # remover conexões das portas deste switch
-        conexoes = _json_read_table(db_file, 'conexoes')
-        # precisamos conhecer as portas antigas; já removidas, então nenhuma ativa. Garantimos limpando conexoes por switch_id não trivial, então mantemos apenas conexoes que não referem esse switch
-        # Como conexoes referem porta_id, vamos simplesmente descartar conexões cujas porta_id não existam mais (todas desse switch)
-        portas_ids_restantes = {p.get('id') for p in portas}
-        conexoes = [c for c in conexoes if c.get('porta_id') in portas_ids_restantes]
-        _json_write_table(db_file, 'conexoes', conexoes)
-        # criar novas portas
-        portas = _json_read_table(db_file, 'switch_portas')
-        for porta_num in range(1, numero_portas + 1):
-            descricao = f"Porta {porta_num}"
-            if porta_num <= 4:
-                descricao += " (Uplink/Gerenciamento)"
-            elif porta_num <= 8:
-                descricao += " (PoE)"
-            else:
-                descricao += " (Acesso)"
-            portas.append({
-                'id': _json_next_id(portas),
-                'switch_id': switch_id,
-                'numero_porta': porta_num,
-                'descricao': descricao,
-                'status': 'livre'
-            })
-        _json_write_table(db_file, 'switch_portas', portas)
-        detalhes = f"Portas recriadas para switch ID={switch_id}, Nome={s.get('nome')}, Portas criadas: {numero_portas}"
-        registrar_log(session.get('username', 'desconhecido'), 'RECRIAR_PORTAS_SWITCH', detalhes, 'sucesso', db_file)
-        return jsonify({'status': 'ok', 'portas_criadas': numero_portas, 'mensagem': f'{numero_portas} portas recriadas com sucesso para o switch {s.get("nome")}'})
+        with _json_transacao(db_file) as tx:
+            switches = tx.ler('switches')
+            s = next((x for x in switches if x.get('id') == switch_id), None)
+            if not s:
+                return jsonify({'status': 'erro', 'mensagem': 'Switch não encontrado'}), 404
+            numero_portas = dados.get('numero_portas', 24)
+            if numero_portas < 1 or numero_portas > 100:
+                return jsonify({'status': 'erro', 'mensagem': 'Número de portas deve estar entre 1 e 100'}), 400
+            portas = tx.ler('switch_portas')
+            # remover portas existentes
+            portas = [p for p in portas if p.get('switch_id') != switch_id]
+            tx.gravar('switch_portas', portas)
+            # remover mapeamentos de patch panel
+            ppp = tx.ler('patch_panel_portas')
+            ppp = [m for m in ppp if m.get('switch_id') != switch_id]
+            tx.gravar('patch_panel_portas', ppp)
+            # remover conexões das portas deste switch
+            conexoes = tx.ler('conexoes')
+            # precisamos conhecer as portas antigas; já removidas, então nenhuma ativa. Garantimos limpando conexoes por switch_id não trivial, então mantemos apenas conexoes que não referem esse switch
+            # Como conexoes referem porta_id, vamos simplesmente descartar conexões cujas porta_id não existam mais (todas desse switch)
+            portas_ids_restantes = {p.get('id') for p in portas}
+            conexoes = [c for c in conexoes if c.get('porta_id') in portas_ids_restantes]
+            tx.gravar('conexoes', conexoes)
+            # criar novas portas
+            portas = tx.ler('switch_portas')
+            ids_portas = iter(_json_reservar_ids(db_file, 'switch_portas', numero_portas))
+            for porta_num in range(1, numero_portas + 1):
+                descricao = f"Porta {porta_num}"
+                if porta_num <= 4:
+                    descricao += " (Uplink/Gerenciamento)"
+                elif porta_num <= 8:
+                    descricao += " (PoE)"
+                else:
+                    descricao += " (Acesso)"
+                portas.append({
+                    'id': next(ids_portas),
+                    'switch_id': switch_id,
+                    'numero_porta': porta_num,
+                    'descricao': descricao,
+                    'status': 'livre'
+                })
+            tx.gravar('switch_portas', portas)
+            detalhes = f"Portas recriadas para switch ID={switch_id}, Nome={s.get('nome')}, Portas criadas: {numero_portas}"
+            registrar_log(session.get('username', 'desconhecido'), 'RECRIAR_PORTAS_SWITCH', detalhes, 'sucesso', db_file)
+            return jsonify({'status': 'ok', 'portas_criadas': numero_portas, 'mensagem': f'{numero_portas} portas recriadas com sucesso para o switch {s.get("nome")}'})
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         
         try:
@@ -2054,6 +3453,7 @@ def adicionar_portas_switch(switch_id):
         existentes = [p for p in portas if p.get('switch_id') == switch_id]
         max_porta = max([p.get('numero_porta') for p in existentes], default=0)
         portas_criadas = 0
+        ids_portas = iter(_json_reservar_ids(db_file, 'switch_portas', numero_portas))
         for i in range(1, numero_portas + 1):
             porta_num = max_porta + i
             descricao = f"Porta {porta_num}"
@@ -2064,7 +3464,7 @@ def adicionar_portas_switch(switch_id):
             else:
                 descricao += " (Acesso)"
             portas.append({
-                'id': _json_next_id(portas),
+                'id': next(ids_portas),
                 'switch_id': switch_id,
                 'numero_porta': porta_num,
                 'descricao': descricao,
@@ -2076,7 +3476,7 @@ def adicionar_portas_switch(switch_id):
         registrar_log(session.get('username', 'desconhecido'), 'ADICIONAR_PORTAS_SWITCH', detalhes, 'sucesso', db_file)
         return jsonify({'status': 'ok', 'portas_adicionadas': portas_criadas, 'mensagem': f'{portas_criadas} portas adicionadas com sucesso ao switch {s.get("nome")}'})
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         
         try:
@@ -2135,20 +3535,28 @@ def adicionar_portas_switch(switch_id):
         finally:
             conn.close()
 
-@app.route('/switch-portas/<int:switch_id>', methods=['GET'])
-@login_required
-def listar_portas_switch(switch_id):
-    db_file = session.get('db')
-    if not db_file:
-        return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
-    if _is_json_mode(db_file):
-        portas = [p for p in _json_read_table(db_file, 'switch_portas') if p.get('switch_id') == switch_id]
+def _switch_portas_json(db_file, switch_ids):
+    """Gera (switch_id, portas) para cada switch pedido, lendo cada tabela uma vez."""
+    pedidos = set(switch_ids)
+    portas_por_switch = {}
+    for p in _json_read_table(db_file, 'switch_portas'):
+        if p.get('switch_id') in pedidos:
+            portas_por_switch.setdefault(p.get('switch_id'), []).append(p)
+    # Vale a primeira conexão ativa / o primeiro mapeamento de cada porta, na ordem da tabela
+    conexao_da_porta = {}
+    for c in _json_read_table(db_file, 'conexoes'):
+        if c.get('status') == 'ativa':
+            conexao_da_porta.setdefault(c.get('porta_id'), c)
+    mapeamento_da_porta = {}
+    for m in _json_read_table(db_file, 'patch_panel_portas'):
+        if m.get('switch_id') in pedidos:
+            mapeamento_da_porta.setdefault((m.get('switch_id'), int(m.get('porta_switch') or 0)), m)
+    equipamentos = {e.get('id'): e for e in _json_read_table(db_file, 'equipamentos')}
+    salas = {s.get('id'): s for s in _json_read_table(db_file, 'salas')}
+    patch_panels = {p.get('id'): p for p in _json_read_table(db_file, 'patch_panels')}
+    for switch_id in switch_ids:
+        portas = portas_por_switch.get(switch_id, [])
         portas.sort(key=lambda x: int(x.get('numero_porta') or 0))
-        conexoes = [c for c in _json_read_table(db_file, 'conexoes') if c.get('status') == 'ativa']
-        equipamentos = {e.get('id'): e for e in _json_read_table(db_file, 'equipamentos')}
-        salas = {s.get('id'): s for s in _json_read_table(db_file, 'salas')}
-        ppp = [m for m in _json_read_table(db_file, 'patch_panel_portas') if m.get('switch_id') == switch_id]
-        patch_panels = {p.get('id'): p for p in _json_read_table(db_file, 'patch_panels')}
         resposta = []
         for p in portas:
             porta_id = p.get('id')
@@ -2157,7 +3565,7 @@ def listar_portas_switch(switch_id):
             status = 'livre'
             equipamento_info = None
             patch_panel_info = None
-            cx = next((c for c in conexoes if c.get('porta_id') == porta_id), None)
+            cx = conexao_da_porta.get(porta_id)
             if cx:
                 status = 'ocupada'
                 eq = equipamentos.get(cx.get('equipamento_id'))
@@ -2173,7 +3581,7 @@ def listar_portas_switch(switch_id):
                         'mac1': (dados.get('mac1') or ''),
                         'mac2': (dados.get('mac2') or '')
                     }
-            mapeamento = next((m for m in ppp if int(m.get('porta_switch') or 0) == int(numero_porta)), None)
+            mapeamento = mapeamento_da_porta.get((switch_id, int(numero_porta or 0)))
             if mapeamento:
                 status = 'ocupada'
                 pp = patch_panels.get(mapeamento.get('patch_panel_id'))
@@ -2209,120 +3617,166 @@ def listar_portas_switch(switch_id):
                 'equipamento_info': equipamento_info,
                 'patch_panel_info': patch_panel_info
             })
-        return jsonify(resposta)
-    else:
-        conn = sqlite3.connect(db_file)
-        cur = conn.cursor()
-        
-        # Criar tabela se não existir
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS switch_portas (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                switch_id INTEGER NOT NULL,
-                numero_porta INTEGER NOT NULL,
-                descricao TEXT,
-                status TEXT DEFAULT 'livre',
-                FOREIGN KEY (switch_id) REFERENCES switches (id)
-            )
-        ''')
-        
-        cur.execute('''
-            SELECT sp.id, sp.numero_porta, sp.descricao, 
-                   CASE 
-                       WHEN c.id IS NOT NULL THEN 'ocupada'
-                       WHEN ppp.equipamento_id IS NOT NULL THEN 'ocupada'
-                       ELSE 'livre' 
-                   END as status,
-                   e.nome as equipamento_nome, e.tipo as equipamento_tipo, s.nome as sala_nome,
-                   pp.nome as patch_panel_nome, ppp.numero_porta as porta_patch_panel, ppp.id as patch_panel_porta_id,
-                   ppp.equipamento_id as patch_panel_equipamento_id
-            FROM switch_portas sp
-            LEFT JOIN conexoes c ON sp.id = c.porta_id AND c.status = 'ativa'
-            LEFT JOIN equipamentos e ON c.equipamento_id = e.id
-            LEFT JOIN salas s ON e.sala_id = s.id
-            LEFT JOIN patch_panel_portas ppp ON ppp.switch_id = sp.switch_id AND ppp.porta_switch = sp.numero_porta
-            LEFT JOIN patch_panels pp ON ppp.patch_panel_id = pp.id
-            WHERE sp.switch_id = ?
-            ORDER BY sp.numero_porta
-        ''', (switch_id,))
-        
-        portas = []
-        for row in cur.fetchall():
-            equipamento_info = None
-            patch_panel_info = None
-            
-            if row[4]:  # Equipamento conectado diretamente
-                # Buscar dados extras do equipamento
-                cur.execute("SELECT id FROM equipamentos WHERE nome=? AND tipo= ?", (row[4], row[5]))
-                eq_row = cur.fetchone()
-                eq_id = eq_row[0] if eq_row else None
-                dados = {}
-                if eq_id:
-                    cur.execute("SELECT chave, valor FROM equipamento_dados WHERE equipamento_id=? AND chave IN ('ip1','ip2','mac1','mac2')", (eq_id,))
-                    dados = {chave: valor for chave, valor in cur.fetchall()}
-                equipamento_info = {
-                    'nome': row[4],
-                    'tipo': row[5],
-                    'sala_nome': row[6],
-                    'ip1': dados.get('ip1',''),
-                    'ip2': dados.get('ip2',''),
-                    'mac1': dados.get('mac1',''),
-                    'mac2': dados.get('mac2','')
-                }
+        yield switch_id, resposta
+
+def _switch_portas_sqlite(db_file, switch_ids):
+    """Gera (switch_id, portas) para cada switch pedido, em lotes de IN (...)."""
+    conn = _sqlite_connect(db_file)
+    cur = conn.cursor()
+    try:
+        for inicio in range(0, len(switch_ids), _SQLITE_LOTE_IN):
+            lote = switch_ids[inicio:inicio + _SQLITE_LOTE_IN]
+            # Uma consulta traz porta, conexão, patch panel e os dois equipamentos;
+            # os IPs/MACs vêm numa segunda, em lote. Custo constante por lote de switches.
+            cur.execute(f'''
+                SELECT sp.id, sp.numero_porta, sp.descricao, 
+                       CASE 
+                           WHEN c.id IS NOT NULL THEN 'ocupada'
+                           WHEN ppp.equipamento_id IS NOT NULL THEN 'ocupada'
+                           ELSE 'livre' 
+                       END as status,
+                       e.nome as equipamento_nome, e.tipo as equipamento_tipo, s.nome as sala_nome,
+                       pp.nome as patch_panel_nome, ppp.numero_porta as porta_patch_panel, ppp.id as patch_panel_porta_id,
+                       ppp.equipamento_id as patch_panel_equipamento_id,
+                       e.id as equipamento_id, pp.prefixo_keystone, pp.andar,
+                       pe.nome as patch_equipamento_nome, pe.tipo as patch_equipamento_tipo, ps.nome as patch_sala_nome,
+                       sp.switch_id
+                FROM switch_portas sp
+                LEFT JOIN conexoes c ON sp.id = c.porta_id AND c.status = 'ativa'
+                LEFT JOIN equipamentos e ON c.equipamento_id = e.id
+                LEFT JOIN salas s ON e.sala_id = s.id
+                LEFT JOIN patch_panel_portas ppp ON ppp.switch_id = sp.switch_id AND ppp.porta_switch = sp.numero_porta
+                LEFT JOIN patch_panels pp ON ppp.patch_panel_id = pp.id
+                LEFT JOIN equipamentos pe ON ppp.equipamento_id = pe.id
+                LEFT JOIN salas ps ON pe.sala_id = ps.id
+                WHERE sp.switch_id IN ({','.join('?' * len(lote))})
+                ORDER BY sp.switch_id, sp.numero_porta
+            ''', lote)
+            rows = cur.fetchall()
+            dados_por_equipamento = _sqlite_dados_equipamentos(
+                cur, [row[11] for row in rows] + [row[10] for row in rows], chaves=('ip1', 'ip2', 'mac1', 'mac2'))
             
-            if row[7]:  # Patch panel mapeado
-                # Gerar keystone usando o prefixo personalizado
-                cur.execute("SELECT prefixo_keystone, andar FROM patch_panels WHERE nome = ?", (row[7],))
-                prefixo_result = cur.fetchone()
-                prefixo = prefixo_result[0] if prefixo_result and prefixo_result[0] else f"PT{20 + (prefixo_result[1] if prefixo_result else 0)}"
-                keystone = f"{prefixo}-{row[8]:04d}"
+            portas_por_switch = {}
+            for row in rows:
+                equipamento_info = None
+                patch_panel_info = None
                 
-                # Buscar equipamento conectado no patch panel
-                equipamento_patch = None
-                if row[10]:  # Se há equipamento_id no patch panel
-                    cur.execute("""
-                        SELECT e.nome, e.tipo, sal.nome as sala_nome, e.id
-                        FROM equipamentos e
-                        LEFT JOIN salas sal ON e.sala_id = sal.id
-                        WHERE e.id = ?
-                    """, (row[10],))
+                if row[4]:  # Equipamento conectado diretamente
+                    dados = dados_por_equipamento.get(row[11], {})
+                    equipamento_info = {
+                        'nome': row[4],
+                        'tipo': row[5],
+                        'sala_nome': row[6],
+                        'ip1': dados.get('ip1',''),
+                        'ip2': dados.get('ip2',''),
+                        'mac1': dados.get('mac1',''),
+                        'mac2': dados.get('mac2','')
+                    }
+                
+                if row[7]:  # Patch panel mapeado
+                    # Gerar keystone usando o prefixo personalizado
+                    prefixo = row[12] or f"PT{20 + (row[13] or 0)}"
+                    keystone = f"{prefixo}-{row[8]:04d}"
                     
-                    equip_result = cur.fetchone()
-                    if equip_result and equip_result[0]:
-                        # Buscar dados extras do equipamento (IP, MAC)
-                        dados = {}
-                        cur.execute("SELECT chave, valor FROM equipamento_dados WHERE equipamento_id=? AND chave IN ('ip1','ip2','mac1','mac2')", (equip_result[3],))
-                        dados = {chave: valor for chave, valor in cur.fetchall()}
-                        
+                    # Equipamento conectado no patch panel
+                    equipamento_patch = None
+                    if row[10] and row[14]:
+                        dados = dados_por_equipamento.get(row[10], {})
                         equipamento_patch = {
-                            'nome': equip_result[0],
-                            'tipo': equip_result[1],
-                            'sala': equip_result[2],
+                            'nome': row[14],
+                            'tipo': row[15],
+                            'sala': row[16],
                             'ip1': dados.get('ip1',''),
                             'ip2': dados.get('ip2',''),
                             'mac1': dados.get('mac1',''),
                             'mac2': dados.get('mac2','')
                         }
+                    
+                    patch_panel_info = {
+                        'nome': row[7],
+                        'porta_patch_panel': row[8],
+                        'keystone': keystone,
+                        'equipamento': equipamento_patch
+                    }
                 
-                patch_panel_info = {
-                    'nome': row[7],
-                    'porta_patch_panel': row[8],
-                    'keystone': keystone,
-                    'equipamento': equipamento_patch
+                porta = {
+                    'id': row[0],
+                    'numero_porta': row[1],
+                    'descricao': row[2],
+                    'status': row[3],
+                    'equipamento_info': equipamento_info,
+                    'patch_panel_info': patch_panel_info
                 }
-            
-            porta = {
-                'id': row[0],
-                'numero_porta': row[1],
-                'descricao': row[2],
-                'status': row[3],
-                'equipamento_info': equipamento_info,
-                'patch_panel_info': patch_panel_info
-            }
-            portas.append(porta)
-        
+                portas_por_switch.setdefault(row[17], []).append(porta)
+            for switch_id in lote:
+                yield switch_id, portas_por_switch.get(switch_id, [])
+    finally:
         conn.close()
-        return jsonify(portas)
+
+def _switch_portas(db_file, switch_ids):
+    if _is_json_mode(db_file):
+        return _switch_portas_json(db_file, switch_ids)
+    return _switch_portas_sqlite(db_file, switch_ids)
+
+@app.route('/switch-portas', methods=['GET'])
+@login_required
+def listar_portas_switches():
+    """Portas de vários switches (?switch_ids=1,2,3 ou ?all=1) numa única
+    passada, agrupadas por switch: {"<switch_id>": [portas], ...}."""
+    db_file = session.get('db')
+    if not db_file:
+        return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
+    if request.args.get('all') in ('1', 'true'):
+        if _is_json_mode(db_file):
+            switch_ids = [s.get('id') for s in _json_read_table(db_file, 'switches')]
+        else:
+            conn = _sqlite_connect(db_file)
+            switch_ids = [row[0] for row in conn.execute('SELECT id FROM switches ORDER BY id')]
+            conn.close()
+    else:
+        try:
+            switch_ids = [int(i) for i in request.args.get('switch_ids', '').split(',') if i.strip()]
+        except ValueError:
+            return jsonify({'status': 'erro', 'mensagem': 'switch_ids deve ser uma lista de IDs separados por vírgula'}), 400
+        if not switch_ids:
+            return jsonify({'status': 'erro', 'mensagem': 'Informe switch_ids ou all=1'}), 400
+    switch_ids = list(dict.fromkeys(switch_ids))
+
+    # Um switch por trecho: a resposta começa a sair antes de o último ser
+    # resolvido. O primeiro é resolvido antes do status, então uma falha logo
+    # de início (banco indisponível etc.) ainda vira um 500
+    portas_por_switch = _switch_portas(db_file, switch_ids)
+    try:
+        primeiro = next(portas_por_switch, None)
+    except Exception as e:
+        print(f"Erro ao listar portas dos switches: {e}")
+        return jsonify({'status': 'erro', 'mensagem': str(e)}), 500
+
+    def trecho(switch_id, portas):
+        return _texto_dumps(str(switch_id)) + b':' + _texto_dumps(portas)
+
+    def gerar():
+        yield b'{'
+        if primeiro is not None:
+            yield trecho(*primeiro)
+            try:
+                for switch_id, portas in portas_por_switch:
+                    yield b',' + trecho(switch_id, portas)
+            except Exception as e:
+                # O 200 já foi enviado: fecha o JSON com a marca de erro em vez de truncá-lo
+                print(f"Erro ao listar portas dos switches: {e}")
+                yield b',"erro":' + _texto_dumps(f'Listagem incompleta: {e}')
+        yield b'}'
+    return app.response_class(stream_with_context(gerar()), mimetype='application/json')
+
+@app.route('/switch-portas/<int:switch_id>', methods=['GET'])
+@login_required
+def listar_portas_switch(switch_id):
+    db_file = session.get('db')
+    if not db_file:
+        return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
+    [(_, portas)] = _switch_portas(db_file, [switch_id])
+    return jsonify(portas)
 
 @app.route('/switch-portas/<int:porta_id>', methods=['PUT'])
 @admin_required
@@ -2348,7 +3802,7 @@ def editar_porta_switch(porta_id):
         registrar_log(session.get('username', 'desconhecido'), 'EDITAR_PORTA_SWITCH', detalhes, 'sucesso', db_file)
         return jsonify({'status': 'ok', 'mensagem': 'Porta editada com sucesso!'})
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         
         try:
@@ -2407,7 +3861,7 @@ def deletar_porta_switch(porta_id):
         registrar_log(session.get('username', 'desconhecido'), 'DELETAR_PORTA_SWITCH', detalhes, 'sucesso', db_file)
         return jsonify({'status': 'ok', 'mensagem': 'Porta deletada com sucesso!'})
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         
         try:
@@ -2467,56 +3921,44 @@ def criar_conexao():
     if not db_file:
         return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
     if _is_json_mode(db_file):
-        portas = _json_read_table(db_file, 'switch_portas')
-        porta = next((p for p in portas if p.get('id') == dados.get('porta_id')), None)
-        if not porta:
-            registrar_log(session.get('username', 'desconhecido'), 'CRIAR_CONEXAO', f"Porta ID={dados.get('porta_id')}: Não encontrada", 'erro', db_file)
-            return jsonify({'status': 'erro', 'mensagem': 'Porta não encontrada'}), 404
-        if (porta.get('status') or 'livre') != 'livre':
-            registrar_log(session.get('username', 'desconhecido'), 'CRIAR_CONEXAO', f"Porta ID={dados.get('porta_id')}: Já ocupada", 'erro', db_file)
-            return jsonify({'status': 'erro', 'mensagem': 'Porta já está ocupada'}), 400
-        conexoes = _json_read_table(db_file, 'conexoes')
-        if any(c.get('equipamento_id') == dados.get('equipamento_id') and c.get('status') == 'ativa' for c in conexoes):
-            registrar_log(session.get('username', 'desconhecido'), 'CRIAR_CONEXAO', f"Equipamento ID={dados.get('equipamento_id')}: Já conectado", 'erro', db_file)
-            return jsonify({'status': 'erro', 'mensagem': 'Equipamento já está conectado a outra porta'}), 400
-        
-        # Verificar se o equipamento já está conectado a algum patch panel
-        patch_panel_portas = _json_read_table(db_file, 'patch_panel_portas')
-        equipamento_ja_conectado_pp = next((p for p in patch_panel_portas 
-                                           if p.get('equipamento_id') == dados.get('equipamento_id')), None)
-        if equipamento_ja_conectado_pp:
-            registrar_log(session.get('username', 'desconhecido'), 'CRIAR_CONEXAO', f"Equipamento ID={dados.get('equipamento_id')}: Já conectado a patch panel", 'erro', db_file)
-            return jsonify({'status': 'erro', 'mensagem': 'Este equipamento já está conectado a um patch panel'}), 400
-        conexao = {
-            'id': _json_next_id(conexoes),
-            'porta_id': dados.get('porta_id'),
-            'equipamento_id': dados.get('equipamento_id'),
-            'data_conexao': datetime.now().isoformat(),
-            'status': 'ativa'
-        }
-        conexoes.append(conexao)
-        _json_write_table(db_file, 'conexoes', conexoes)
-        # atualizar status porta
-        porta['status'] = 'ocupada'
-        _json_write_table(db_file, 'switch_portas', portas)
-        conexao_id = conexao['id']
+        with _json_transacao(db_file) as tx:
+            portas = tx.ler('switch_portas')
+            porta = next((p for p in portas if p.get('id') == dados.get('porta_id')), None)
+            if not porta:
+                registrar_log(session.get('username', 'desconhecido'), 'CRIAR_CONEXAO', f"Porta ID={dados.get('porta_id')}: Não encontrada", 'erro', db_file)
+                return jsonify({'status': 'erro', 'mensagem': 'Porta não encontrada'}), 404
+            if (porta.get('status') or 'livre') != 'livre':
+                registrar_log(session.get('username', 'desconhecido'), 'CRIAR_CONEXAO', f"Porta ID={dados.get('porta_id')}: Já ocupada", 'erro', db_file)
+                return jsonify({'status': 'erro', 'mensagem': 'Porta já está ocupada'}), 400
+            conexoes = tx.ler('conexoes')
+            if any(c.get('equipamento_id') == dados.get('equipamento_id') and c.get('status') == 'ativa' for c in conexoes):
+                registrar_log(session.get('username', 'desconhecido'), 'CRIAR_CONEXAO', f"Equipamento ID={dados.get('equipamento_id')}: Já conectado", 'erro', db_file)
+                return jsonify({'status': 'erro', 'mensagem': 'Equipamento já está conectado a outra porta'}), 400
+        
+            # Verificar se o equipamento já está conectado a algum patch panel
+            patch_panel_portas = tx.ler('patch_panel_portas')
+            equipamento_ja_conectado_pp = next((p for p in patch_panel_portas 
+                                               if p.get('equipamento_id') == dados.get('equipamento_id')), None)
+            if equipamento_ja_conectado_pp:
+                registrar_log(session.get('username', 'desconhecido'), 'CRIAR_CONEXAO', f"Equipamento ID={dados.get('equipamento_id')}: Já conectado a patch panel", 'erro', db_file)
+                return jsonify({'status': 'erro', 'mensagem': 'Este equipamento já está conectado a um patch panel'}), 400
+            conexao = {
+                'id': _json_proximo_id(db_file, 'conexoes'),
+                'porta_id': dados.get('porta_id'),
+                'equipamento_id': dados.get('equipamento_id'),
+                'data_conexao': datetime.now().isoformat(),
+                'status': 'ativa'
+            }
+            conexoes.append(conexao)
+            tx.gravar('conexoes', conexoes)
+            # atualizar status porta
+            porta['status'] = 'ocupada'
+            tx.gravar('switch_portas', portas)
+            conexao_id = conexao['id']
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         
-        # Criar tabela de conexões se não existir
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS conexoes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                porta_id INTEGER NOT NULL,
-                equipamento_id INTEGER NOT NULL,
-                data_conexao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                status TEXT DEFAULT 'ativa',
-                FOREIGN KEY (porta_id) REFERENCES switch_portas (id),
-                FOREIGN KEY (equipamento_id) REFERENCES equipamentos (id)
-            )
-        ''')
-        
         # Verificar se a porta está livre
         cur.execute('SELECT status FROM switch_portas WHERE id=?', (dados['porta_id'],))
         porta = cur.fetchone()
@@ -2564,22 +4006,23 @@ def remover_conexao(conexao_id):
     if not db_file:
         return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
     if _is_json_mode(db_file):
-        conexoes = _json_read_table(db_file, 'conexoes')
-        cx = next((c for c in conexoes if c.get('id') == conexao_id and c.get('status') == 'ativa'), None)
-        if not cx:
-            registrar_log(session.get('username', 'desconhecido'), 'REMOVER_CONEXAO', f'Conexão ID={conexao_id}: Não encontrada', 'erro', db_file)
-            return jsonify({'status': 'erro', 'mensagem': 'Conexão não encontrada'}), 404
-        porta_id = cx.get('porta_id')
-        equipamento_id = cx.get('equipamento_id')
-        cx['status'] = 'inativa'
-        _json_write_table(db_file, 'conexoes', conexoes)
-        portas = _json_read_table(db_file, 'switch_portas')
-        p = next((x for x in portas if x.get('id') == porta_id), None)
-        if p:
-            p['status'] = 'livre'
-            _json_write_table(db_file, 'switch_portas', portas)
+        with _json_transacao(db_file) as tx:
+            conexoes = tx.ler('conexoes')
+            cx = next((c for c in conexoes if c.get('id') == conexao_id and c.get('status') == 'ativa'), None)
+            if not cx:
+                registrar_log(session.get('username', 'desconhecido'), 'REMOVER_CONEXAO', f'Conexão ID={conexao_id}: Não encontrada', 'erro', db_file)
+                return jsonify({'status': 'erro', 'mensagem': 'Conexão não encontrada'}), 404
+            porta_id = cx.get('porta_id')
+            equipamento_id = cx.get('equipamento_id')
+            cx['status'] = 'inativa'
+            tx.gravar('conexoes', conexoes)
+            portas = tx.ler('switch_portas')
+            p = next((x for x in portas if x.get('id') == porta_id), None)
+            if p:
+                p['status'] = 'livre'
+                tx.gravar('switch_portas', portas)
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         
         # Buscar a conexão
@@ -2639,7 +4082,7 @@ def listar_conexoes():
         itens.sort(key=lambda x: (x.get('switch') or '', int(x.get('porta') or 0)))
         return jsonify(itens)
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         
         cur.execute('''
@@ -2760,23 +4203,24 @@ def excluir_switch(id):
     if not db_file:
         return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
     if _is_json_mode(db_file):
-        switches = _json_read_table(db_file, 'switches')
-        s = next((x for x in switches if x.get('id') == id), None)
-        nome, marca, modelo = (s.get('nome') if s else ''), (s.get('marca') if s else ''), (s.get('modelo') if s else '')
-        switches = [x for x in switches if x.get('id') != id]
-        _json_write_table(db_file, 'switches', switches)
-        portas = _json_read_table(db_file, 'switch_portas')
-        portas_ids = {p.get('id') for p in portas if p.get('switch_id') == id}
-        portas = [p for p in portas if p.get('switch_id') != id]
-        _json_write_table(db_file, 'switch_portas', portas)
-        # inativar conexoes dessas portas
-        conexoes = _json_read_table(db_file, 'conexoes')
-        for c in conexoes:
-            if c.get('porta_id') in portas_ids and c.get('status') == 'ativa':
-                c['status'] = 'inativa'
-        _json_write_table(db_file, 'conexoes', conexoes)
+        with _json_transacao(db_file) as tx:
+            switches = tx.ler('switches')
+            s = next((x for x in switches if x.get('id') == id), None)
+            nome, marca, modelo = (s.get('nome') if s else ''), (s.get('marca') if s else ''), (s.get('modelo') if s else '')
+            switches = [x for x in switches if x.get('id') != id]
+            tx.gravar('switches', switches)
+            portas = tx.ler('switch_portas')
+            portas_ids = {p.get('id') for p in portas if p.get('switch_id') == id}
+            portas = [p for p in portas if p.get('switch_id') != id]
+            tx.gravar('switch_portas', portas)
+            # inativar conexoes dessas portas
+            conexoes = tx.ler('conexoes')
+            for c in conexoes:
+                if c.get('porta_id') in portas_ids and c.get('status') == 'ativa':
+                    c['status'] = 'inativa'
+            tx.gravar('conexoes', conexoes)
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         # Buscar dados do switch
         cur.execute('SELECT nome, marca, modelo FROM switches WHERE id=?', (id,))
@@ -2810,7 +4254,7 @@ def atualizar_defeito_equipamento(id):
     db_file = session.get('db')
     if not db_file:
         return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
-    conn = sqlite3.connect(db_file)
+    conn = _sqlite_connect(db_file)
     cur = conn.cursor()
     # Se marcar como defeito, desvincula da sala
     if defeito:
@@ -3009,41 +4453,43 @@ def criar_patch_panel():
         return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
     dados = request.get_json() or {}
     if _is_json_mode(db_file):
-        patch_panels = _json_read_table(db_file, 'patch_panels')
-        portas = _json_read_table(db_file, 'patch_panel_portas')
-
-        novo = {
-            'id': _json_next_id(patch_panels),
-            'codigo': dados.get('codigo') or f"PP-{datetime.now().strftime('%Y%m%d%H%M%S')}",
-            'nome': dados.get('nome'),
-            'andar': dados.get('andar'),
-            'num_portas': int(dados.get('num_portas') or 0),
-            'porta_inicial': int(dados.get('porta_inicial') or 1),
-            'status': dados.get('status') or 'ativo',
-            'descricao': dados.get('descricao'),
-            'data_criacao': datetime.now().isoformat()
-        }
-        patch_panels.append(novo)
-
-        # criar portas
-        inicio = int(novo['porta_inicial'])
-        fim = inicio + int(novo['num_portas'] or 0) - 1
-        for numero in range(inicio, fim + 1):
-            portas.append({
-                'id': _json_next_id(portas),
-                'patch_panel_id': novo['id'],
-                'numero_porta': numero,
-                'switch_id': None,
-                'porta_switch': None,
-                'status': 'livre',
-                'equipamento_id': None,
-                'data_conexao': None
-            })
+        with _json_transacao(db_file) as tx:
+            patch_panels = tx.ler('patch_panels')
+            portas = tx.ler('patch_panel_portas')
+
+            novo = {
+                'id': _json_proximo_id(db_file, 'patch_panels'),
+                'codigo': dados.get('codigo') or f"PP-{datetime.now().strftime('%Y%m%d%H%M%S')}",
+                'nome': dados.get('nome'),
+                'andar': dados.get('andar'),
+                'num_portas': int(dados.get('num_portas') or 0),
+                'porta_inicial': int(dados.get('porta_inicial') or 1),
+                'status': dados.get('status') or 'ativo',
+                'descricao': dados.get('descricao'),
+                'data_criacao': datetime.now().isoformat()
+            }
+            patch_panels.append(novo)
+
+            # criar portas
+            inicio = int(novo['porta_inicial'])
+            fim = inicio + int(novo['num_portas'] or 0) - 1
+            ids_portas = iter(_json_reservar_ids(db_file, 'patch_panel_portas', max(fim - inicio + 1, 0)))
+            for numero in range(inicio, fim + 1):
+                portas.append({
+                    'id': next(ids_portas),
+                    'patch_panel_id': novo['id'],
+                    'numero_porta': numero,
+                    'switch_id': None,
+                    'porta_switch': None,
+                    'status': 'livre',
+                    'equipamento_id': None,
+                    'data_conexao': None
+                })
 
-        _json_write_table(db_file, 'patch_panels', patch_panels)
-        _json_write_table(db_file, 'patch_panel_portas', portas)
-        registrar_log(session.get('username','desconhecido'), 'CRIAR_PATCH_PANEL', f"Patch panel {novo['nome']} criado", 'sucesso', db_file)
-        return jsonify({'status': 'ok', 'id': novo['id']})
+            tx.gravar('patch_panels', patch_panels)
+            tx.gravar('patch_panel_portas', portas)
+            registrar_log(session.get('username','desconhecido'), 'CRIAR_PATCH_PANEL', f"Patch panel {novo['nome']} criado", 'sucesso', db_file)
+            return jsonify({'status': 'ok', 'id': novo['id']})
     else:
         return jsonify({'erro': 'Modo SQLite não suportado nesta rota no ambiente atual'}), 501
 
@@ -3077,16 +4523,17 @@ def excluir_patch_panel(id: int):
     if not db_file:
         return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
     if _is_json_mode(db_file):
-        patch_panels = _json_read_table(db_file, 'patch_panels')
-        portas = _json_read_table(db_file, 'patch_panel_portas')
-        if not any(pp.get('id') == id for pp in patch_panels):
-            return jsonify({'status': 'erro', 'mensagem': 'Patch panel não encontrado'}), 404
-        patch_panels = [pp for pp in patch_panels if pp.get('id') != id]
-        portas = [p for p in portas if p.get('patch_panel_id') != id]
-        _json_write_table(db_file, 'patch_panels', patch_panels)
-        _json_write_table(db_file, 'patch_panel_portas', portas)
-        registrar_log(session.get('username','desconhecido'), 'EXCLUIR_PATCH_PANEL', f'Patch panel {id} excluído', 'sucesso', db_file)
-        return jsonify({'status': 'ok'})
+        with _json_transacao(db_file) as tx:
+            patch_panels = tx.ler('patch_panels')
+            portas = tx.ler('patch_panel_portas')
+            if not any(pp.get('id') == id for pp in patch_panels):
+                return jsonify({'status': 'erro', 'mensagem': 'Patch panel não encontrado'}), 404
+            patch_panels = [pp for pp in patch_panels if pp.get('id') != id]
+            portas = [p for p in portas if p.get('patch_panel_id') != id]
+            tx.gravar('patch_panels', patch_panels)
+            tx.gravar('patch_panel_portas', portas)
+            registrar_log(session.get('username','desconhecido'), 'EXCLUIR_PATCH_PANEL', f'Patch panel {id} excluído', 'sucesso', db_file)
+            return jsonify({'status': 'ok'})
     else:
         return jsonify({'erro': 'Modo SQLite não suportado nesta rota no ambiente atual'}), 501
 
@@ -3128,6 +4575,182 @@ def listar_portas_patch_panel(id: int):
         return jsonify({'erro': 'Modo SQLite não suportado nesta rota no ambiente atual'}), 501
 
 
+PATCH_PANEL_STATUS = ('livre', 'mapeada', 'ocupada')
+
+def _patch_panel_filtros():
+    """(porta_de, porta_ate, status) dos parâmetros; ValueError se inválidos."""
+    porta_de = int(request.args['porta_de']) if request.args.get('porta_de') else None
+    porta_ate = int(request.args['porta_ate']) if request.args.get('porta_ate') else None
+    status = set(_lote_lista(request.args.get('status')))
+    if status - set(PATCH_PANEL_STATUS):
+        raise ValueError(f"status deve ser um de {', '.join(PATCH_PANEL_STATUS)}")
+    return porta_de, porta_ate, status
+
+def _patch_panel_completo_json(db_file, pp, porta_de, porta_ate, status):
+    prefixo_keystone = pp.get('prefixo_keystone') or 'KST'
+    portas = _json_buscar(db_file, 'patch_panel_portas', 'patch_panel_id', pp.get('id'))
+    total = len(portas)
+    portas = [p for p in portas
+              if (porta_de is None or int(p.get('numero_porta') or 0) >= porta_de)
+              and (porta_ate is None or int(p.get('numero_porta') or 0) <= porta_ate)
+              and (not status or (p.get('status') or 'livre') in status)]
+    portas.sort(key=lambda x: int(x.get('numero_porta') or 0))
+
+    # Só os registros referenciados pelas portas do intervalo, pelo índice de ids
+    cache = {}
+    def obter(tabela, row_id):
+        if row_id is None:
+            return None
+        if (tabela, row_id) not in cache:
+            cache[(tabela, row_id)] = _json_get(db_file, tabela, row_id)
+        return cache[(tabela, row_id)]
+
+    # Cabo ligado a cada porta: conexão de cabo ativa com destino neste patch panel
+    cabo_da_porta = {}
+    for cc in _json_read_table(db_file, 'conexoes_cabos'):
+        if (cc.get('tipo_destino') == 'patch_panel' and cc.get('equipamento_destino_id') == pp.get('id')
+                and not cc.get('data_desconexao') and str(cc.get('porta_destino') or '').isdigit()):
+            cabo_da_porta.setdefault(int(cc.get('porta_destino')), cc)
+
+    resultado = []
+    for p in portas:
+        numero_porta = int(p.get('numero_porta') or 0)
+        equip = obter('equipamentos', p.get('equipamento_id'))
+        sala = obter('salas', (equip or {}).get('sala_id'))
+        switch_obj = obter('switches', p.get('switch_id'))
+        conexao_cabo = cabo_da_porta.get(numero_porta)
+        cabo = obter('cabos', (conexao_cabo or {}).get('cabo_id'))
+        resultado.append({
+            'id': p.get('id'),
+            'numero_porta': p.get('numero_porta'),
+            'prefixo_keystone': prefixo_keystone,
+            'keystone': f"{prefixo_keystone}-{numero_porta:04d}",
+            'status': p.get('status') or 'livre',
+            'data_conexao': p.get('data_conexao'),
+            'switch_id': p.get('switch_id'),
+            'switch_nome': (switch_obj or {}).get('nome'),
+            'porta_switch': p.get('porta_switch'),
+            'switch': {
+                'id': switch_obj.get('id'),
+                'nome': switch_obj.get('nome'),
+                'marca': switch_obj.get('marca'),
+                'modelo': switch_obj.get('modelo')
+            } if switch_obj else None,
+            'equipamento_id': p.get('equipamento_id'),
+            'equipamento_nome': (equip or {}).get('nome'),
+            'equipamento_tipo': (equip or {}).get('tipo'),
+            'equipamento_sala_id': (equip or {}).get('sala_id'),
+            'equipamento_sala': (sala or {}).get('nome'),
+            'sala_nome': (sala or {}).get('nome'),
+            'equipamento': _equipamento_registro(equip) if equip else None,
+            'sala': {'id': sala.get('id'), 'nome': sala.get('nome'), 'andar_id': sala.get('andar_id')} if sala else None,
+            'cabo_id': (cabo or {}).get('id'),
+            'codigo_cabo': (cabo or {}).get('codigo_unico'),
+            'tipo_cabo': (cabo or {}).get('tipo'),
+        })
+    return total, resultado
+
+def _patch_panel_completo_sqlite(db_file, pp_id, porta_de, porta_ate, status):
+    conn = _sqlite_connect(db_file)
+    cur = conn.cursor()
+    cur.execute('''
+        SELECT id, codigo, nome, andar, porta_inicial, num_portas, status, descricao, data_criacao, prefixo_keystone
+        FROM patch_panels WHERE id = ?
+    ''', (pp_id,))
+    row = cur.fetchone()
+    if not row:
+        conn.close()
+        return None, 0, []
+    pp = dict(zip(('id', 'codigo', 'nome', 'andar', 'porta_inicial', 'num_portas', 'status', 'descricao',
+                   'data_criacao', 'prefixo_keystone'), row))
+    prefixo_keystone = pp['prefixo_keystone'] or 'KST'
+    cur.execute('SELECT COUNT(*) FROM patch_panel_portas WHERE patch_panel_id = ?', (pp_id,))
+    total = cur.fetchone()[0]
+
+    condicoes, parametros = ['ppp.patch_panel_id = ?'], [pp_id]
+    if porta_de is not None:
+        condicoes.append('ppp.numero_porta >= ?')
+        parametros.append(porta_de)
+    if porta_ate is not None:
+        condicoes.append('ppp.numero_porta <= ?')
+        parametros.append(porta_ate)
+    if status:
+        condicoes.append(f"COALESCE(ppp.status, 'livre') IN ({','.join('?' * len(status))})")
+        parametros.extend(sorted(status))
+    cur.execute(f'''
+        SELECT ppp.id, ppp.numero_porta, COALESCE(ppp.status, 'livre'), ppp.data_conexao,
+               ppp.switch_id, sw.nome, sw.marca, sw.modelo, ppp.porta_switch,
+               ppp.equipamento_id, s.id, s.nome, s.andar_id
+        FROM patch_panel_portas ppp
+        LEFT JOIN switches sw ON ppp.switch_id = sw.id
+        LEFT JOIN equipamentos e ON ppp.equipamento_id = e.id
+        LEFT JOIN salas s ON e.sala_id = s.id
+        WHERE {' AND '.join(condicoes)}
+        ORDER BY ppp.numero_porta
+    ''', parametros)
+    rows = cur.fetchall()
+    equipamentos = _equipamentos_lote_sqlite(cur, list(dict.fromkeys(row[9] for row in rows if row[9] is not None)))
+    conn.close()
+
+    resultado = []
+    for row in rows:
+        equip = equipamentos.get(row[9])
+        resultado.append({
+            'id': row[0],
+            'numero_porta': row[1],
+            'prefixo_keystone': prefixo_keystone,
+            'keystone': f"{prefixo_keystone}-{int(row[1] or 0):04d}",
+            'status': row[2],
+            'data_conexao': row[3],
+            'switch_id': row[4],
+            'switch_nome': row[5],
+            'porta_switch': row[8],
+            'switch': {'id': row[4], 'nome': row[5], 'marca': row[6], 'modelo': row[7]} if row[5] is not None else None,
+            'equipamento_id': row[9],
+            'equipamento_nome': (equip or {}).get('nome'),
+            'equipamento_tipo': (equip or {}).get('tipo'),
+            'equipamento_sala_id': (equip or {}).get('sala_id'),
+            'equipamento_sala': row[11],
+            'sala_nome': row[11],
+            'equipamento': equip,
+            'sala': {'id': row[10], 'nome': row[11], 'andar_id': row[12]} if row[10] is not None else None,
+            # Cabos só existem no modo JSON
+            'cabo_id': None,
+            'codigo_cabo': None,
+            'tipo_cabo': None,
+        })
+    return _patch_panel_registro(pp) | {'prefixo_keystone': prefixo_keystone}, total, resultado
+
+@app.route('/patch-panels/<int:id>/completo', methods=['GET'])
+@login_required
+def patch_panel_completo(id: int):
+    """Patch panel com as portas e, em cada porta, switch, equipamento, sala e
+    cabo já resolvidos. Filtros opcionais: ?porta_de=&porta_ate= (inclusivos)
+    e ?status=livre,mapeada,ocupada, para paginar painéis grandes."""
+    db_file = session.get('db')
+    if not db_file:
+        return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
+    try:
+        porta_de, porta_ate, status = _patch_panel_filtros()
+    except ValueError as e:
+        return jsonify({'status': 'erro', 'mensagem': f'Filtro inválido: {e}'}), 400
+    if _is_json_mode(db_file):
+        pp = _json_get(db_file, 'patch_panels', id)
+        if not pp:
+            return jsonify({'status': 'erro', 'mensagem': 'Patch panel não encontrado'}), 404
+        total, portas = _patch_panel_completo_json(db_file, pp, porta_de, porta_ate, status)
+        patch_panel = _patch_panel_registro(pp) | {'prefixo_keystone': pp.get('prefixo_keystone') or 'KST'}
+    else:
+        patch_panel, total, portas = _patch_panel_completo_sqlite(db_file, id, porta_de, porta_ate, status)
+        if patch_panel is None:
+            return jsonify({'status': 'erro', 'mensagem': 'Patch panel não encontrado'}), 404
+    return jsonify({
+        'patch_panel': patch_panel,
+        'total_portas': total,
+        'filtros': {'porta_de': porta_de, 'porta_ate': porta_ate, 'status': sorted(status) or None},
+        'portas': portas
+    })
+
 @app.route('/patch-panel-portas/<int:porta_id>/conectar-equipamento', methods=['PUT'])
 @admin_required
 def conectar_equipamento_patch_panel(porta_id):
@@ -3140,9 +4763,7 @@ def conectar_equipamento_patch_panel(porta_id):
         return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
     
     if _is_json_mode(db_file):
-        patch_panel_portas = _json_read_table(db_file, 'patch_panel_portas')
-        
-        porta_pp = next((p for p in patch_panel_portas if p.get('id') == porta_id), None)
+        porta_pp = _json_get(db_file, 'patch_panel_portas', porta_id)
         if not porta_pp:
             return jsonify({'status': 'erro', 'mensagem': 'Porta do patch panel não encontrada'}), 404
         
@@ -3154,21 +4775,19 @@ def conectar_equipamento_patch_panel(porta_id):
             return jsonify({'status': 'erro', 'mensagem': 'ID do equipamento é obrigatório'}), 400
         
         # Verificar se o equipamento existe
-        equipamentos = _json_read_table(db_file, 'equipamentos')
-        equipamento = next((e for e in equipamentos if e.get('id') == equipamento_id), None)
+        equipamento = _json_get(db_file, 'equipamentos', equipamento_id)
         if not equipamento:
             return jsonify({'status': 'erro', 'mensagem': 'Equipamento não encontrado'}), 404
         
         # Verificar se o equipamento já está conectado a qualquer patch panel
-        equipamento_ja_conectado_pp = next((p for p in patch_panel_portas 
-                                           if p.get('equipamento_id') == equipamento_id and p.get('id') != porta_id), None)
+        equipamento_ja_conectado_pp = next((p for p in _json_buscar(db_file, 'patch_panel_portas', 'equipamento_id', equipamento_id)
+                                           if p.get('id') != porta_id), None)
         if equipamento_ja_conectado_pp:
             return jsonify({'status': 'erro', 'mensagem': 'Este equipamento já está conectado a outro patch panel'}), 400
         
         # Verificar se o equipamento já está conectado a algum switch
-        conexoes = _json_read_table(db_file, 'conexoes')
-        equipamento_ja_conectado_switch = next((c for c in conexoes 
-                                              if c.get('equipamento_id') == equipamento_id and c.get('status') == 'ativa'), None)
+        equipamento_ja_conectado_switch = next((c for c in _json_buscar(db_file, 'conexoes', 'equipamento_id', equipamento_id)
+                                              if c.get('status') == 'ativa'), None)
         if equipamento_ja_conectado_switch:
             return jsonify({'status': 'erro', 'mensagem': 'Este equipamento já está conectado a um switch'}), 400
         
@@ -3177,214 +4796,1434 @@ def conectar_equipamento_patch_panel(porta_id):
         porta_pp['status'] = 'ocupada'
         porta_pp['data_conexao'] = datetime.now().isoformat()
         
-        _json_write_table(db_file, 'patch_panel_portas', patch_panel_portas)
+        _json_atualizar_linhas(db_file, 'patch_panel_portas', [porta_pp])
         
         registrar_log(session.get('username'), 'CONECTAR_EQUIPAMENTO_PATCH_PANEL', 
                      f'Equipamento {equipamento_id} conectado à porta {porta_id}', 'sucesso', db_file)
         
         return jsonify({'status': 'ok', 'mensagem': 'Equipamento conectado com sucesso!'})
     else:
-        return jsonify({'status': 'erro', 'mensagem': 'Modo SQLite não implementado'}), 501
+        return jsonify({'status': 'erro', 'mensagem': 'Modo SQLite não implementado'}), 501
+
+@app.route('/patch-panel-portas/<int:porta_id>/desconectar-equipamento', methods=['PUT'])
+@admin_required
+def desconectar_equipamento_patch_panel(porta_id):
+    db_file = session.get('db')
+    if not db_file:
+        return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
+    
+    if _is_json_mode(db_file):
+        patch_panel_portas = _json_read_table(db_file, 'patch_panel_portas')
+        
+        porta_pp = next((p for p in patch_panel_portas if p.get('id') == porta_id), None)
+        if not porta_pp:
+            return jsonify({'status': 'erro', 'mensagem': 'Porta do patch panel não encontrada'}), 404
+        
+        if porta_pp.get('status') != 'ocupada':
+            return jsonify({'status': 'erro', 'mensagem': 'Porta não está ocupada'}), 400
+        
+        equipamento_id = porta_pp.get('equipamento_id')
+        
+        # Desconectar equipamento
+        porta_pp['equipamento_id'] = None
+        porta_pp['data_conexao'] = None
+        
+        # Se a porta estava mapeada para um switch, voltar para mapeada
+        if porta_pp.get('switch_id'):
+            porta_pp['status'] = 'mapeada'
+        else:
+            porta_pp['status'] = 'livre'
+        
+        _json_write_table(db_file, 'patch_panel_portas', patch_panel_portas)
+        
+        registrar_log(session.get('username'), 'DESCONECTAR_EQUIPAMENTO_PATCH_PANEL', 
+                     f'Equipamento {equipamento_id} desconectado da porta {porta_id}', 'sucesso', db_file)
+        
+        return jsonify({'status': 'ok', 'mensagem': 'Equipamento desconectado com sucesso!'})
+    else:
+        return jsonify({'status': 'erro', 'mensagem': 'Modo SQLite não implementado'}), 501
+
+@app.route('/patch-panel-portas/<int:porta_id>', methods=['PUT'])
+@tecnico_required
+def atualizar_patch_panel_porta(porta_id: int):
+    db_file = session.get('db')
+    if not db_file:
+        return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
+    dados = request.get_json() or {}
+    if _is_json_mode(db_file):
+        portas = _json_read_table(db_file, 'patch_panel_portas')
+        porta = next((p for p in portas if p.get('id') == porta_id), None)
+        if not porta:
+            return jsonify({'status': 'erro', 'mensagem': 'Porta não encontrada'}), 404
+        if 'switch_id' in dados:
+            porta['switch_id'] = dados.get('switch_id') if dados.get('switch_id') not in ['', None] else None
+        if 'porta_switch' in dados:
+            valor = dados.get('porta_switch')
+            porta['porta_switch'] = int(valor) if str(valor).isdigit() else None
+        _json_write_table(db_file, 'patch_panel_portas', portas)
+        registrar_log(session.get('username','desconhecido'), 'ATUALIZAR_PATCH_PANEL_PORTA', f'Porta {porta_id} atualizada', 'sucesso', db_file)
+        return jsonify({'status': 'ok'})
+    else:
+        return jsonify({'erro': 'Modo SQLite não suportado nesta rota no ambiente atual'}), 501
+
+# Logs de ping em modo JSON: um arquivo JSONL por dia em
+# <empresa>/ping_logs/AAAA-MM-DD.jsonl. Cada execução anexa todas as linhas
+# de uma vez (O_APPEND), em vez de reler e regravar o histórico inteiro por
+# equipamento. A leitura mantém em memória o que já leu de cada segmento e só
+# lê o trecho novo. Retenção: segmentos com mais de PING_LOGS_RETENCAO_DIAS
+# dias são apagados e o total fica limitado a PING_LOGS_MAX_REGISTROS linhas.
+PING_LOGS_RETENCAO_DIAS = int(os.environ.get('PING_LOGS_RETENCAO_DIAS', '90'))
+PING_LOGS_MAX_REGISTROS = int(os.environ.get('PING_LOGS_MAX_REGISTROS', '200000'))
+_PING_LOGS_DIR = 'ping_logs'
+
+_ping_segmentos_cache = {}  # caminho -> {'assinatura': (ino, geração), 'offset', 'rows'}
+_ping_segmentos_lock = threading.Lock()
+
+def _ping_log_chave(p):
+    return (p.get('timestamp') or '', _json_chave(p.get('id')) or 0)
+
+def _ping_logs_dir(db_file):
+    return os.path.join(_empresa_data_dir(db_file), _PING_LOGS_DIR)
+
+def _ping_segmentos(pasta):
+    """Segmentos existentes, do mais novo para o mais antigo."""
+    try:
+        nomes = [n for n in os.listdir(pasta) if re.fullmatch(r'\d{4}-\d{2}-\d{2}\.jsonl', n)]
+    except FileNotFoundError:
+        return []
+    return [os.path.join(pasta, n) for n in sorted(nomes, reverse=True)]
+
+def _ping_segmento_ler(path):
+    """Linhas do segmento, lendo do disco só o que foi anexado desde a última vez."""
+    with _ping_segmentos_lock:
+        try:
+            with open(path, 'rb') as f:
+                st = os.fstat(f.fileno())
+                entrada = _ping_segmentos_cache.get(path)
+                # Segmento recriado (retenção ou limpeza): começa do zero
+                if entrada is None or entrada['ino'] != st.st_ino or st.st_size < entrada['offset']:
+                    entrada = {'ino': st.st_ino, 'offset': 0, 'rows': []}
+                    _ping_segmentos_cache[path] = entrada
+                if st.st_size > entrada['offset']:
+                    f.seek(entrada['offset'])
+                    dados = f.read(st.st_size - entrada['offset'])
+                    fim = dados.rfind(b'\n') + 1  # linha incompleta fica para a próxima leitura
+                    for linha in dados[:fim].splitlines():
+                        if linha.strip():
+                            try:
+                                entrada['rows'].append(_texto_loads(linha))
+                            except ValueError:
+                                print(f"DEBUG: Linha inválida ignorada em {path}")
+                    entrada['offset'] += fim
+                return entrada['rows']
+        except FileNotFoundError:
+            _ping_segmentos_cache.pop(path, None)
+            return []
+
+def _ping_logs_migrar_tabela(db_file):
+    """Move a antiga tabela ping_logs.json para os segmentos (chamar com a trava da empresa)."""
+    antigos = _json_read_table(db_file, 'ping_logs')
+    if not antigos:
+        return
+    # Garante que a sequência de ids fique acima dos ids antigos
+    _json_reservar_ids(db_file, 'ping_logs', 1)
+    por_dia = {}
+    for p in antigos:
+        dia = (p.get('timestamp') or '')[:10]
+        if not re.fullmatch(r'\d{4}-\d{2}-\d{2}', dia):
+            dia = datetime.now().strftime('%Y-%m-%d')
+        por_dia.setdefault(dia, []).append(p)
+    _ping_logs_anexar(db_file, por_dia)
+    _json_write_table(db_file, 'ping_logs', [])
+    print(f"DEBUG: {len(antigos)} logs de ping movidos de ping_logs.json para {_ping_logs_dir(db_file)}")
+
+def _ping_logs_anexar(db_file, por_dia):
+    pasta = _ping_logs_dir(db_file)
+    os.makedirs(pasta, exist_ok=True)
+    for dia, registros in por_dia.items():
+        conteudo = b''.join(_texto_dumps(r) + b'\n' for r in registros)
+        fd = os.open(os.path.join(pasta, f'{dia}.jsonl'), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, conteudo)
+            if JSON_FSYNC != 'nenhum':
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+
+def _ping_logs_gravar(db_file, registros):
+    """Grava de uma vez os logs de uma execução; atribui ids e aplica a retenção."""
+    if not registros:
+        return
+    empresa_dir = _empresa_data_dir(db_file)
+    with _json_trava(empresa_dir):
+        _ping_logs_migrar_tabela(db_file)
+        ids = iter(_json_reservar_ids(db_file, 'ping_logs', len(registros)))
+        por_dia = {}
+        for registro in registros:
+            registro['id'] = next(ids)
+            por_dia.setdefault(registro['timestamp'][:10], []).append(registro)
+        _ping_logs_anexar(db_file, por_dia)
+        _ping_logs_reter(db_file)
+
+def _ping_logs_reter(db_file):
+    """Aplica a retenção por idade e por quantidade (chamar com a trava da empresa)."""
+    limite_dia = (datetime.now() - timedelta(days=PING_LOGS_RETENCAO_DIAS)).strftime('%Y-%m-%d')
+    mantidos = 0
+    for path in _ping_segmentos(_ping_logs_dir(db_file)):
+        dia = os.path.basename(path)[:10]
+        if dia < limite_dia or mantidos >= PING_LOGS_MAX_REGISTROS:
+            os.remove(path)
+            _ping_segmentos_cache.pop(path, None)
+            print(f"DEBUG: Segmento de logs de ping removido pela retenção: {path}")
+            continue
+        rows = _ping_segmento_ler(path)
+        excedente = mantidos + len(rows) - PING_LOGS_MAX_REGISTROS
+        if excedente > 0:
+            # Segmento mais antigo que ainda cabe em parte: descarta as linhas mais velhas
+            restantes = sorted(rows, key=_ping_log_chave)[excedente:]
+            _gravar_arquivo_atomico(path, b''.join(_texto_dumps(r) + b'\n' for r in restantes))
+            rows = restantes
+        mantidos += len(rows)
+
+def _ping_logs_limpar(db_file):
+    empresa_dir = _empresa_data_dir(db_file)
+    with _json_trava(empresa_dir):
+        _json_write_table(db_file, 'ping_logs', [])
+        for path in _ping_segmentos(_ping_logs_dir(db_file)):
+            os.remove(path)
+            _ping_segmentos_cache.pop(path, None)
+
+def _ping_logs_pagina(db_file, limite, antes_id=None):
+    """Até `limite` logs, mais recentes primeiro; com antes_id, só os anteriores
+    a ele. Levanta LookupError se o log do cursor não existir."""
+    if _json_read_table(db_file, 'ping_logs'):
+        with _json_trava(_empresa_data_dir(db_file)):
+            _ping_logs_migrar_tabela(db_file)
+    segmentos = _ping_segmentos(_ping_logs_dir(db_file))
+    filtro = None
+    if antes_id is not None:
+        cursor = None
+        for path in segmentos:
+            cursor = next((p for p in _ping_segmento_ler(path) if _json_chave(p.get('id')) == antes_id), None)
+            if cursor is not None:
+                break
+        if cursor is None:
+            raise LookupError(antes_id)
+        chave_cursor = _ping_log_chave(cursor)
+        filtro = lambda p: _ping_log_chave(p) < chave_cursor
+    pagina = []
+    for path in segmentos:
+        if filtro is not None and os.path.basename(path)[:10] > chave_cursor[0][:10]:
+            continue  # segmento inteiro mais novo que o cursor
+        rows = _ping_segmento_ler(path)
+        candidatos = rows if filtro is None else (p for p in rows if filtro(p))
+        pagina.extend(dict(p) for p in heapq.nlargest(limite - len(pagina), candidatos, key=_ping_log_chave))
+        if len(pagina) >= limite:
+            break
+    pagina.sort(key=_ping_log_chave, reverse=True)
+    return pagina
+
+def _ping_alvos(db_file):
+    """(id, nome, ip) dos equipamentos com IP cadastrado."""
+    if _is_json_mode(db_file):
+        alvos = []
+        for eq in _json_read_table(db_file, 'equipamentos'):
+            dados = eq.get('dados') or {}
+            ip = dados.get('ip1') or dados.get('ip')
+            if ip and ip.strip():
+                alvos.append((eq.get('id'), eq.get('nome'), ip))
+        return alvos
+    conn = _sqlite_connect(db_file)
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT e.id, e.nome, d.valor as ip
+            FROM equipamentos e
+            JOIN equipamento_dados d ON e.id = d.equipamento_id
+            WHERE d.chave = 'ip1' AND d.valor IS NOT NULL AND d.valor != ''
+        """)
+        return cur.fetchall()
+    finally:
+        conn.close()
+
+def _ping_registro(eq_id, nome, ip, resultado):
+    sucesso, saida, latencia_ms = resultado
+    return {'equipamento_id': eq_id, 'nome_equipamento': nome, 'ip': ip, 'resultado': saida,
+            'sucesso': sucesso, 'latencia_ms': latencia_ms, 'quando': time.time()}
+
+def _ping_utc(quando, separador='T'):
+    return datetime.fromtimestamp(quando, timezone.utc).strftime(f'%Y-%m-%d{separador}%H:%M:%S')
+
+def _ping_logs_registrar(db_file, registros):
+    """Grava de uma vez os logs (de _ping_registro) nos dois modos, com
+    retenção, e acrescenta as sondas à série temporal."""
+    if not registros:
+        return
+    try:
+        _telemetria_registrar(db_file, registros)
+    except Exception as e:
+        print(f"DEBUG: Falha ao gravar a telemetria de ping de {db_file}: {e}")
+    if _is_json_mode(db_file):
+        _ping_logs_gravar(db_file, [{
+            'equipamento_id': r['equipamento_id'],
+            'nome_equipamento': r['nome_equipamento'],
+            'ip': r['ip'],
+            'resultado': r['resultado'],
+            'sucesso': r['sucesso'],
+            'latencia_ms': r['latencia_ms'],
+            'timestamp': datetime.fromtimestamp(r['quando']).isoformat()
+        } for r in registros])
+        return
+    conn = _sqlite_connect(db_file)
+    try:
+        cur = conn.cursor()
+        cur.executemany(
+            'INSERT INTO ping_logs (equipamento_id, nome_equipamento, ip, resultado, sucesso, latencia_ms, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(r['equipamento_id'], r['nome_equipamento'], r['ip'], r['resultado'], r['sucesso'], r['latencia_ms'], _ping_utc(r['quando'], ' '))
+             for r in registros]
+        )
+        cur.execute("DELETE FROM ping_logs WHERE timestamp < datetime('now', ?)", (f'-{PING_LOGS_RETENCAO_DIAS} days',))
+        cur.execute('''
+            DELETE FROM ping_logs WHERE id IN (
+                SELECT id FROM ping_logs ORDER BY timestamp DESC, id DESC LIMIT -1 OFFSET ?
+            )
+        ''', (PING_LOGS_MAX_REGISTROS,))
+        conn.commit()
+    finally:
+        conn.close()
+
+# Série temporal de alcançabilidade. Cada sonda vira uma amostra compacta
+# (equipamento, instante, rtt, sucesso) num SQLite próprio da empresa em
+# static/data/telemetria/<empresa>.db, fora do banco/JSON principal, para que
+# o monitor não dispute escrita com as rotas. A mesma transação atualiza os
+# agregados de 1 min, 1 h e 1 dia (UTC): total, sucessos, soma/mín/máx do rtt
+# e um histograma logarítmico do rtt, que somado entre baldes dá p50/p95
+# aproximados (erro < 12%). Retenção: amostras brutas por
+# TELEMETRIA_BRUTA_DIAS, baldes de 1 min por TELEMETRIA_MINUTOS_DIAS, de 1 h
+# por TELEMETRIA_HORAS_DIAS; os diários ficam.
+TELEMETRIA_BRUTA_DIAS = int(os.environ.get('TELEMETRIA_BRUTA_DIAS', '7'))
+TELEMETRIA_MINUTOS_DIAS = int(os.environ.get('TELEMETRIA_MINUTOS_DIAS', '30'))
+TELEMETRIA_HORAS_DIAS = int(os.environ.get('TELEMETRIA_HORAS_DIAS', '365'))
+# Leituras dos demais coletores (sensores de ocupação, UPS): JSON por leitura
+TELEMETRIA_LEITURAS_DIAS = int(os.environ.get('TELEMETRIA_LEITURAS_DIAS', '30'))
+_TELEMETRIA_DIR = os.path.join(os.path.dirname(__file__), 'static', 'data', 'telemetria')
+_TELEMETRIA_RESOLUCOES = (60, 3600, 86400)
+
+# Classe i do histograma: rtt em [0,1 ms * 1,25^i, 0,1 ms * 1,25^(i+1)); a
+# última acumula tudo acima de ~21 s
+_HIST_BASE_MS = 0.1
+_HIST_FATOR = 1.25
+_HIST_CLASSES = 56
+_HIST_FORMATO = f'<{_HIST_CLASSES}I'
+
+_TELEMETRIA_MIGRACOES = [
+    (1, 'amostras e agregados de telemetria', [
+        '''CREATE TABLE IF NOT EXISTS amostras (
+            equipamento_id INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            rtt_ms REAL,
+            sucesso INTEGER NOT NULL,
+            PRIMARY KEY (equipamento_id, ts)
+        ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS ix_amostras_ts ON amostras (ts)',
+        '''CREATE TABLE IF NOT EXISTS agregados (
+            resolucao INTEGER NOT NULL,
+            equipamento_id INTEGER NOT NULL,
+            inicio INTEGER NOT NULL,
+            total INTEGER NOT NULL,
+            sucessos INTEGER NOT NULL,
+            rtt_n INTEGER NOT NULL,
+            rtt_soma REAL NOT NULL,
+            rtt_min REAL,
+            rtt_max REAL,
+            histograma BLOB NOT NULL,
+            PRIMARY KEY (resolucao, equipamento_id, inicio)
+        ) WITHOUT ROWID''',
+    ]),
+    (2, 'leituras dos coletores de sensores e UPS', [
+        '''CREATE TABLE IF NOT EXISTS leituras (
+            coletor TEXT NOT NULL,
+            equipamento_id INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            sucesso INTEGER NOT NULL,
+            dados TEXT,
+            PRIMARY KEY (coletor, equipamento_id, ts)
+        ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS ix_leituras_ts ON leituras (ts)',
+    ]),
+]
+
+_telemetria_retida_em = {}  # caminho -> time.monotonic() da última retenção
+
+def _telemetria_db(db_file):
+    if _is_json_mode(db_file):
+        nome = _empresa_dir_from_db(db_file)
+    else:
+        # O nome base do banco pode se repetir em pastas diferentes: o caminho
+        # completo entra no nome do arquivo (resumido, para caber no sistema de arquivos)
+        caminho = os.path.abspath(str(db_file))
+        nome = f"{_empresa_dir_from_db(db_file)}-{hashlib.sha1(caminho.encode('utf-8')).hexdigest()[:12]}"
+    path = os.path.join(_TELEMETRIA_DIR, f'{nome}.db')
+    if path not in _sqlite_esquemas:
+        os.makedirs(_TELEMETRIA_DIR, exist_ok=True)
+        _sqlite_esquemas[path] = _TELEMETRIA_MIGRACOES
+    return path
+
+def _hist_classe(rtt_ms):
+    if rtt_ms <= _HIST_BASE_MS:
+        return 0
+    return min(_HIST_CLASSES - 1, int(math.log(rtt_ms / _HIST_BASE_MS, _HIST_FATOR)))
+
+def _hist_percentil(hist, p, minimo=None, maximo=None):
+    """Ponto médio (geométrico) da classe onde cai o percentil p, limitado ao
+    rtt mínimo e máximo observados (a classe pode passar dos dois)."""
+    total = sum(hist)
+    if not total:
+        return None
+    alvo = p / 100 * total
+    acumulado = 0
+    for i, n in enumerate(hist):
+        acumulado += n
+        if n and acumulado >= alvo:
+            valor = _HIST_BASE_MS * _HIST_FATOR ** (i + 0.5)
+            if minimo is not None:
+                valor = max(valor, minimo)
+            if maximo is not None:
+                valor = min(valor, maximo)
+            return round(valor, 2)
+
+def _percentil(ordenados, p):
+    if not ordenados:
+        return None
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+def _telemetria_balde(linha=None):
+    """Balde de agregação vazio ou a partir de (total, sucessos, rtt_n,
+    rtt_soma, rtt_min, rtt_max, histograma) lidos de agregados."""
+    if linha is None:
+        return {'total': 0, 'sucessos': 0, 'rtt_n': 0, 'rtt_soma': 0.0, 'rtt_min': None, 'rtt_max': None, 'hist': [0] * _HIST_CLASSES}
+    total, sucessos, rtt_n, rtt_soma, rtt_min, rtt_max, histograma = linha
+    return {'total': total, 'sucessos': sucessos, 'rtt_n': rtt_n, 'rtt_soma': rtt_soma, 'rtt_min': rtt_min, 'rtt_max': rtt_max,
+            'hist': list(struct.unpack(_HIST_FORMATO, histograma))}
+
+def _telemetria_amostra(balde, rtt_ms, sucesso):
+    balde['total'] += 1
+    balde['sucessos'] += sucesso
+    if rtt_ms is not None:
+        balde['rtt_n'] += 1
+        balde['rtt_soma'] += rtt_ms
+        balde['rtt_min'] = rtt_ms if balde['rtt_min'] is None else min(balde['rtt_min'], rtt_ms)
+        balde['rtt_max'] = rtt_ms if balde['rtt_max'] is None else max(balde['rtt_max'], rtt_ms)
+        balde['hist'][_hist_classe(rtt_ms)] += 1
+
+def _telemetria_somar(balde, outro):
+    for campo in ('total', 'sucessos', 'rtt_n', 'rtt_soma'):
+        balde[campo] += outro[campo]
+    for campo, escolher in (('rtt_min', min), ('rtt_max', max)):
+        valores = [v for v in (balde[campo], outro[campo]) if v is not None]
+        balde[campo] = escolher(valores) if valores else None
+    balde['hist'] = [a + b for a, b in zip(balde['hist'], outro['hist'])]
+
+def _telemetria_registrar(db_file, registros):
+    """Acrescenta as sondas (de _ping_registro) à série e aos agregados."""
+    path = _telemetria_db(db_file)
+    conn = _sqlite_connect(path)
+    try:
+        # IMMEDIATE: os agregados são lidos e regravados; outro processo espera
+        conn.execute('BEGIN IMMEDIATE')
+        cur = conn.cursor()
+        baldes = {}
+        for r in registros:
+            eq_id = _json_chave(r['equipamento_id'])
+            if eq_id is None:
+                continue
+            ts = int(r['quando'])
+            sucesso = 1 if r['sucesso'] else 0
+            rtt_ms = r['latencia_ms'] if sucesso else None
+            cur.execute('INSERT OR IGNORE INTO amostras (equipamento_id, ts, rtt_ms, sucesso) VALUES (?, ?, ?, ?)',
+                        (eq_id, ts, rtt_ms, sucesso))
+            if not cur.rowcount:
+                continue  # o equipamento já tem amostra neste segundo
+            for resolucao in _TELEMETRIA_RESOLUCOES:
+                balde = baldes.setdefault((resolucao, eq_id, ts - ts % resolucao), _telemetria_balde())
+                _telemetria_amostra(balde, rtt_ms, sucesso)
+        for (resolucao, eq_id, inicio), balde in baldes.items():
+            cur.execute('''
+                SELECT total, sucessos, rtt_n, rtt_soma, rtt_min, rtt_max, histograma FROM agregados
+                WHERE resolucao = ? AND equipamento_id = ? AND inicio = ?
+            ''', (resolucao, eq_id, inicio))
+            linha = cur.fetchone()
+            if linha:
+                _telemetria_somar(balde, _telemetria_balde(linha))
+            cur.execute('''
+                INSERT OR REPLACE INTO agregados
+                    (resolucao, equipamento_id, inicio, total, sucessos, rtt_n, rtt_soma, rtt_min, rtt_max, histograma)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (resolucao, eq_id, inicio, balde['total'], balde['sucessos'], balde['rtt_n'], balde['rtt_soma'],
+                  balde['rtt_min'], balde['rtt_max'], struct.pack(_HIST_FORMATO, *balde['hist'])))
+        _telemetria_reter(cur, path)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def _telemetria_reter(cur, path):
+    # No máximo a cada 10 minutos por processo
+    ultima = _telemetria_retida_em.get(path)
+    if ultima is not None and time.monotonic() - ultima < 600:
+        return
+    _telemetria_retida_em[path] = time.monotonic()
+    agora = int(time.time())
+    cur.execute('DELETE FROM amostras WHERE ts < ?', (agora - TELEMETRIA_BRUTA_DIAS * 86400,))
+    cur.execute('DELETE FROM agregados WHERE resolucao = 60 AND inicio < ?', (agora - TELEMETRIA_MINUTOS_DIAS * 86400,))
+    cur.execute('DELETE FROM agregados WHERE resolucao = 3600 AND inicio < ?', (agora - TELEMETRIA_HORAS_DIAS * 86400,))
+    cur.execute('DELETE FROM leituras WHERE ts < ?', (agora - TELEMETRIA_LEITURAS_DIAS * 86400,))
+
+def _telemetria_resolucao(inicio):
+    """Dado mais fino ainda retido a partir de inicio: 0 (amostras brutas) ou
+    a resolução dos agregados em segundos."""
+    idade = time.time() - inicio
+    if idade <= TELEMETRIA_BRUTA_DIAS * 86400:
+        return 0
+    if idade <= TELEMETRIA_MINUTOS_DIAS * 86400:
+        return 60
+    if idade <= TELEMETRIA_HORAS_DIAS * 86400:
+        return 3600
+    return 86400
+
+def _telemetria_ler(cur, sql, ids, parametros):
+    """{equipamento_id: [linhas sem o id]} para sql com {ids} no lugar do IN."""
+    por_id = {}
+    for i in range(0, len(ids), _SQLITE_LOTE_IN):
+        lote = ids[i:i + _SQLITE_LOTE_IN]
+        cur.execute(sql.format(ids=','.join('?' * len(lote))), (*lote, *parametros))
+        for linha in cur.fetchall():
+            por_id.setdefault(linha[0], []).append(linha[1:])
+    return por_id
+
+def _telemetria_estatisticas(balde, rtts=None):
+    """Uptime e latência do balde; com os rtts brutos (ordenados) os
+    percentis são exatos, senão saem do histograma."""
+    latencia = None
+    if balde['rtt_n']:
+        latencia = {
+            'p50': _percentil(rtts, 50) if rtts is not None else _hist_percentil(balde['hist'], 50, balde['rtt_min'], balde['rtt_max']),
+            'p95': _percentil(rtts, 95) if rtts is not None else _hist_percentil(balde['hist'], 95, balde['rtt_min'], balde['rtt_max']),
+            'media': round(balde['rtt_soma'] / balde['rtt_n'], 2),
+            'min': balde['rtt_min'],
+            'max': balde['rtt_max'],
+        }
+    return {
+        'amostras': balde['total'],
+        'uptime_pct': round(100 * balde['sucessos'] / balde['total'], 2) if balde['total'] else None,
+        'latencia_ms': latencia,
+    }
+
+def _telemetria_quedas(estados, fim):
+    """Janelas de indisponibilidade a partir de (instante, online) em ordem:
+    começam na primeira falha e terminam na próxima resposta."""
+    quedas = []
+    caiu_em = None
+    for instante, online in estados:
+        if not online and caiu_em is None:
+            caiu_em = instante
+        elif online and caiu_em is not None:
+            quedas.append({'inicio': _ping_utc(caiu_em), 'fim': _ping_utc(instante), 'duracao_s': instante - caiu_em, 'em_andamento': False})
+            caiu_em = None
+    if caiu_em is not None:
+        ate = min(fim, int(time.time()))
+        quedas.append({'inicio': _ping_utc(caiu_em), 'fim': None, 'duracao_s': max(0, ate - caiu_em), 'em_andamento': True})
+    return quedas
+
+def _telemetria_disponibilidade(db_file, equipamentos, inicio, fim, serie=False):
+    """Uptime, latência (p50/p95) e quedas de cada equipamento [(id, nome)] e
+    do conjunto entre inicio e fim (epoch). Usa as amostras brutas enquanto
+    retidas; para períodos mais antigos, os agregados mais finos disponíveis."""
+    ids = list(dict.fromkeys(_json_chave(i) for i, _ in equipamentos))
+    resolucao = _telemetria_resolucao(inicio)
+    conn = _sqlite_connect(_telemetria_db(db_file))
+    try:
+        cur = conn.cursor()
+        if resolucao == 0:
+            linhas = _telemetria_ler(cur, '''
+                SELECT equipamento_id, ts, rtt_ms, sucesso FROM amostras
+                WHERE equipamento_id IN ({ids}) AND ts >= ? AND ts < ?
+                ORDER BY equipamento_id, ts
+            ''', ids, (inicio, fim))
+        else:
+            linhas = _telemetria_ler(cur, '''
+                SELECT equipamento_id, inicio, total, sucessos, rtt_n, rtt_soma, rtt_min, rtt_max, histograma FROM agregados
+                WHERE equipamento_id IN ({ids}) AND resolucao = ? AND inicio >= ? AND inicio < ?
+                ORDER BY equipamento_id, inicio
+            ''', ids, (resolucao, inicio - inicio % resolucao, fim))
+        pontos = None
+        if serie:
+            # Série: 1 min até 6 h, 1 h até 14 dias, 1 dia acima disso
+            passo = 60 if fim - inicio <= 6 * 3600 else 3600 if fim - inicio <= 14 * 86400 else 86400
+            passo = max(passo, resolucao)
+            por_inicio = {}
+            for baldes in _telemetria_ler(cur, '''
+                SELECT equipamento_id, inicio, total, sucessos, rtt_n, rtt_soma, rtt_min, rtt_max, histograma FROM agregados
+                WHERE equipamento_id IN ({ids}) AND resolucao = ? AND inicio >= ? AND inicio < ?
+            ''', ids, (passo, inicio - inicio % passo, fim)).values():
+                for balde_inicio, *valores in baldes:
+                    _telemetria_somar(por_inicio.setdefault(balde_inicio, _telemetria_balde()), _telemetria_balde(valores))
+            pontos = {'resolucao_s': passo, 'pontos': [
+                {'inicio': _ping_utc(balde_inicio), **_telemetria_estatisticas(balde)} for balde_inicio, balde in sorted(por_inicio.items())
+            ]}
+    finally:
+        conn.close()
+
+    conjunto = _telemetria_balde()
+    rtts_conjunto = []
+    itens = []
+    vistos = set()
+    for eq_id, nome in equipamentos:
+        chave = _json_chave(eq_id)
+        if chave in vistos:
+            continue
+        vistos.add(chave)
+        balde = _telemetria_balde()
+        rtts = None
+        if resolucao == 0:
+            amostras = linhas.get(chave, [])
+            for _, rtt_ms, sucesso in amostras:
+                _telemetria_amostra(balde, rtt_ms, sucesso)
+            rtts = sorted(rtt_ms for _, rtt_ms, _ in amostras if rtt_ms is not None)
+            rtts_conjunto.extend(rtts)
+            quedas = _telemetria_quedas(((ts, sucesso) for ts, _, sucesso in amostras), fim)
+        else:
+            baldes = [(balde_inicio, _telemetria_balde(valores)) for balde_inicio, *valores in linhas.get(chave, [])]
+            for _, b in baldes:
+                _telemetria_somar(balde, b)
+            quedas = _telemetria_quedas(((balde_inicio, b['sucessos'] > 0) for balde_inicio, b in baldes), fim)
+        _telemetria_somar(conjunto, balde)
+        itens.append({'id': eq_id, 'nome': nome, **_telemetria_estatisticas(balde, rtts), 'quedas': quedas})
+
+    resultado = {
+        'inicio': _ping_utc(inicio),
+        'fim': _ping_utc(fim),
+        'fonte': 'amostras' if resolucao == 0 else f'agregados de {resolucao}s',
+        **_telemetria_estatisticas(conjunto, sorted(rtts_conjunto) if resolucao == 0 else None),
+        'equipamentos': itens,
+    }
+    if pontos is not None:
+        resultado['serie'] = pontos
+    return resultado
+
+def _leituras_gravar(db_file, coletor, registros):
+    """Grava as leituras de um coletor: dicts com equipamento_id, quando, sucesso e dados."""
+    if not registros:
+        return
+    path = _telemetria_db(db_file)
+    conn = _sqlite_connect(path)
+    try:
+        cur = conn.cursor()
+        cur.executemany(
+            'INSERT OR REPLACE INTO leituras (coletor, equipamento_id, ts, sucesso, dados) VALUES (?, ?, ?, ?, ?)',
+            [(coletor, _json_chave(r['equipamento_id']), int(r['quando']), 1 if r['sucesso'] else 0,
+              _texto_dumps(r.get('dados')).decode('utf-8')) for r in registros]
+        )
+        _telemetria_reter(cur, path)
+        conn.commit()
+    finally:
+        conn.close()
+
+def _leituras_consultar(db_file, coletor, equipamento_id=None, inicio=None, fim=None):
+    """Sem equipamento_id: a leitura mais recente de cada equipamento. Com ele:
+    as leituras do equipamento entre inicio e fim, mais recentes primeiro."""
+    conn = _sqlite_connect(_telemetria_db(db_file))
+    try:
+        cur = conn.cursor()
+        if equipamento_id is None:
+            # No SQLite as colunas soltas vêm da linha que deu o MAX(ts)
+            cur.execute('''
+                SELECT equipamento_id, MAX(ts), sucesso, dados FROM leituras
+                WHERE coletor = ? GROUP BY equipamento_id
+            ''', (coletor,))
+        else:
+            cur.execute('''
+                SELECT equipamento_id, ts, sucesso, dados FROM leituras
+                WHERE coletor = ? AND equipamento_id = ? AND ts >= ? AND ts < ?
+                ORDER BY ts DESC
+            ''', (coletor, _json_chave(equipamento_id), inicio, fim))
+        return [{'equipamento_id': eq_id, 'timestamp': _ping_utc(ts), 'sucesso': bool(sucesso),
+                 'dados': _texto_loads(dados) if dados else None} for eq_id, ts, sucesso, dados in cur.fetchall()]
+    finally:
+        conn.close()
+
+# Os pings rodam em paralelo num pool de threads limitado; as sondas passam a
+# maior parte do tempo esperando rede ou processo externo. A duração total
+# fica perto da do ping mais lento, não da soma de todos.
+PING_CONCORRENCIA = int(os.environ.get('PING_CONCORRENCIA', '64'))
+PING_CONCORRENCIA_MAX = 256
+PING_TIMEOUT = float(os.environ.get('PING_TIMEOUT', '5'))
+
+# Backends de sondagem (PING_BACKEND):
+#   icmp    - echo ICMP por socket datagrama sem privilégio (Linux com
+#             net.ipv4.ping_group_range liberado, macOS); sem fork/exec
+#   tcp     - conexão TCP às portas de PING_PORTAS_TCP; recusa (RST) também
+#             conta como online, pois o host respondeu
+#   sistema - comando ping do sistema operacional, com os parâmetros certos
+#             para Windows, Linux e macOS
+#   auto    - icmp quando o kernel permite, senão sistema
+# Todos devolvem a latência em ms.
+PING_BACKEND = os.environ.get('PING_BACKEND', 'auto')
+PING_PORTAS_TCP = [int(p) for p in os.environ.get('PING_PORTAS_TCP', '80,443,41794').split(',') if p.strip()]
+
+_icmp_permitido = None
+_icmp_sequencia = itertools.count(1)
+
+def _icmp_disponivel():
+    global _icmp_permitido
+    if _icmp_permitido is None:
+        try:
+            socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP).close()
+            _icmp_permitido = True
+        except (OSError, AttributeError):
+            _icmp_permitido = False
+            # Avisado uma vez por processo; depois _ping_backend só troca de sonda
+            print("DEBUG: ICMP sem privilégio indisponível neste host; sondas icmp usam o ping do sistema")
+    return _icmp_permitido
+
+def _icmp_checksum(dados):
+    if len(dados) % 2:
+        dados += b'\0'
+    soma = sum(struct.unpack(f'!{len(dados) // 2}H', dados))
+    soma = (soma >> 16) + (soma & 0xffff)
+    soma += soma >> 16
+    return ~soma & 0xffff
+
+def _sonda_icmp(ip, timeout, portas=None):
+    sequencia = next(_icmp_sequencia) & 0xffff
+    carga = b'projeto-bd-ping'
+    cabecalho = struct.pack('!BBHHH', 8, 0, 0, 0, sequencia)
+    pacote = struct.pack('!BBHHH', 8, 0, _icmp_checksum(cabecalho + carga), 0, sequencia) + carga
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP) as sock:
+        inicio = time.perf_counter()
+        limite = inicio + timeout
+        try:
+            sock.sendto(pacote, (ip, 0))
+            while True:
+                restante = limite - time.perf_counter()
+                if restante <= 0:
+                    break
+                sock.settimeout(restante)
+                resposta, _ = sock.recvfrom(1024)
+                # O macOS entrega o cabeçalho IP junto; o Linux só o ICMP
+                if resposta and resposta[0] >> 4 == 4:
+                    resposta = resposta[(resposta[0] & 0x0f) * 4:]
+                if len(resposta) >= 8:
+                    tipo, _, _, _, seq_resposta = struct.unpack('!BBHHH', resposta[:8])
+                    if tipo == 0 and seq_resposta == sequencia:
+                        latencia = (time.perf_counter() - inicio) * 1000
+                        return 1, f'Resposta de {ip}: tempo={latencia:.1f}ms (icmp)', round(latencia, 2)
+        except socket.timeout:
+            pass
+        except OSError as e:
+            return 0, f'Falha ao pingar {ip}: {e} (icmp)', None
+    return 0, f'Sem resposta de {ip} em {timeout:g}s (icmp)', None
+
+def _sonda_tcp(ip, timeout, portas=None):
+    portas = portas or PING_PORTAS_TCP
+    fatia = timeout / max(1, len(portas))
+    falhas = []
+    for porta in portas:
+        inicio = time.perf_counter()
+        try:
+            socket.create_connection((ip, porta), timeout=fatia).close()
+            estado = 'aberta'
+        except ConnectionRefusedError:
+            estado = 'fechada'
+        except OSError as e:
+            falhas.append(f'{porta}: {e}')
+            continue
+        latencia = (time.perf_counter() - inicio) * 1000
+        return 1, f'Resposta de {ip}: porta {porta} {estado}, tempo={latencia:.1f}ms (tcp)', round(latencia, 2)
+    return 0, f'Sem resposta de {ip} nas portas TCP ({"; ".join(falhas)})', None
+
+def _ping_comando(ip, timeout):
+    espera = max(1, math.ceil(timeout))
+    if os.name == 'nt':
+        return ['ping', '-n', '1', '-w', str(int(timeout * 1000)), ip]
+    if sys.platform == 'darwin':
+        return ['ping', '-c', '1', '-t', str(espera), ip]
+    return ['ping', '-c', '1', '-W', str(espera), ip]
+
+def _sonda_sistema(ip, timeout, portas=None):
+    inicio = time.perf_counter()
+    try:
+        result = subprocess.run(_ping_comando(ip, timeout), capture_output=True, text=True, timeout=timeout + 1)
+    except Exception as e:
+        return 0, str(e), None
+    saida = result.stdout
+    # No Windows o código de saída é 0 até com "host de destino inacessível"
+    sucesso = int(result.returncode == 0 and ('TTL=' in saida or 'ttl=' in saida))
+    if not sucesso:
+        return 0, saida, None
+    medida = re.search(r'(?:time|tempo)[=<]\s*([\d.,]+)\s*ms', saida, re.IGNORECASE)
+    latencia = float(medida.group(1).replace(',', '.')) if medida else (time.perf_counter() - inicio) * 1000
+    return 1, saida, round(latencia, 2)
+
+_SONDAS = {'icmp': _sonda_icmp, 'tcp': _sonda_tcp, 'sistema': _sonda_sistema}
+
+def _ping_backend(backend=None):
+    backend = backend or PING_BACKEND
+    if backend == 'icmp' and not _icmp_disponivel():
+        return 'sistema'
+    if backend not in _SONDAS:
+        return 'icmp' if _icmp_disponivel() else 'sistema'
+    return backend
+
+def _ping_executar(ip, timeout=PING_TIMEOUT, backend=None, portas=None):
+    """Sonda um IP; devolve (sucesso, saida, latencia_ms)."""
+    backend = _ping_backend(backend)
+    if backend == 'icmp' and ':' in ip:
+        backend = 'sistema'  # o socket ICMP aqui é só IPv4
+    try:
+        return _SONDAS[backend](ip, timeout, portas)
+    except Exception as e:
+        return 0, str(e), None
+
+def _ping_em_lote(ips, concorrencia=None, timeout=None, backend=None, portas=None):
+    """Sonda todos os IPs em paralelo; resultados na mesma ordem de ips."""
+    ips = list(ips)
+    if not ips:
+        return []
+    concorrencia = max(1, min(concorrencia or PING_CONCORRENCIA, PING_CONCORRENCIA_MAX, len(ips)))
+    timeout = timeout or PING_TIMEOUT
+    backend = _ping_backend(backend)
+    inicio = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concorrencia, thread_name_prefix='ping') as executor:
+        resultados = list(executor.map(lambda ip: _ping_executar(ip, timeout, backend, portas), ips))
+    print(f"DEBUG: {len(ips)} pings ({backend}) em {time.monotonic() - inicio:.1f}s (concorrência {concorrencia}, timeout {timeout}s)")
+    return resultados
+
+def _ping_opcoes():
+    """concorrencia, timeout, backend e portas (TCP) opcionais no corpo JSON da requisição."""
+    opcoes = request.get_json(silent=True) or {}
+    try:
+        concorrencia = int(opcoes['concorrencia']) if opcoes.get('concorrencia') else None
+        timeout = float(opcoes['timeout']) if opcoes.get('timeout') else None
+        portas = [int(p) for p in opcoes['portas']] if opcoes.get('portas') else None
+    except (TypeError, ValueError):
+        return None, None, None, None
+    if timeout is not None:
+        timeout = max(0.5, min(timeout, 30.0))
+    backend = opcoes.get('backend') if opcoes.get('backend') in _SONDAS else None
+    return concorrencia, timeout, backend, portas
+
+# Monitoramento contínuo: cada coletor de _COLETORES (ping, sensores de
+# ocupação, UPS) percorre, no seu próprio intervalo, os equipamentos das
+# empresas de empresas.json, espalhando as leituras ao longo do intervalo em
+# vez de disparar todas juntas. Roda como thread do servidor web
+# (MONITOR_ATIVO=1) ou como processo separado (python server.py --monitor); a
+# trava em static/data/monitor/monitor.lock garante um único monitor por host,
+# mesmo com vários workers. O ping alimenta os logs, a série temporal e o
+# status atual de cada equipamento (em memória e em
+# static/data/monitor/<empresa>.json, lido por /ping-status sem sondar nada);
+# os demais coletores gravam em leituras, no banco de telemetria.
+MONITOR_ATIVO = os.environ.get('MONITOR_ATIVO', '0') == '1'
+MONITOR_INTERVALO = float(os.environ.get('MONITOR_INTERVALO', '300'))  # do coletor de ping
+MONITOR_GRAVACAO = float(os.environ.get('MONITOR_GRAVACAO', '15'))  # s entre gravações durante o ciclo
+_MONITOR_DIR = os.path.join(os.path.dirname(__file__), 'static', 'data', 'monitor')
+
+_ping_status = {}  # db_file -> {'assinatura', 'equipamentos': {id: status}, 'atualizado_em', 'monitor_em'}
+_ping_status_lock = threading.RLock()
+_monitor = {'pid': None, 'tentativa': 0.0, 'thread': None, 'fd': None}
+_monitor_lock = threading.Lock()
+
+def _ping_status_path(db_file):
+    return os.path.join(_MONITOR_DIR, f'{_empresa_dir_from_db(db_file)}.json')
+
+def _ping_status_ler(db_file):
+    """Status atual da empresa; relê o arquivo só quando outro processo o alterou."""
+    path = _ping_status_path(db_file)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return {'equipamentos': {}, 'atualizado_em': None, 'monitor_em': None}
+    assinatura = (st.st_mtime_ns, st.st_size, st.st_ino)
+    with _ping_status_lock:
+        entrada = _ping_status.get(db_file)
+        if entrada is not None and entrada['assinatura'] == assinatura:
+            return entrada
+        try:
+            with open(path, 'rb') as f:
+                dados = _texto_loads(f.read())
+        except (FileNotFoundError, ValueError) as e:
+            print(f"DEBUG: Status de ping ilegível em {path}: {e}")
+            return {'equipamentos': {}, 'atualizado_em': None, 'monitor_em': None}
+        entrada = {'assinatura': assinatura, 'equipamentos': dados.get('equipamentos', {}),
+                   'atualizado_em': dados.get('atualizado_em'), 'monitor_em': dados.get('monitor_em')}
+        _ping_status[db_file] = entrada
+        return entrada
+
+def _ping_status_atualizar(db_file, registros, ids_validos=None, monitor=False):
+    """Incorpora ao status os resultados (de _ping_registro); com ids_validos,
+    descarta os equipamentos que não têm mais IP ou foram excluídos."""
+    path = _ping_status_path(db_file)
+    os.makedirs(_MONITOR_DIR, exist_ok=True)
+    with _ping_status_lock:
+        fd = None
+        if fcntl is not None:
+            fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            atual = _ping_status_ler(db_file)
+            equipamentos = dict(atual['equipamentos'])
+            for r in registros:
+                chave = str(r['equipamento_id'])
+                anterior = equipamentos.get(chave) or {}
+                sucesso = bool(r['sucesso'])
+                quando = _ping_utc(r['quando'])
+                mudou = anterior.get('sucesso') != sucesso or not anterior.get('desde')
+                equipamentos[chave] = {
+                    'id': r['equipamento_id'],
+                    'nome': r['nome_equipamento'],
+                    'ip': r['ip'],
+                    'sucesso': sucesso,
+                    'latencia_ms': r['latencia_ms'],
+                    'timestamp': quando,
+                    'desde': quando if mudou else anterior['desde'],
+                    'falhas_seguidas': 0 if sucesso else anterior.get('falhas_seguidas', 0) + 1
+                }
+            if ids_validos is not None:
+                validos = {str(i) for i in ids_validos}
+                equipamentos = {k: v for k, v in equipamentos.items() if k in validos}
+            agora = _ping_utc(time.time())
+            dados = {'equipamentos': equipamentos, 'atualizado_em': agora,
+                     'monitor_em': agora if monitor else atual.get('monitor_em')}
+            assinatura = _gravar_arquivo_atomico(path, _texto_dumps(dados))
+            _ping_status[db_file] = {'assinatura': assinatura, **dados}
+        finally:
+            if fd is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+
+def _monitor_empresas():
+    """db_file de cada empresa cadastrada em empresas.json."""
+    path = os.path.join(os.path.dirname(__file__), 'static', 'data', 'empresas.json')
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            empresas = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return []
+    dbs = []
+    for e in empresas:
+        db_file = e.get('db_file') or f"json:empresa_{e.get('id')}"
+        if _is_json_mode(db_file) or os.path.exists(db_file):
+            dbs.append(db_file)
+    return dbs
+
+def _monitor_equipamentos(db_file, tipos):
+    """(id, nome, ip, sala) dos equipamentos com IP cujo tipo (ou nome) está em tipos."""
+    tipos = {t.casefold() for t in tipos}
+    alvos = {}
+    if _is_json_mode(db_file):
+        for eq in _json_read_table(db_file, 'equipamentos'):
+            if (eq.get('tipo') or '').casefold() not in tipos and (eq.get('nome') or '').casefold() not in tipos:
+                continue
+            dados = eq.get('dados') or {}
+            ip = (dados.get('ip1') or dados.get('ip') or '').strip()
+            if not ip:
+                continue
+            sala = _json_get(db_file, 'salas', eq.get('sala_id')) if eq.get('sala_id') is not None else None
+            alvos.setdefault(eq.get('id'), (eq.get('id'), eq.get('nome'), ip, sala.get('nome', '') if sala else ''))
+        return list(alvos.values())
+    conn = _sqlite_connect(db_file)
+    try:
+        cur = conn.cursor()
+        marcadores = ','.join('?' * len(tipos))
+        cur.execute(f'''
+            SELECT e.id, e.nome, d.valor, COALESCE(s.nome, '')
+            FROM equipamentos e
+            JOIN equipamento_dados d ON d.equipamento_id = e.id AND d.chave IN ('ip1', 'ip')
+            LEFT JOIN salas s ON s.id = e.sala_id
+            WHERE (LOWER(e.tipo) IN ({marcadores}) OR LOWER(e.nome) IN ({marcadores}))
+              AND d.valor IS NOT NULL AND TRIM(d.valor) != ''
+            ORDER BY e.id, d.chave DESC
+        ''', (*tipos, *tipos))
+        for eq_id, nome, ip, sala in cur.fetchall():
+            alvos.setdefault(eq_id, (eq_id, nome, ip.strip(), sala))
+        return list(alvos.values())
+    finally:
+        conn.close()
+
+def _coletor_modulo(nome):
+    """Importa um dos scripts de coleta de server/ (ocupacao_salas, ups)."""
+    pasta = os.path.join(os.path.dirname(__file__), 'server')
+    if pasta not in sys.path:
+        sys.path.append(pasta)
+    return importlib.import_module(nome)
+
+_coletor_navegadores = {}
+_coletor_navegadores_lock = threading.Lock()
+
+def _coletor_pool(nome, tamanho, fabrica):
+    """Pool de navegadores headless do coletor, criado na primeira leitura e
+    fechado na saída do processo."""
+    with _coletor_navegadores_lock:
+        pool = _coletor_navegadores.get(nome)
+        if pool is None:
+            pool = _coletor_modulo('ocupacao_salas').PoolNavegadores(tamanho, fabrica)
+            _coletor_navegadores[nome] = pool
+            atexit.register(pool.fechar)
+        return pool
+
+def _coletor_ping(alvo, backend=None):
+    eq_id, nome, ip = alvo
+    return _ping_registro(eq_id, nome, ip, _ping_executar(ip, PING_TIMEOUT, backend))
+
+def _coletor_ping_gravar(db_file, registros, validos=None):
+    _ping_logs_registrar(db_file, registros)
+    _ping_status_atualizar(db_file, registros, validos, monitor=True)
+
+def _coletor_ocupacao(alvo):
+    eq_id, nome, ip, sala = alvo
+    modulo = _coletor_modulo('ocupacao_salas')
+    pool = _coletor_pool('ocupacao', _COLETORES['ocupacao']['concorrencia'], modulo.novo_navegador)
+    try:
+        status = modulo.consultar_sensor(modulo.sensor(sala, ip), pool)
+    except Exception as e:
+        print(f"DEBUG: Sensor de ocupação {nome} ({ip}) sem leitura: {e}")
+        status = 'Indefinido'
+    sucesso = status not in ('Indefinido', 'Tag div não encontrada')
+    return {'equipamento_id': eq_id, 'quando': time.time(), 'sucesso': sucesso,
+            'dados': {'status': status, 'ocupada': status.casefold() in ('occupied', 'ocupada', 'ocupado') if sucesso else None}}
+
+def _coletor_ups(alvo):
+    eq_id, nome, ip, sala = alvo
+    modulo = _coletor_modulo('ups')
+    pool = _coletor_pool('ups', _COLETORES['ups']['concorrencia'], modulo.novo_navegador)
+    try:
+        with pool.emprestar() as driver:
+            dados = modulo.ler_ups(driver, ip)
+        sucesso = True
+    except Exception as e:
+        print(f"DEBUG: UPS {nome} ({ip}) sem leitura: {e}")
+        dados, sucesso = {'erro': str(e)}, False
+    return {'equipamento_id': eq_id, 'quando': time.time(), 'sucesso': sucesso, 'dados': dados}
+
+# Coletores do monitor. Cada um tem intervalo e concorrência próprios e roda
+# na sua thread: 'alvos' lista os equipamentos de uma empresa, 'coletar' lê um
+# equipamento e 'gravar' grava um lote de resultados da empresa. 'preparar',
+# opcional, roda uma vez por ciclo e o que devolve vai como segundo argumento
+# de 'coletar' (ex.: o backend de ping já resolvido).
+_COLETORES = {
+    'ping': {
+        'intervalo': MONITOR_INTERVALO,
+        'concorrencia': min(PING_CONCORRENCIA, PING_CONCORRENCIA_MAX),
+        'alvos': _ping_alvos,
+        'preparar': _ping_backend,
+        'coletar': _coletor_ping,
+        'gravar': _coletor_ping_gravar,
+    },
+    'ocupacao': {
+        'intervalo': float(os.environ.get('MONITOR_OCUPACAO_INTERVALO', '300')),
+        'concorrencia': int(os.environ.get('MONITOR_OCUPACAO_CONCORRENCIA', '4')),
+        'alvos': lambda db_file: _monitor_equipamentos(db_file, ('Sensor',)),
+        'coletar': _coletor_ocupacao,
+        'gravar': lambda db_file, registros, validos=None: _leituras_gravar(db_file, 'ocupacao', registros),
+    },
+    'ups': {
+        'intervalo': float(os.environ.get('MONITOR_UPS_INTERVALO', '120')),
+        'concorrencia': int(os.environ.get('MONITOR_UPS_CONCORRENCIA', '2')),
+        'alvos': lambda db_file: _monitor_equipamentos(db_file, ('UPS', 'No-break', 'Nobreak')),
+        'coletar': _coletor_ups,
+        'gravar': lambda db_file, registros, validos=None: _leituras_gravar(db_file, 'ups', registros),
+    },
+}
+# Só o ping por padrão: ocupação e UPS abrem navegadores headless (Selenium +
+# Edge) e entram quando pedidos, ex.: MONITOR_COLETORES=ping,ocupacao,ups
+MONITOR_COLETORES = [c.strip() for c in os.environ.get('MONITOR_COLETORES', 'ping').split(',') if c.strip()]
+
+def _monitor_ciclo(nome, parar):
+    """Uma passada do coletor por todos os equipamentos de todas as empresas,
+    com as leituras distribuídas ao longo do intervalo. Devolve quantos
+    equipamentos foram lidos."""
+    coletor = _COLETORES[nome]
+    intervalo = coletor['intervalo']
+    fila = []
+    validos = {}
+    for db_file in _monitor_empresas():
+        try:
+            alvos = coletor['alvos'](db_file)
+        except Exception as e:
+            print(f"DEBUG: Coletor '{nome}' não conseguiu listar equipamentos de {db_file}: {e}")
+            continue
+        validos[db_file] = {alvo[0] for alvo in alvos}
+        fila.extend((db_file, alvo) for alvo in alvos)
+
+    pendentes = {}
+    pendentes_lock = threading.Lock()
+    preparar = coletor.get('preparar')
+    contexto = (preparar(),) if preparar else ()
+
+    def ler(db_file, alvo):
+        resultado = coletor['coletar'](alvo, *contexto)
+        with pendentes_lock:
+            pendentes.setdefault(db_file, []).append(resultado)
+
+    def gravar(final=False):
+        with pendentes_lock:
+            lote = dict(pendentes)
+            pendentes.clear()
+        for db_file in (validos if final else lote):
+            try:
+                coletor['gravar'](db_file, lote.get(db_file, []), validos[db_file] if final else None)
+            except Exception as e:
+                print(f"DEBUG: Coletor '{nome}' falhou ao gravar resultados de {db_file}: {e}")
+
+    inicio = time.monotonic()
+    espacamento = intervalo / len(fila) if fila else 0
+    ultima_gravacao = inicio
+    enviados = 0
+    with ThreadPoolExecutor(max_workers=max(1, coletor['concorrencia']), thread_name_prefix=f'monitor-{nome}') as executor:
+        for i, (db_file, alvo) in enumerate(fila):
+            espera = inicio + i * espacamento - time.monotonic()
+            if espera > 0 and parar.wait(espera):
+                break
+            if time.monotonic() - ultima_gravacao >= MONITOR_GRAVACAO:
+                gravar()
+                ultima_gravacao = time.monotonic()
+            executor.submit(ler, db_file, alvo)
+            enviados += 1
+    gravar(final=not parar.is_set())
+    print(f"DEBUG: Coletor '{nome}' leu {enviados} equipamento(s) de {len(validos)} empresa(s) em {time.monotonic() - inicio:.1f}s")
+    return enviados
+
+def _monitor_principal():
+    """Monitor contínuo em primeiro plano (python server.py --monitor e
+    server/verificar.py); sai com erro se outro processo do host já o roda."""
+    _monitor['fd'] = _monitor_travar()
+    if _monitor['fd'] is None:
+        print('Outro processo deste host já executa o monitor')
+        raise SystemExit(1)
+    try:
+        _monitor_executar()
+    except KeyboardInterrupt:
+        pass
+
+def _monitor_laco(nome, parar):
+    intervalo = _COLETORES[nome]['intervalo']
+    while not parar.is_set():
+        inicio = time.monotonic()
+        try:
+            _monitor_ciclo(nome, parar)
+        except Exception as e:
+            print(f"DEBUG: Falha no ciclo do coletor '{nome}': {e}")
+        parar.wait(max(1.0, intervalo - (time.monotonic() - inicio)))
+
+def _monitor_executar(parar=None):
+    """Roda os coletores de MONITOR_COLETORES, cada um na sua thread, até parar."""
+    parar = parar or threading.Event()
+    threads = []
+    for nome in MONITOR_COLETORES:
+        if nome not in _COLETORES:
+            print(f"DEBUG: Coletor desconhecido em MONITOR_COLETORES: {nome}")
+            continue
+        thread = threading.Thread(target=_monitor_laco, args=(nome, parar), name=f'monitor-{nome}', daemon=True)
+        thread.start()
+        threads.append(thread)
+        print(f"DEBUG: Coletor '{nome}' iniciado (pid {os.getpid()}, intervalo {_COLETORES[nome]['intervalo']:g}s, concorrência {_COLETORES[nome]['concorrencia']})")
+    try:
+        while any(t.is_alive() for t in threads):
+            parar.wait(1)
+    finally:
+        parar.set()
+
+def _monitor_travar():
+    """fd da trava do monitor, ou None se outro processo do host já monitora."""
+    os.makedirs(_MONITOR_DIR, exist_ok=True)
+    fd = os.open(os.path.join(_MONITOR_DIR, 'monitor.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+    if fcntl is not None:  # no Windows vale um único processo
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+    return fd
+
+def _monitor_iniciar():
+    """Sobe a thread do monitor neste processo se nenhum outro do host o roda;
+    quem perdeu tenta de novo a cada intervalo, caso o dono tenha saído."""
+    if _monitor['pid'] == os.getpid() and (_monitor['thread'] or time.monotonic() - _monitor['tentativa'] < MONITOR_INTERVALO):
+        return
+    with _monitor_lock:
+        if _monitor['pid'] == os.getpid() and (_monitor['thread'] or time.monotonic() - _monitor['tentativa'] < MONITOR_INTERVALO):
+            return
+        if _monitor['pid'] != os.getpid():
+            # Processo filho de um fork: a thread e a trava ficaram com o pai
+            _monitor.update(thread=None, fd=None)
+        _monitor.update(pid=os.getpid(), tentativa=time.monotonic())
+        fd = _monitor_travar()
+        if fd is None:
+            return
+        thread = threading.Thread(target=_monitor_executar, name='monitor', daemon=True)
+        _monitor.update(fd=fd, thread=thread)
+        thread.start()
+
+@app.before_request
+def _monitor_requisicao():
+    if MONITOR_ATIVO:
+        _monitor_iniciar()
+
+@app.route('/ping-equipamentos', methods=['POST'])
+@login_required
+def ping_equipamentos():
+    db_file = session.get('db')
+    if not db_file:
+        return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
+    
+    concorrencia, timeout, backend, portas = _ping_opcoes()
+    # Buscar equipamentos com IP cadastrado
+    alvos = _ping_alvos(db_file)
+    pings = _ping_em_lote([ip for _, _, ip in alvos], concorrencia, timeout, backend, portas)
+    registros = [_ping_registro(eq_id, nome, ip, resultado) for (eq_id, nome, ip), resultado in zip(alvos, pings)]
+    
+    # Uma gravação por execução, não uma por equipamento
+    _ping_logs_registrar(db_file, registros)
+    _ping_status_atualizar(db_file, registros, ids_validos={eq_id for eq_id, _, _ in alvos})
+    
+    resultados = [
+        {'id': r['equipamento_id'], 'nome': r['nome_equipamento'], 'ip': r['ip'], 'sucesso': bool(r['sucesso']),
+         'latencia_ms': r['latencia_ms'], 'saida': r['resultado']}
+        for r in registros
+    ]
+    equipamentos_online = sum(1 for r in resultados if r['sucesso'])
+    equipamentos_offline = len(resultados) - equipamentos_online
+    
+    # Log da execução do ping
+    detalhes = f'Ping executado em {len(alvos)} equipamentos: {equipamentos_online} online, {equipamentos_offline} offline'
+    registrar_log(session.get('username', 'desconhecido'), 'EXECUTAR_PING', detalhes, 'sucesso', db_file)
+    
+    return jsonify({'status': 'ok', 'resultados': resultados})
+
+@app.route('/ping-status')
+@login_required
+def ping_status():
+    """Último resultado de cada equipamento (do monitor ou da última execução
+    manual), lido do status em memória, sem disparar sondagem."""
+    db_file = session.get('db')
+    if not db_file:
+        return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
+    status = _ping_status_ler(db_file)
+    equipamentos = sorted(status['equipamentos'].values(), key=lambda s: (str(s.get('nome') or '').lower(), str(s.get('id'))))
+    monitor_ativo = False
+    if status.get('monitor_em'):
+        ultima = datetime.strptime(status['monitor_em'], '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc)
+        # Durante um ciclo o monitor grava a cada MONITOR_GRAVACAO segundos
+        monitor_ativo = (datetime.now(timezone.utc) - ultima).total_seconds() <= MONITOR_INTERVALO + MONITOR_GRAVACAO + PING_TIMEOUT + 60
+    online = sum(1 for s in equipamentos if s.get('sucesso'))
+    return jsonify({
+        'monitor': {'ativo': monitor_ativo, 'intervalo': MONITOR_INTERVALO, 'ultima_sondagem': status.get('monitor_em')},
+        'atualizado_em': status.get('atualizado_em'),
+        'online': online,
+        'offline': len(equipamentos) - online,
+        'equipamentos': equipamentos
+    })
+
+def _telemetria_periodo():
+    """(inicio, fim) em epoch: ?periodo=30m|24h|7d (padrão 24h) até agora ou
+    ?inicio=/?fim= em ISO 8601 (sem fuso = UTC). Levanta ValueError se inválido."""
+    def instante(texto):
+        momento = datetime.fromisoformat(texto.rstrip('Z'))
+        if momento.tzinfo is None:
+            momento = momento.replace(tzinfo=timezone.utc)
+        return int(momento.astimezone(timezone.utc).timestamp())
+    # fim é exclusivo: o padrão inclui o segundo corrente
+    fim = instante(request.args['fim']) if request.args.get('fim') else int(time.time()) + 1
+    if request.args.get('inicio'):
+        inicio = instante(request.args['inicio'])
+    else:
+        medida = re.fullmatch(r'(\d+)([mhd])', request.args.get('periodo', '24h'))
+        if not medida:
+            raise ValueError(request.args.get('periodo'))
+        inicio = fim - int(medida.group(1)) * {'m': 60, 'h': 3600, 'd': 86400}[medida.group(2)]
+    if inicio >= fim:
+        raise ValueError('inicio >= fim')
+    return inicio, fim
+
+def _telemetria_resposta(db_file, equipamentos, **identificacao):
+    try:
+        inicio, fim = _telemetria_periodo()
+    except ValueError:
+        return jsonify({'status': 'erro', 'mensagem': 'Período inválido: use ?periodo=30m, 24h, 7d... ou ?inicio= e ?fim= em ISO 8601 (sem fuso = UTC)'}), 400
+    serie = request.args.get('serie') in ('1', 'true')
+    return jsonify({**identificacao, **_telemetria_disponibilidade(db_file, equipamentos, inicio, fim, serie)})
 
-@app.route('/patch-panel-portas/<int:porta_id>/desconectar-equipamento', methods=['PUT'])
-@admin_required
-def desconectar_equipamento_patch_panel(porta_id):
+@app.route('/api/equipamentos/<int:equipamento_id>/disponibilidade')
+@login_required
+def disponibilidade_equipamento(equipamento_id):
+    """Uptime, latência p50/p95 e quedas do equipamento no período (?periodo=24h, ?serie=1)."""
     db_file = session.get('db')
     if not db_file:
         return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
-    
     if _is_json_mode(db_file):
-        patch_panel_portas = _json_read_table(db_file, 'patch_panel_portas')
-        
-        porta_pp = next((p for p in patch_panel_portas if p.get('id') == porta_id), None)
-        if not porta_pp:
-            return jsonify({'status': 'erro', 'mensagem': 'Porta do patch panel não encontrada'}), 404
-        
-        if porta_pp.get('status') != 'ocupada':
-            return jsonify({'status': 'erro', 'mensagem': 'Porta não está ocupada'}), 400
-        
-        equipamento_id = porta_pp.get('equipamento_id')
-        
-        # Desconectar equipamento
-        porta_pp['equipamento_id'] = None
-        porta_pp['data_conexao'] = None
-        
-        # Se a porta estava mapeada para um switch, voltar para mapeada
-        if porta_pp.get('switch_id'):
-            porta_pp['status'] = 'mapeada'
-        else:
-            porta_pp['status'] = 'livre'
-        
-        _json_write_table(db_file, 'patch_panel_portas', patch_panel_portas)
-        
-        registrar_log(session.get('username'), 'DESCONECTAR_EQUIPAMENTO_PATCH_PANEL', 
-                     f'Equipamento {equipamento_id} desconectado da porta {porta_id}', 'sucesso', db_file)
-        
-        return jsonify({'status': 'ok', 'mensagem': 'Equipamento desconectado com sucesso!'})
+        equipamento = _json_get(db_file, 'equipamentos', equipamento_id)
+        equipamentos = [(equipamento.get('id'), equipamento.get('nome'))] if equipamento else []
     else:
-        return jsonify({'status': 'erro', 'mensagem': 'Modo SQLite não implementado'}), 501
+        conn = _sqlite_connect(db_file)
+        cur = conn.cursor()
+        cur.execute('SELECT id, nome FROM equipamentos WHERE id = ?', (equipamento_id,))
+        equipamentos = cur.fetchall()
+        conn.close()
+    if not equipamentos:
+        return jsonify({'status': 'erro', 'mensagem': 'Equipamento não encontrado'}), 404
+    return _telemetria_resposta(db_file, equipamentos, equipamento_id=equipamento_id)
 
-@app.route('/patch-panel-portas/<int:porta_id>', methods=['PUT'])
-@tecnico_required
-def atualizar_patch_panel_porta(porta_id: int):
+@app.route('/api/salas/<int:sala_id>/disponibilidade')
+@login_required
+def disponibilidade_sala(sala_id):
+    """Disponibilidade dos equipamentos da sala, somada e por equipamento."""
     db_file = session.get('db')
     if not db_file:
         return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
-    dados = request.get_json() or {}
     if _is_json_mode(db_file):
-        portas = _json_read_table(db_file, 'patch_panel_portas')
-        porta = next((p for p in portas if p.get('id') == porta_id), None)
-        if not porta:
-            return jsonify({'status': 'erro', 'mensagem': 'Porta não encontrada'}), 404
-        if 'switch_id' in dados:
-            porta['switch_id'] = dados.get('switch_id') if dados.get('switch_id') not in ['', None] else None
-        if 'porta_switch' in dados:
-            valor = dados.get('porta_switch')
-            porta['porta_switch'] = int(valor) if str(valor).isdigit() else None
-        _json_write_table(db_file, 'patch_panel_portas', portas)
-        registrar_log(session.get('username','desconhecido'), 'ATUALIZAR_PATCH_PANEL_PORTA', f'Porta {porta_id} atualizada', 'sucesso', db_file)
-        return jsonify({'status': 'ok'})
+        if not _json_get(db_file, 'salas', sala_id):
+            return jsonify({'status': 'erro', 'mensagem': 'Sala não encontrada'}), 404
+        equipamentos = [(e.get('id'), e.get('nome')) for e in _json_buscar(db_file, 'equipamentos', 'sala_id', sala_id)]
     else:
-        return jsonify({'erro': 'Modo SQLite não suportado nesta rota no ambiente atual'}), 501
+        conn = _sqlite_connect(db_file)
+        cur = conn.cursor()
+        cur.execute('SELECT 1 FROM salas WHERE id = ?', (sala_id,))
+        if not cur.fetchone():
+            conn.close()
+            return jsonify({'status': 'erro', 'mensagem': 'Sala não encontrada'}), 404
+        cur.execute('SELECT id, nome FROM equipamentos WHERE sala_id = ? ORDER BY id', (sala_id,))
+        equipamentos = cur.fetchall()
+        conn.close()
+    return _telemetria_resposta(db_file, equipamentos, sala_id=sala_id)
 
-@app.route('/ping-equipamentos', methods=['POST'])
+@app.route('/api/switches/<int:switch_id>/disponibilidade')
 @login_required
-def ping_equipamentos():
+def disponibilidade_switch(switch_id):
+    """Disponibilidade dos equipamentos com conexão ativa nas portas do switch."""
     db_file = session.get('db')
     if not db_file:
         return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
-    
     if _is_json_mode(db_file):
-        equipamentos = _json_read_table(db_file, 'equipamentos')
-        # Buscar equipamentos com IP cadastrado
-        equipamentos_com_ip = []
-        for eq in equipamentos:
-            dados = eq.get('dados', {})
-            ip = dados.get('ip1') or dados.get('ip')
-            if ip and ip.strip():
-                equipamentos_com_ip.append({
-                    'id': eq.get('id'),
-                    'nome': eq.get('nome'),
-                    'ip': ip
-                })
-        
-        resultados = []
-        equipamentos_online = 0
-        equipamentos_offline = 0
-        
-        for eq in equipamentos_com_ip:
-            eq_id = eq['id']
-            nome = eq['nome']
-            ip = eq['ip']
-            
-            try:
-                result = subprocess.run(['ping', '-n', '1', ip], capture_output=True, text=True, timeout=5)
-                saida = result.stdout
-                sucesso = int('TTL=' in saida or 'ttl=' in saida)
-                if sucesso:
-                    equipamentos_online += 1
-                else:
-                    equipamentos_offline += 1
-            except Exception as e:
-                saida = str(e)
-                sucesso = 0
-                equipamentos_offline += 1
-            
-            # Salva no log
-            ping_logs = _json_read_table(db_file, 'ping_logs')
-            novo_log = {
-                'id': _json_next_id(ping_logs),
-                'equipamento_id': eq_id,
-                'nome_equipamento': nome,
-                'ip': ip,
-                'resultado': saida,
-                'sucesso': sucesso,
-                'timestamp': datetime.now().isoformat()
-            }
-            ping_logs.append(novo_log)
-            _json_write_table(db_file, 'ping_logs', ping_logs)
-            
-            resultados.append({'id': eq_id, 'nome': nome, 'ip': ip, 'sucesso': bool(sucesso), 'saida': saida})
-        
-        # Log da execução do ping
-        total_equipamentos = len(equipamentos_com_ip)
-        detalhes = f'Ping executado em {total_equipamentos} equipamentos: {equipamentos_online} online, {equipamentos_offline} offline'
-        registrar_log(session.get('username', 'desconhecido'), 'EXECUTAR_PING', detalhes, 'sucesso', db_file)
-        
-        return jsonify({'status': 'ok', 'resultados': resultados})
+        if not _json_get(db_file, 'switches', switch_id):
+            return jsonify({'status': 'erro', 'mensagem': 'Switch não encontrado'}), 404
+        equipamentos = []
+        for porta in _json_buscar(db_file, 'switch_portas', 'switch_id', switch_id):
+            for conexao in _json_buscar(db_file, 'conexoes', 'porta_id', porta.get('id')):
+                if conexao.get('status') != 'ativa':
+                    continue
+                equipamento = _json_get(db_file, 'equipamentos', conexao.get('equipamento_id'))
+                if equipamento:
+                    equipamentos.append((equipamento.get('id'), equipamento.get('nome')))
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
-        # Busca todos os equipamentos com IP cadastrado
-        cur.execute("""
-            SELECT e.id, e.nome, d.valor as ip
-            FROM equipamentos e
-            JOIN equipamento_dados d ON e.id = d.equipamento_id
-            WHERE d.chave = 'ip1' AND d.valor IS NOT NULL AND d.valor != ''
-        """)
+        cur.execute('SELECT 1 FROM switches WHERE id = ?', (switch_id,))
+        if not cur.fetchone():
+            conn.close()
+            return jsonify({'status': 'erro', 'mensagem': 'Switch não encontrado'}), 404
+        cur.execute('''
+            SELECT e.id, e.nome
+            FROM switch_portas sp
+            JOIN conexoes c ON c.porta_id = sp.id AND c.status = 'ativa'
+            JOIN equipamentos e ON e.id = c.equipamento_id
+            WHERE sp.switch_id = ?
+            ORDER BY sp.numero_porta
+        ''', (switch_id,))
         equipamentos = cur.fetchall()
-        resultados = []
-        equipamentos_online = 0
-        equipamentos_offline = 0
-        
-        for eq_id, nome, ip in equipamentos:
-            try:
-                result = subprocess.run(['ping', '-n', '1', ip], capture_output=True, text=True, timeout=5)
-                saida = result.stdout
-                sucesso = int('TTL=' in saida or 'ttl=' in saida)
-                if sucesso:
-                    equipamentos_online += 1
-                else:
-                    equipamentos_offline += 1
-            except Exception as e:
-                saida = str(e)
-                sucesso = 0
-                equipamentos_offline += 1
-            # Salva no log
-            cur.execute(
-                'INSERT INTO ping_logs (equipamento_id, nome_equipamento, ip, resultado, sucesso) VALUES (?, ?, ?, ?, ?)',
-                (eq_id, nome, ip, saida, sucesso)
-            )
-            resultados.append({'id': eq_id, 'nome': nome, 'ip': ip, 'sucesso': bool(sucesso), 'saida': saida})
-        
-        conn.commit()
         conn.close()
-        
-        # Log da execução do ping
-        total_equipamentos = len(equipamentos)
-        detalhes = f'Ping executado em {total_equipamentos} equipamentos: {equipamentos_online} online, {equipamentos_offline} offline'
-        registrar_log(session.get('username', 'desconhecido'), 'EXECUTAR_PING', detalhes, 'sucesso', db_file)
-        
-        return jsonify({'status': 'ok', 'resultados': resultados})
+    return _telemetria_resposta(db_file, equipamentos, switch_id=switch_id)
+
+@app.route('/api/telemetria/<coletor>')
+@login_required
+def telemetria_coletor(coletor):
+    """Leitura mais recente de cada equipamento no coletor (ocupacao, ups)."""
+    db_file = session.get('db')
+    if not db_file:
+        return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
+    if coletor not in _COLETORES or coletor == 'ping':
+        return jsonify({'status': 'erro', 'mensagem': f'Coletor desconhecido: {coletor} (o ping fica em /ping-status)'}), 404
+    leituras = _leituras_consultar(db_file, coletor)
+    # Nome e sala atuais de cada equipamento lido
+    if _is_json_mode(db_file):
+        for leitura in leituras:
+            equipamento = _json_get(db_file, 'equipamentos', leitura['equipamento_id']) or {}
+            sala = _json_get(db_file, 'salas', equipamento.get('sala_id')) if equipamento.get('sala_id') is not None else None
+            leitura['nome'] = equipamento.get('nome')
+            leitura['sala'] = sala.get('nome') if sala else 'Sem sala'
+    elif leituras:
+        conn = _sqlite_connect(db_file)
+        cur = conn.cursor()
+        ids = [leitura['equipamento_id'] for leitura in leituras]
+        info = {}
+        for i in range(0, len(ids), _SQLITE_LOTE_IN):
+            lote = ids[i:i + _SQLITE_LOTE_IN]
+            cur.execute(f'''
+                SELECT e.id, e.nome, s.nome FROM equipamentos e LEFT JOIN salas s ON s.id = e.sala_id
+                WHERE e.id IN ({','.join('?' * len(lote))})
+            ''', lote)
+            info.update((eq_id, (nome, sala)) for eq_id, nome, sala in cur.fetchall())
+        conn.close()
+        for leitura in leituras:
+            nome, sala = info.get(leitura['equipamento_id'], (None, None))
+            leitura['nome'] = nome
+            leitura['sala'] = sala or 'Sem sala'
+    leituras.sort(key=lambda l: (str(l.get('sala') or ''), str(l.get('nome') or '')))
+    return jsonify({'coletor': coletor, 'intervalo': _COLETORES[coletor]['intervalo'], 'leituras': leituras})
+
+@app.route('/api/equipamentos/<int:equipamento_id>/leituras')
+@login_required
+def leituras_equipamento(equipamento_id):
+    """Histórico de leituras do equipamento num coletor (?coletor=ups&periodo=24h)."""
+    db_file = session.get('db')
+    if not db_file:
+        return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
+    coletor = request.args.get('coletor', '')
+    if coletor not in _COLETORES or coletor == 'ping':
+        return jsonify({'status': 'erro', 'mensagem': 'Informe ?coletor=ocupacao ou ?coletor=ups'}), 400
+    try:
+        inicio, fim = _telemetria_periodo()
+    except ValueError:
+        return jsonify({'status': 'erro', 'mensagem': 'Período inválido: use ?periodo=30m, 24h, 7d... ou ?inicio= e ?fim= em ISO 8601 (sem fuso = UTC)'}), 400
+    return jsonify({
+        'equipamento_id': equipamento_id,
+        'coletor': coletor,
+        'inicio': _ping_utc(inicio),
+        'fim': _ping_utc(fim),
+        'leituras': _leituras_consultar(db_file, coletor, equipamento_id, inicio, fim)
+    })
+
+PING_LOGS_LIMITE_PADRAO = 100
+PING_LOGS_LIMITE_MAX = 1000
 
 @app.route('/ping-logs')
 @login_required
 def ping_logs():
+    """Logs de ping, mais recentes primeiro. Paginação: ?limit=N (padrão 100)
+    e ?before=<id do último log recebido> para a página seguinte."""
     db_file = session.get('db')
     if not db_file:
         return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
+    try:
+        limite = int(request.args.get('limit', PING_LOGS_LIMITE_PADRAO))
+        antes_id = request.args.get('before')
+        antes_id = int(antes_id) if antes_id not in (None, '') else None
+    except ValueError:
+        return jsonify({'status': 'erro', 'mensagem': 'limit e before devem ser números inteiros'}), 400
+    limite = max(1, min(limite, PING_LOGS_LIMITE_MAX))
     if _is_json_mode(db_file):
-        ping_logs = _json_read_table(db_file, 'ping_logs')
-        equipamentos = _json_read_table(db_file, 'equipamentos')
-        salas = _json_read_table(db_file, 'salas')
-        conexoes = _json_read_table(db_file, 'conexoes')
-        switch_portas = _json_read_table(db_file, 'switch_portas')
-        switches = _json_read_table(db_file, 'switches')
-        
-        # Criar dicionários para lookup
-        equipamentos_dict = {e.get('id'): e for e in equipamentos}
-        salas_dict = {s.get('id'): s for s in salas}
-        switch_portas_dict = {sp.get('id'): sp for sp in switch_portas}
-        switches_dict = {s.get('id'): s for s in switches}
-        
-        logs = []
-        # Ordenar por timestamp (mais recentes primeiro) e limitar a 100
-        ping_logs_ordenados = sorted(ping_logs, key=lambda x: x.get('timestamp', ''), reverse=True)[:100]
-        
-        for p in ping_logs_ordenados:
-            eq_id = p.get('equipamento_id')
-            equipamento = equipamentos_dict.get(eq_id) if eq_id else None
-            sala = salas_dict.get(equipamento.get('sala_id')) if equipamento else None
+        try:
+            ping_logs_ordenados = _ping_logs_pagina(db_file, limite, antes_id)
+        except LookupError:
+            return jsonify({'status': 'erro', 'mensagem': 'Log de ping do cursor não encontrado'}), 400
+        
+        # Equipamento, sala, MAC e switch/porta por equipamento da página,
+        # pelos índices (id e conexoes.equipamento_id), uma vez cada
+        info_equipamentos = {}
+        for eq_id in {p.get('equipamento_id') for p in ping_logs_ordenados if p.get('equipamento_id')}:
+            equipamento = _json_get(db_file, 'equipamentos', eq_id)
+            sala = _json_get(db_file, 'salas', equipamento.get('sala_id')) if equipamento and equipamento.get('sala_id') is not None else None
             
             # Buscar MAC do equipamento
             mac = ''
@@ -3395,20 +6234,25 @@ def ping_logs():
             # Buscar switch e porta (se houver conexão ativa)
             switch = ''
             porta = ''
-            if eq_id:
-                conexao_ativa = next((c for c in conexoes if c.get('equipamento_id') == eq_id and c.get('status') == 'ativa'), None)
-                if conexao_ativa:
-                    porta_switch = switch_portas_dict.get(conexao_ativa.get('porta_id'))
-                    if porta_switch:
-                        switch_obj = switches_dict.get(porta_switch.get('switch_id'))
-                        if switch_obj:
-                            switch = switch_obj.get('nome', '')
-                            porta = porta_switch.get('numero_porta', '')
-            
+            conexao_ativa = next((c for c in _json_buscar(db_file, 'conexoes', 'equipamento_id', eq_id) if c.get('status') == 'ativa'), None)
+            if conexao_ativa:
+                porta_switch = _json_get(db_file, 'switch_portas', conexao_ativa.get('porta_id'))
+                if porta_switch:
+                    switch_obj = _json_get(db_file, 'switches', porta_switch.get('switch_id'))
+                    if switch_obj:
+                        switch = switch_obj.get('nome', '')
+                        porta = porta_switch.get('numero_porta', '')
+            info_equipamentos[eq_id] = (equipamento, sala, mac, switch, porta)
+        
+        logs = []
+        for p in ping_logs_ordenados:
+            equipamento, sala, mac, switch, porta = info_equipamentos.get(p.get('equipamento_id')) or (None, None, '', '', '')
             logs.append(dict(
+                id=p.get('id'),
                 nome=p.get('nome_equipamento'), 
                 ip=p.get('ip'), 
                 sucesso=p.get('sucesso'), 
+                latencia_ms=p.get('latencia_ms'),
                 timestamp=p.get('timestamp'), 
                 sala=sala.get('nome') if sala else 'Sem sala', 
                 mac=mac, 
@@ -3418,36 +6262,45 @@ def ping_logs():
         
         return jsonify(logs)
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
-        cur.execute('''
-            SELECT p.nome_equipamento, p.ip, p.sucesso, p.timestamp, s.nome as sala_nome, e.id as equipamento_id
+        filtro_cursor = ''
+        parametros = []
+        if antes_id is not None:
+            cur.execute('SELECT timestamp, id FROM ping_logs WHERE id=?', (antes_id,))
+            cursor = cur.fetchone()
+            if not cursor:
+                conn.close()
+                return jsonify({'status': 'erro', 'mensagem': 'Log de ping do cursor não encontrado'}), 400
+            filtro_cursor = 'WHERE (p.timestamp, p.id) < (?, ?)'
+            parametros.extend(cursor)
+        # MAC e switch/porta da conexão ativa vêm na mesma consulta
+        cur.execute(f'''
+            SELECT p.nome_equipamento, p.ip, p.sucesso, p.timestamp, s.nome as sala_nome, p.id,
+                   (SELECT d.valor FROM equipamento_dados d
+                    WHERE d.equipamento_id = e.id AND d.chave IN ('mac', 'mac1') LIMIT 1) as mac,
+                   sw.nome as switch_nome, sp.numero_porta, c.id as conexao_id, p.latencia_ms
             FROM ping_logs p
             LEFT JOIN equipamentos e ON p.equipamento_id = e.id
             LEFT JOIN salas s ON e.sala_id = s.id
-            ORDER BY p.timestamp DESC
-            LIMIT 100
-        ''')
+            LEFT JOIN conexoes c ON c.id = (
+                SELECT c2.id FROM conexoes c2
+                JOIN switch_portas sp2 ON c2.porta_id = sp2.id
+                JOIN switches s2 ON sp2.switch_id = s2.id
+                WHERE c2.equipamento_id = e.id AND c2.status = 'ativa' LIMIT 1
+            )
+            LEFT JOIN switch_portas sp ON c.porta_id = sp.id
+            LEFT JOIN switches sw ON sp.switch_id = sw.id
+            {filtro_cursor}
+            ORDER BY p.timestamp DESC, p.id DESC
+            LIMIT ?
+        ''', (*parametros, limite))
         logs = []
         for row in cur.fetchall():
-            eq_id = row[5]
-            # Busca MAC
-            cur.execute("SELECT valor FROM equipamento_dados WHERE equipamento_id=? AND chave IN ('mac', 'mac1') LIMIT 1", (eq_id,))
-            mac_row = cur.fetchone()
-            mac = mac_row[0] if mac_row else ''
-            # Busca switch e porta (se houver conexão ativa)
-            cur.execute('''
-                SELECT s.nome, sp.numero_porta
-                FROM conexoes c
-                JOIN switch_portas sp ON c.porta_id = sp.id
-                JOIN switches s ON sp.switch_id = s.id
-                WHERE c.equipamento_id=? AND c.status='ativa' LIMIT 1
-            ''', (eq_id,))
-            sw_row = cur.fetchone()
-            switch = sw_row[0] if sw_row else ''
-            porta = sw_row[1] if sw_row else ''
             logs.append(dict(
-                nome=row[0], ip=row[1], sucesso=row[2], timestamp=row[3], sala=row[4] or 'Sem sala', mac=mac, switch=switch, porta=porta
+                id=row[5], nome=row[0], ip=row[1], sucesso=row[2], latencia_ms=row[10], timestamp=row[3], sala=row[4] or 'Sem sala',
+                mac=row[6] if row[6] is not None else '',
+                switch=row[7] if row[9] is not None else '', porta=row[8] if row[9] is not None else ''
             ))
         conn.close()
         return jsonify(logs)
@@ -3466,14 +6319,14 @@ def limpar_ping_logs():
     
     if _is_json_mode(db_file):
         # Limpar todos os logs de ping
-        _json_write_table(db_file, 'ping_logs', [])
+        _ping_logs_limpar(db_file)
         
         # Log da limpeza dos logs de ping
         registrar_log(session.get('username', 'desconhecido'), 'LIMPAR_PING_LOGS', 'Todos os logs de ping foram limpos', 'sucesso', db_file)
         
         return jsonify({'status': 'ok'})
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         cur.execute('DELETE FROM ping_logs')
         conn.commit()
@@ -3647,7 +6500,7 @@ def api_salas():
             print(f"Erro ao carregar salas: {e}")
             return jsonify({'erro': 'Erro interno do servidor'}), 500
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         cur.execute('SELECT id, nome FROM salas')
         salas = [{'id': row[0], 'nome': row[1]} for row in cur.fetchall()]
@@ -3687,16 +6540,8 @@ def salvar_layout_sala(sala_id):
         _json_write_table(db_file, 'sala_layouts', rows)
         print("DEBUG: Layout salvo em arquivo JSON")
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
-        # Cria a tabela se não existir
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS sala_layouts (
-                sala_id INTEGER PRIMARY KEY,
-                layout_json TEXT,
-                atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
         # Salva ou atualiza o layout
         cur.execute('''
             INSERT INTO sala_layouts (sala_id, layout_json, atualizado_em)
@@ -3729,7 +6574,7 @@ def obter_layout_sala(sala_id):
                 return jsonify(r.get('layout_json') or {})
         return jsonify({'erro': 'Nenhum layout salvo para esta sala.'}), 404
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         cur.execute('SELECT layout_json FROM sala_layouts WHERE sala_id=?', (sala_id,))
         row = cur.fetchone()
@@ -3790,7 +6635,7 @@ def obter_conexoes_reais_sala(sala_id):
         conexoes.sort(key=lambda x: x.get('data_conexao', ''), reverse=True)
         return jsonify(conexoes)
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         
         # Buscar conexões de cabos ativas na sala
@@ -3842,7 +6687,7 @@ def obter_layout_hibrido_sala(sala_id):
     if not db_file:
         return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
     
-    conn = sqlite3.connect(db_file)
+    conn = _sqlite_connect(db_file)
     cur = conn.cursor()
     
     # Buscar layout manual
@@ -3935,7 +6780,7 @@ def salas_com_layout():
     db_file = session.get('db')
     if not db_file:
         return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
-    conn = sqlite3.connect(db_file)
+    conn = _sqlite_connect(db_file)
     cur = conn.cursor()
     cur.execute('''
         SELECT s.id, s.nome
@@ -3984,7 +6829,7 @@ def criar_conexao_cabo():
             
             # Criar nova conexão
             nova_conexao = {
-                'id': _json_next_id(conexoes_cabos),
+                'id': _json_proximo_id(db_file, 'conexoes_cabos'),
                 'cabo_id': dados.get('cabo_id'),
                 'equipamento_origem_id': dados.get('equipamento_origem_id'),
                 'equipamento_destino_id': dados.get('equipamento_destino_id'),
@@ -4210,7 +7055,7 @@ def substituir_cabo(conexao_id):
             
             # Criar nova conexão com o novo cabo
             nova_conexao = {
-                'id': _json_next_id(conexoes_cabos),
+                'id': _json_proximo_id(db_file, 'conexoes_cabos'),
                 'cabo_id': dados.get('novo_cabo_id'),
                 'equipamento_origem_id': conexao_original.get('equipamento_origem_id'),
                 'equipamento_destino_id': conexao_original.get('equipamento_destino_id'),
@@ -4371,7 +7216,7 @@ def criar_cabo():
             
             # Criar novo cabo
             novo_cabo = {
-                'id': _json_next_id(cabos),
+                'id': _json_proximo_id(db_file, 'cabos'),
                 'codigo_unico': dados.get('codigo_unico'),
                 'tipo': dados.get('tipo'),
                 'comprimento': dados.get('comprimento'),
@@ -4462,8 +7307,7 @@ def obter_cabo(cabo_id):
     
     if _is_json_mode(db_file):
         try:
-            cabos = _json_read_table(db_file, 'cabos')
-            cabo = next((c for c in cabos if c.get('id') == cabo_id), None)
+            cabo = _json_get(db_file, 'cabos', cabo_id)
             
             if not cabo:
                 return jsonify({'erro': 'Cabo não encontrado'}), 404
@@ -4527,6 +7371,525 @@ def excluir_cabo(cabo_id):
             return jsonify({'status': 'erro', 'mensagem': 'Erro interno do servidor'}), 500
     else:
         return jsonify({'status': 'erro', 'mensagem': 'Modo SQLite não implementado'}), 501
+# Snapshot do dashboard: tudo o que dashboard.html usa numa única resposta,
+# montado numa passada pelas tabelas e guardado já serializado. A chave do
+# cache é a versão dos dados (assinaturas das tabelas JSON, ou do arquivo
+# SQLite e do seu WAL), então gravações feitas por outros workers também
+# invalidam; as deste processo descartam a entrada no fim da requisição.
+_DASHBOARD_TABELAS = ('equipamentos', 'salas', 'switches', 'switch_portas', 'conexoes',
+                      'patch_panel_portas', 'cabos', 'conexoes_cabos')
+_dashboard_cache = {}
+_dashboard_lock = threading.Lock()
+
+def _dados_versao(db_file, tabelas):
+    """Versão das tabelas: muda sempre que alguma delas (ou, no SQLite, o banco) é gravada."""
+    if _is_json_mode(db_file):
+        empresa_dir = _empresa_data_dir(db_file)
+        cache = _json_cache_empresa(empresa_dir)
+        with cache['trava']:
+            return tuple((entrada['assinatura'], entrada['jornal'])
+                         for entrada in (_json_tabela_atual(empresa_dir, t) for t in tabelas))
+    versao = []
+    for path in (db_file, db_file + '-wal'):
+        try:
+            st = os.stat(path)
+            versao.append((st.st_mtime_ns, st.st_size, st.st_ino))
+        except FileNotFoundError:
+            versao.append(None)
+    return tuple(versao)
+
+def _dashboard_equipamento(eq_id, nome, tipo, marca, sala_id, defeito, dados):
+    return {
+        'id': eq_id,
+        'nome': nome,
+        'tipo': tipo,
+        'marca': marca,
+        'sala_id': sala_id,
+        'defeito': int(defeito or 0),
+        # Só o que o dashboard consulta: se há IP/MAC cadastrado
+        'dados': {k: dados[k] for k in ('ip1', 'mac1', 'ip2', 'mac2') if dados.get(k)} if isinstance(dados, dict) else {}
+    }
+
+def _dashboard_ler(db_file):
+    """(equipamentos, salas, switches, portas, cabos, conexoes_cabos) reduzidos
+    aos campos do dashboard, com as mesmas regras das rotas de listagem."""
+    if _is_json_mode(db_file):
+        equipamentos = [
+            _dashboard_equipamento(e.get('id'), e.get('nome'), e.get('tipo'), e.get('marca'),
+                                   e.get('sala_id'), e.get('defeito'), e.get('dados') or {})
+            for e in _json_read_table(db_file, 'equipamentos') if not is_patch_panel(e)
+        ]
+        salas = [{'id': s.get('id'), 'nome': s.get('nome'), 'andar_id': s.get('andar_id')}
+                 for s in _json_read_table(db_file, 'salas')]
+        switches = [{'id': s.get('id'), 'nome': s.get('nome'), 'data_criacao': s.get('data_criacao')}
+                    for s in _json_read_table(db_file, 'switches')]
+        switches.sort(key=lambda x: x.get('data_criacao') or '', reverse=True)
+        # Porta ocupada: conexão ativa ou mapeamento de patch panel (como em /switch-portas)
+        ativas = {c.get('porta_id') for c in _json_read_table(db_file, 'conexoes') if c.get('status') == 'ativa'}
+        mapeadas = {(m.get('switch_id'), int(m.get('porta_switch') or 0))
+                    for m in _json_read_table(db_file, 'patch_panel_portas')}
+        ids_switches = {s['id'] for s in switches}
+        portas = [
+            {'switch_id': p.get('switch_id'),
+             'status': 'ocupada' if p.get('id') in ativas
+                       or (p.get('switch_id'), int(p.get('numero_porta') or 0)) in mapeadas else 'livre'}
+            for p in _json_read_table(db_file, 'switch_portas') if p.get('switch_id') in ids_switches
+        ]
+        cabos = [{'id': c.get('id'), 'tipo': c.get('tipo')} for c in _json_read_table(db_file, 'cabos')]
+        ids_cabos = {c['id'] for c in cabos}
+        conexoes_cabos = [
+            {'id': cc.get('id'), 'cabo_id': cc.get('cabo_id'), 'data_desconexao': cc.get('data_desconexao')}
+            for cc in _json_read_table(db_file, 'conexoes_cabos') if cc.get('cabo_id') in ids_cabos
+        ]
+        return equipamentos, salas, switches, portas, cabos, conexoes_cabos
+
+    conn = _sqlite_connect(db_file)
+    cur = conn.cursor()
+    cur.execute('SELECT id, nome, tipo, marca, sala_id, defeito FROM equipamentos')
+    rows = cur.fetchall()
+    dados_por_equipamento = _sqlite_dados_equipamentos(
+        cur, [row[0] for row in rows], chaves=('ip1', 'mac1', 'ip2', 'mac2'))
+    equipamentos = [_dashboard_equipamento(*row, dados_por_equipamento.get(row[0], {})) for row in rows]
+    cur.execute('SELECT id, nome, andar_id FROM salas')
+    salas = [dict(id=row[0], nome=row[1], andar_id=row[2]) for row in cur.fetchall()]
+    cur.execute('SELECT id, nome, data_criacao FROM switches ORDER BY data_criacao DESC')
+    switches = [dict(id=row[0], nome=row[1], data_criacao=row[2]) for row in cur.fetchall()]
+    cur.execute('''
+        SELECT sp.switch_id,
+               EXISTS (SELECT 1 FROM conexoes c WHERE c.porta_id = sp.id AND c.status = 'ativa')
+               OR EXISTS (SELECT 1 FROM patch_panel_portas ppp
+                          WHERE ppp.switch_id = sp.switch_id AND ppp.porta_switch = sp.numero_porta
+                            AND ppp.equipamento_id IS NOT NULL)
+        FROM switch_portas sp
+        JOIN switches s ON s.id = sp.switch_id
+        ORDER BY sp.switch_id, sp.numero_porta
+    ''')
+    portas = [{'switch_id': row[0], 'status': 'ocupada' if row[1] else 'livre'} for row in cur.fetchall()]
+    conn.close()
+    # Cabos só existem no modo JSON
+    return equipamentos, salas, switches, portas, [], []
+
+def _dashboard_resumo(equipamentos, salas, switches, portas, cabos, conexoes_cabos):
+    nomes_salas = {s['id']: s['nome'] for s in salas}
+
+    def contar(itens, chave):
+        contagem = {}
+        for item in itens:
+            valor = chave(item)
+            contagem[valor] = contagem.get(valor, 0) + 1
+        return dict(sorted(contagem.items(), key=lambda kv: -kv[1]))
+
+    def por_sala(itens):
+        return [{'sala_id': sala_id, 'nome': nomes_salas.get(sala_id), 'total': total}
+                for sala_id, total in contar(itens, lambda e: e['sala_id']).items()]
+
+    por_switch = {sw['id']: {'switch_id': sw['id'], 'nome': sw['nome'], 'total': 0, 'ocupadas': 0, 'livres': 0}
+                  for sw in switches}
+    for p in portas:
+        linha = por_switch[p['switch_id']]
+        linha['total'] += 1
+        linha['ocupadas' if p['status'] == 'ocupada' else 'livres'] += 1
+    ocupadas = sum(linha['ocupadas'] for linha in por_switch.values())
+    fontes = [e for e in equipamentos if 'fonte' in (e['tipo'] or '').lower()]
+    ativas = sum(1 for cc in conexoes_cabos if not cc['data_desconexao'])
+    return {
+        'equipamentos': {
+            'total': len(equipamentos),
+            'com_defeito': sum(1 for e in equipamentos if e['defeito']),
+            'por_tipo': contar(equipamentos, lambda e: e['tipo'] or 'Não especificado'),
+            'por_marca': contar(equipamentos, lambda e: e['marca'] or 'Não especificada'),
+            'por_sala': por_sala(equipamentos),
+        },
+        'salas': {'total': len(salas)},
+        'portas': {
+            'switches': len(switches),
+            'total': len(portas),
+            'ocupadas': ocupadas,
+            'livres': len(portas) - ocupadas,
+            'por_switch': list(por_switch.values()),
+        },
+        'cabos': {
+            'total': len(cabos),
+            'por_tipo': contar(cabos, lambda c: c['tipo'] or 'Não especificado'),
+            'conexoes_ativas': ativas,
+            'conexoes_inativas': len(conexoes_cabos) - ativas,
+        },
+        'fontes': {
+            'total': len(fontes),
+            'com_defeito': sum(1 for f in fontes if f['defeito']),
+            'funcionando': sum(1 for f in fontes if not f['defeito']),
+            'por_sala': por_sala(fontes),
+        },
+    }
+
+def _dashboard_snapshot(db_file):
+    """Corpo JSON (bytes) do snapshot, do cache enquanto os dados não mudarem."""
+    # A versão é lida antes dos dados: uma gravação no meio só faz a próxima
+    # requisição remontar, nunca servir dado velho com versão nova
+    versao = _dados_versao(db_file, _DASHBOARD_TABELAS)
+    with _dashboard_lock:
+        entrada = _dashboard_cache.get(db_file)
+    if entrada is not None and entrada[0] == versao:
+        return entrada[1]
+    inicio = time.monotonic()
+    equipamentos, salas, switches, portas, cabos, conexoes_cabos = _dashboard_ler(db_file)
+    corpo = _texto_dumps({
+        'gerado_em': _ping_utc(time.time()),
+        'resumo': _dashboard_resumo(equipamentos, salas, switches, portas, cabos, conexoes_cabos),
+        'equipamentos': equipamentos,
+        'salas': salas,
+        'switches': switches,
+        'portas': portas,
+        'cabos': cabos,
+        'conexoes_cabos': conexoes_cabos,
+    })
+    with _dashboard_lock:
+        _dashboard_cache[db_file] = (versao, corpo)
+    print(f"DEBUG: Snapshot do dashboard montado em {(time.monotonic() - inicio) * 1000:.1f} ms ({len(corpo)} bytes)")
+    return corpo
+
+@app.after_request
+def _dashboard_invalidar(resposta):
+    if request.method not in ('GET', 'HEAD', 'OPTIONS') and resposta.status_code < 400:
+        db_file = session.get('db')
+        if db_file:
+            with _dashboard_lock:
+                _dashboard_cache.pop(db_file, None)
+    return resposta
+
+@app.route('/api/dashboard/snapshot')
+@login_required
+def dashboard_snapshot():
+    db_file = session.get('db')
+    if not db_file:
+        return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
+    return app.response_class(_dashboard_snapshot(db_file), mimetype='application/json')
+
+# Topologia física por empresa, em memória: nós são equipamentos, switches e
+# suas portas, patch panels e suas portas, e cabos; arestas são as ligações
+# (conexões, mapeamentos de patch panel, cabos). Cada linha das tabelas de
+# origem contribui com alguns nós e arestas, e o grafo guarda só essa
+# contribuição por linha, não a linha. Quando uma linha muda, a contribuição
+# antiga é retirada e a nova aplicada, então o grafo acompanha as gravações
+# sem ser remontado: no modo JSON só as linhas que o journal alterou desde a
+# última consulta são revistas; no SQLite, que não tem versão por tabela, as
+# tabelas são relidas quando o banco muda. Referências por número de porta
+# (switch_id + porta, patch panel + porta) viram nós "@" de apelido, o que
+# mantém a contribuição de cada linha independente das outras tabelas. Ids
+# passam por _json_chave: "7" e 7 são o mesmo nó.
+_TOPOLOGIA_TABELAS = ('equipamentos', 'switches', 'switch_portas', 'conexoes',
+                      'patch_panels', 'patch_panel_portas', 'cabos', 'conexoes_cabos')
+# Arestas de pertinência (switch -> porta, patch panel -> porta) não levam
+# sinal de uma porta a outra: não são percorridas ao traçar caminhos
+_TOPOLOGIA_PORTA = 'porta'
+_topologia = {}
+_topologia_travas = {}  # db_file -> Lock do grafo da empresa
+_topologia_lock = threading.Lock()  # só para criar as travas
+
+def _topologia_trava(db_file):
+    with _topologia_lock:
+        trava = _topologia_travas.get(db_file)
+        if trava is None:
+            trava = _topologia_travas[db_file] = threading.Lock()
+        return trava
+
+def _topologia_int(valor):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+def _topologia_contribuicao(tabela, row):
+    """(nós {nó: atributos}, arestas [(a, b, rótulo)]) de uma linha."""
+    def ref(campo):
+        return _json_chave(row.get(campo))
+
+    rid = ref('id')
+    if tabela == 'equipamentos':
+        return {('equipamento', rid): {'nome': row.get('nome'), 'tipo': row.get('tipo'),
+                                       'sala_id': row.get('sala_id')}}, []
+    if tabela == 'switches':
+        return {('switch', rid): {'nome': row.get('nome'), 'marca': row.get('marca'),
+                                  'modelo': row.get('modelo')}}, []
+    if tabela == 'switch_portas':
+        no = ('porta_switch', rid)
+        return {no: {'switch_id': row.get('switch_id'), 'numero_porta': row.get('numero_porta'),
+                     'descricao': row.get('descricao')}}, [
+            (('switch', ref('switch_id')), no, _TOPOLOGIA_PORTA),
+            (no, ('porta_switch@', ref('switch_id'), _topologia_int(row.get('numero_porta'))), 'apelido'),
+        ]
+    if tabela == 'conexoes':
+        if row.get('status') != 'ativa':
+            return {}, []
+        return {}, [(('porta_switch', ref('porta_id')), ('equipamento', ref('equipamento_id')), 'conexao')]
+    if tabela == 'patch_panels':
+        return {('patch_panel', rid): {'nome': row.get('nome'), 'codigo': row.get('codigo'),
+                                       'prefixo_keystone': row.get('prefixo_keystone')}}, []
+    if tabela == 'patch_panel_portas':
+        no = ('porta_patch_panel', rid)
+        arestas = [
+            (('patch_panel', ref('patch_panel_id')), no, _TOPOLOGIA_PORTA),
+            (no, ('porta_patch_panel@', ref('patch_panel_id'), _topologia_int(row.get('numero_porta'))), 'apelido'),
+        ]
+        if row.get('switch_id') and row.get('porta_switch') is not None:
+            arestas.append((no, ('porta_switch@', ref('switch_id'), _topologia_int(row.get('porta_switch'))), 'mapeamento'))
+        if row.get('equipamento_id'):
+            arestas.append((no, ('equipamento', ref('equipamento_id')), 'conexao'))
+        return {no: {'patch_panel_id': row.get('patch_panel_id'), 'numero_porta': row.get('numero_porta'),
+                     'status': row.get('status')}}, arestas
+    if tabela == 'cabos':
+        return {('cabo', rid): {'codigo_unico': row.get('codigo_unico'), 'tipo': row.get('tipo')}}, []
+    if tabela == 'conexoes_cabos':
+        if row.get('data_desconexao') or not row.get('cabo_id'):
+            return {}, []
+        destino_id = ref('equipamento_destino_id')
+        if row.get('tipo_destino') == 'patch_panel':
+            porta = _topologia_int(row.get('porta_destino'))
+            destino = ('porta_patch_panel@', destino_id, porta) if porta is not None else ('patch_panel', destino_id)
+        else:
+            destino = ('equipamento', destino_id)
+        cabo = ('cabo', ref('cabo_id'))
+        return {}, [(('equipamento', ref('equipamento_origem_id')), cabo, 'cabo'), (cabo, destino, 'cabo')]
+    return {}, []
+
+def _topologia_aplicar(grafo, contribuicao, sinal):
+    nos, arestas = contribuicao
+    for no, info in nos.items():
+        if sinal > 0:
+            grafo['info'][no] = info
+        else:
+            grafo['info'].pop(no, None)
+    adj = grafo['adj']
+    for a, b, rotulo in arestas:
+        # Contagem por aresta: duas linhas podem produzir a mesma ligação
+        for x, y in ((a, b), (b, a)):
+            vizinhos = adj.setdefault(x, {})
+            n = vizinhos.get((y, rotulo), 0) + sinal
+            if n > 0:
+                vizinhos[(y, rotulo)] = n
+            else:
+                vizinhos.pop((y, rotulo), None)
+                if not vizinhos:
+                    del adj[x]
+
+def _topologia_linha(grafo, tabela, chave, row):
+    """Troca a contribuição da linha pela de row (None = linha removida).
+    Devolve 1 se o grafo mudou."""
+    contribuicoes = grafo['contribuicoes'][tabela]
+    anterior = contribuicoes.get(chave)
+    nova = _topologia_contribuicao(tabela, row) if row is not None else None
+    if nova == anterior:
+        return 0
+    if anterior is not None:
+        _topologia_aplicar(grafo, anterior, -1)
+        del contribuicoes[chave]
+    if nova is not None:
+        _topologia_aplicar(grafo, nova, 1)
+        contribuicoes[chave] = nova
+    return 1
+
+def _topologia_tabela(grafo, tabela, rows):
+    """Revê todas as linhas da tabela; as que sumiram saem do grafo."""
+    atuais = {}
+    for row in rows:
+        if isinstance(row, dict) and row.get('id') is not None:
+            atuais[_json_chave(row['id'])] = row
+    alteradas = 0
+    for chave in [c for c in grafo['contribuicoes'][tabela] if c not in atuais]:
+        alteradas += _topologia_linha(grafo, tabela, chave, None)
+    for chave, row in atuais.items():
+        alteradas += _topologia_linha(grafo, tabela, chave, row)
+    return alteradas
+
+def _topologia_json(grafo, db_file):
+    """Aplica ao grafo só as linhas que o journal alterou desde a última vez;
+    as linhas são lidas direto do cache, sem cópia."""
+    empresa_dir = _empresa_data_dir(db_file)
+    cache = _json_cache_empresa(empresa_dir)
+    alteradas = 0
+    with cache['trava']:
+        for tabela in _TOPOLOGIA_TABELAS:
+            entrada = _json_tabela_atual(empresa_dir, tabela)
+            marca = grafo['marcas'].get(tabela)
+            ids, atual = _json_mudancas_desde(entrada, marca)
+            if atual == marca:
+                continue
+            if ids is None:
+                alteradas += _topologia_tabela(grafo, tabela, entrada['rows'])
+            else:
+                pos = _jornal_posicoes(entrada)
+                for chave in ids:
+                    i = pos.get(chave)
+                    alteradas += _topologia_linha(grafo, tabela, chave, entrada['rows'][i] if i is not None else None)
+            grafo['marcas'][tabela] = atual
+    return alteradas
+
+def _topologia_sqlite(grafo, db_file):
+    versao = _dados_versao(db_file, _TOPOLOGIA_TABELAS)
+    if grafo['marcas'].get(None) == versao:
+        return 0
+    conn = _sqlite_connect(db_file)
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+    alteradas = 0
+    try:
+        for tabela in _TOPOLOGIA_TABELAS:
+            try:
+                cur.execute(f'SELECT * FROM {tabela}')
+                rows = (dict(row) for row in cur)
+            except sqlite3.OperationalError:
+                rows = []  # cabos e conexoes_cabos só existem no modo JSON
+            alteradas += _topologia_tabela(grafo, tabela, rows)
+    finally:
+        conn.close()
+    grafo['marcas'][None] = versao
+    return alteradas
+
+def _topologia_grafo(db_file):
+    """Grafo atualizado da empresa (usar com _topologia_trava(db_file))."""
+    grafo = _topologia.get(db_file)
+    if grafo is None:
+        grafo = _topologia[db_file] = {'marcas': {}, 'adj': {}, 'info': {},
+                                       'contribuicoes': {t: {} for t in _TOPOLOGIA_TABELAS}}
+    inicio = time.monotonic()
+    if _is_json_mode(db_file):
+        alteradas = _topologia_json(grafo, db_file)
+    else:
+        alteradas = _topologia_sqlite(grafo, db_file)
+    if alteradas:
+        print(f"DEBUG: Topologia de {db_file}: {alteradas} linha(s) aplicadas em {(time.monotonic() - inicio) * 1000:.1f} ms "
+              f"({len(grafo['info'])} nós)")
+    return grafo
+
+def _topologia_no(grafo, no):
+    return {**grafo['info'].get(no, {}), 'elemento': no[0], 'id': no[1]}
+
+def _topologia_vizinhos(grafo, no):
+    """Vizinhos percorríveis: as arestas de pertinência ficam de fora."""
+    for (vizinho, rotulo) in grafo['adj'].get(no, ()):
+        if rotulo != _TOPOLOGIA_PORTA:
+            yield vizinho, rotulo
+
+def _topologia_caminho(grafo, origem):
+    """Busca em largura até a porta de switch mais próxima: [(nó, rótulo)] da
+    origem ao switch, ou None se o equipamento não chega a nenhum switch."""
+    anterior = {origem: None}
+    fila = [origem]
+    for no in fila:
+        if no[0] == 'porta_switch':
+            caminho = []
+            while no is not None:
+                caminho.append((no, anterior[no][1] if anterior[no] else None))
+                no = anterior[no][0] if anterior[no] else None
+            caminho.reverse()
+            switch = ('switch', _json_chave(grafo['info'].get(caminho[-1][0], {}).get('switch_id')))
+            if switch in grafo['info']:
+                caminho.append((switch, _TOPOLOGIA_PORTA))
+            return caminho
+        for vizinho, rotulo in _topologia_vizinhos(grafo, no):
+            if vizinho not in anterior:
+                anterior[vizinho] = (no, rotulo)
+                fila.append(vizinho)
+    return None
+
+def _topologia_alcance(grafo, fontes, bloqueados, limite=None):
+    """Nós alcançáveis a partir de fontes sem passar por bloqueados (nem sair de
+    limite, se informado). Portas de switch não são atravessadas: cada uma é
+    a ponta de um enlace até o switch."""
+    vistos = set(fontes)
+    fila = list(fontes)
+    for no in fila:
+        if no[0] == 'porta_switch' and no not in fontes:
+            continue
+        for vizinho, _ in _topologia_vizinhos(grafo, no):
+            if vizinho in vistos or vizinho in bloqueados or (limite is not None and vizinho not in limite):
+                continue
+            vistos.add(vizinho)
+            fila.append(vizinho)
+    return vistos
+
+def _topologia_impacto(grafo, falhas):
+    """Equipamentos que perdem todo caminho até uma porta de switch se os nós
+    de falhas caírem. Só a região ligada às falhas é visitada."""
+    vizinhos = {v for no in falhas for v, _ in _topologia_vizinhos(grafo, no)} - falhas
+    regiao = _topologia_alcance(grafo, vizinhos, falhas)
+    portas = {no for no in regiao | falhas if no[0] == 'porta_switch'}
+    antes = _topologia_alcance(grafo, portas, set(), limite=regiao | falhas)
+    depois = _topologia_alcance(grafo, portas - falhas, falhas, limite=regiao)
+    return [no for no in antes - depois - falhas if no[0] == 'equipamento']
+
+def _topologia_resposta_caminho(grafo, caminho):
+    passos = []
+    ligacao = None
+    for no, rotulo in caminho:
+        # Nós de apelido só ligam tabelas: a ligação real é a que chega neles
+        if no[0].endswith('@'):
+            ligacao = ligacao if rotulo == 'apelido' else rotulo
+            continue
+        passo = _topologia_no(grafo, no)
+        passo['ligacao'] = ligacao if rotulo == 'apelido' else rotulo
+        ligacao = None
+        passos.append(passo)
+    return passos
+
+@app.route('/api/topologia/caminho/<int:equipamento_id>')
+@login_required
+def topologia_caminho(equipamento_id):
+    """Caminho físico do equipamento até a porta de switch que o alimenta
+    (cabos, portas de patch panel, mapeamentos)."""
+    db_file = session.get('db')
+    if not db_file:
+        return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
+    with _topologia_trava(db_file):
+        grafo = _topologia_grafo(db_file)
+        origem = ('equipamento', equipamento_id)
+        if origem not in grafo['info']:
+            return jsonify({'status': 'erro', 'mensagem': 'Equipamento não encontrado'}), 404
+        caminho = _topologia_caminho(grafo, origem)
+        if caminho is None:
+            return jsonify({'equipamento': _topologia_no(grafo, origem), 'conectado': False,
+                            'switch': None, 'porta_switch': None, 'caminho': []})
+        passos = _topologia_resposta_caminho(grafo, caminho)
+    porta = next((p for p in passos if p['elemento'] == 'porta_switch'), None)
+    switch = passos[-1] if passos[-1]['elemento'] == 'switch' else None
+    return jsonify({'equipamento': passos[0], 'conectado': True, 'switch': switch,
+                    'porta_switch': porta, 'saltos': len(passos) - 1, 'caminho': passos})
+
+# tipo na URL -> (tipo do nó, se as portas do nó também caem com ele)
+_TOPOLOGIA_FALHAS = {
+    'switch': ('switch', True),
+    'patch-panel': ('patch_panel', True),
+    'porta-switch': ('porta_switch', False),
+    'porta-patch-panel': ('porta_patch_panel', False),
+    'equipamento': ('equipamento', False),
+    'cabo': ('cabo', False),
+}
+
+@app.route('/api/topologia/impacto/<tipo>/<int:item_id>')
+@login_required
+def topologia_impacto(tipo, item_id):
+    """Raio de impacto: o que fica sem rede se o item cair, por exemplo
+    /api/topologia/impacto/switch/3."""
+    db_file = session.get('db')
+    if not db_file:
+        return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
+    if tipo not in _TOPOLOGIA_FALHAS:
+        return jsonify({'status': 'erro', 'mensagem': f"Tipo inválido; use {', '.join(_TOPOLOGIA_FALHAS)}"}), 400
+    tipo_no, com_portas = _TOPOLOGIA_FALHAS[tipo]
+    with _topologia_trava(db_file):
+        grafo = _topologia_grafo(db_file)
+        no = (tipo_no, item_id)
+        if no not in grafo['info']:
+            return jsonify({'status': 'erro', 'mensagem': 'Item não encontrado'}), 404
+        falhas = {no}
+        if com_portas:
+            falhas |= {v for (v, rotulo) in grafo['adj'].get(no, ()) if rotulo == _TOPOLOGIA_PORTA}
+        afetados = sorted((_topologia_no(grafo, n) for n in _topologia_impacto(grafo, falhas)),
+                          key=lambda e: (str(e.get('sala_id')), str(e.get('nome'))))
+        item = _topologia_no(grafo, no)
+    return jsonify({'falha': item, 'portas_afetadas': len(falhas) - 1,
+                    'total': len(afetados), 'equipamentos': afetados})
+
 @app.route('/api/salas/<int:sala_id>/switches-usados')
 @login_required
 def switches_usados_sala(sala_id):
@@ -4535,51 +7898,36 @@ def switches_usados_sala(sala_id):
         return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
     
     if _is_json_mode(db_file):
-        switches = _json_read_table(db_file, 'switches')
-        switch_portas = _json_read_table(db_file, 'switch_portas')
-        patch_panel_portas = _json_read_table(db_file, 'patch_panel_portas')
-        patch_panels = _json_read_table(db_file, 'patch_panels')
-        equipamentos = _json_read_table(db_file, 'equipamentos')
-        salas = _json_read_table(db_file, 'salas')
-        conexoes = _json_read_table(db_file, 'conexoes')
+        salas_dict = {s.get('id'): s for s in _json_read_table(db_file, 'salas')}
+        patch_panels_dict = {pp.get('id'): pp for pp in _json_read_table(db_file, 'patch_panels')}
+        equipamentos_dict = {}
 
-        # Dicionários de apoio
-        equipamentos_dict = {e.get('id'): e for e in equipamentos}
-        salas_dict = {s.get('id'): s for s in salas}
-        patch_panels_dict = {pp.get('id'): pp for pp in patch_panels}
-        switch_portas_by_id = {sp.get('id'): sp for sp in switch_portas}
-        switch_portas_by_switch = {}
-        for sp in switch_portas:
-            switch_portas_by_switch.setdefault(sp.get('switch_id'), []).append(sp)
-
-        # índices rápidos
-        ppp_index = {}
-        for m in patch_panel_portas:
-            key = (m.get('switch_id'), m.get('porta_switch'))
-            ppp_index[key] = m
-        conexao_por_porta = {c.get('porta_id'): c for c in conexoes if c.get('status') == 'ativa'}
-
-        # Identificar switches relevantes pela sala
+        def obter_equipamento(equipamento_id):
+            if equipamento_id not in equipamentos_dict:
+                equipamentos_dict[equipamento_id] = _json_get(db_file, 'equipamentos', equipamento_id) if equipamento_id else None
+            return equipamentos_dict[equipamento_id]
+
+        # Identificar switches relevantes a partir dos equipamentos da sala
         switch_ids_usados = set()
-        # via conexões diretas
-        for c in conexoes:
-            if c.get('status') == 'ativa':
-                eq = equipamentos_dict.get(c.get('equipamento_id'))
-                sp = switch_portas_by_id.get(c.get('porta_id'))
-                if eq and sp and eq.get('sala_id') == sala_id:
-                    switch_ids_usados.add(sp.get('switch_id'))
-        # via patch panel
-        for m in patch_panel_portas:
-            eq = equipamentos_dict.get(m.get('equipamento_id')) if m.get('equipamento_id') else None
-            if eq and eq.get('sala_id') == sala_id and m.get('switch_id'):
-                switch_ids_usados.add(m.get('switch_id'))
+        for eq in _json_buscar(db_file, 'equipamentos', 'sala_id', sala_id):
+            equipamentos_dict[eq.get('id')] = eq
+            # via conexões diretas
+            for c in _json_buscar(db_file, 'conexoes', 'equipamento_id', eq.get('id')):
+                if c.get('status') == 'ativa':
+                    sp = _json_get(db_file, 'switch_portas', c.get('porta_id'))
+                    if sp:
+                        switch_ids_usados.add(sp.get('switch_id'))
+            # via patch panel
+            for m in _json_buscar(db_file, 'patch_panel_portas', 'equipamento_id', eq.get('id')):
+                if m.get('switch_id'):
+                    switch_ids_usados.add(m.get('switch_id'))
 
         resultado = []
         for switch_id in sorted(switch_ids_usados):
-            sw = next((s for s in switches if s.get('id') == switch_id), None)
+            sw = _json_get(db_file, 'switches', switch_id)
             if not sw:
                 continue
-            portas_sw = sorted(switch_portas_by_switch.get(switch_id, []), key=lambda x: int(x.get('numero_porta') or 0))
+            portas_sw = sorted(_json_buscar(db_file, 'switch_portas', 'switch_id', switch_id), key=lambda x: int(x.get('numero_porta') or 0))
             portas_render = []
             for porta in portas_sw:
                 numero = porta.get('numero_porta')
@@ -4589,7 +7937,7 @@ def switches_usados_sala(sala_id):
                 sala_especifica = False
 
                 # Primeiro, verificar mapeamento com patch panel
-                mapping = ppp_index.get((switch_id, numero))
+                mapping = _json_buscar_um(db_file, 'patch_panel_portas', ('switch_id', 'porta_switch'), (switch_id, numero))
                 if mapping:
                     pp = patch_panels_dict.get(mapping.get('patch_panel_id')) if mapping.get('patch_panel_id') else None
                     patch_panel_info = {
@@ -4598,7 +7946,7 @@ def switches_usados_sala(sala_id):
                         'prefixo_keystone': (pp or {}).get('prefixo_keystone')
                     }
                     if mapping.get('equipamento_id'):
-                        eq = equipamentos_dict.get(mapping.get('equipamento_id'))
+                        eq = obter_equipamento(mapping.get('equipamento_id'))
                         if eq:
                             status = 'ocupada'
                             sala = salas_dict.get(eq.get('sala_id'))
@@ -4617,9 +7965,12 @@ def switches_usados_sala(sala_id):
                         status = 'mapeada'
                 else:
                     # Verificar conexão direta
-                    c = conexao_por_porta.get(porta.get('id'))
+                    # Com mais de uma conexão ativa na porta vale a última, como no
+                    # dicionário porta_id -> conexão montado antes dos índices
+                    ativas = [c for c in _json_buscar(db_file, 'conexoes', 'porta_id', porta.get('id')) if c.get('status') == 'ativa']
+                    c = ativas[-1] if ativas else None
                     if c:
-                        eq = equipamentos_dict.get(c.get('equipamento_id')) if c.get('equipamento_id') else None
+                        eq = obter_equipamento(c.get('equipamento_id'))
                         if eq:
                             status = 'ocupada'
                             sala = salas_dict.get(eq.get('sala_id'))
@@ -4653,7 +8004,7 @@ def switches_usados_sala(sala_id):
 
         return jsonify(resultado)
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         
         # Buscar switches que têm conexão com equipamentos da sala específica
@@ -4690,7 +8041,7 @@ def listar_salas_por_andar(andar):
     if not db_file:
         return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
     
-    conn = sqlite3.connect(db_file)
+    conn = _sqlite_connect(db_file)
     cur = conn.cursor()
     
     try:
@@ -4727,27 +8078,12 @@ def get_patch_panel(id):
             return jsonify({'status': 'erro', 'mensagem': 'Banco de dados não selecionado'}), 400
         
         if _is_json_mode(db_file):
-            pps = _json_read_table(db_file, 'patch_panels')
-            pp = next((x for x in pps if x.get('id') == id), None)
+            pp = _json_get(db_file, 'patch_panels', id)
             if not pp:
                 return jsonify({'status': 'erro', 'mensagem': 'Patch panel não encontrado'}), 404
-            porta_inicial = int(pp.get('porta_inicial') or 1)
-            num_portas = int(pp.get('num_portas') or 0)
-            retorno = {
-                'id': pp.get('id'),
-                'codigo': pp.get('codigo'),
-                'nome': pp.get('nome'),
-                'andar': pp.get('andar'),
-                'porta_inicial': porta_inicial,
-                'num_portas': num_portas,
-                'status': pp.get('status'),
-                'descricao': pp.get('descricao'),
-                'data_criacao': pp.get('data_criacao'),
-                'porta_final': porta_inicial + num_portas - 1 if num_portas else porta_inicial
-            }
-            return jsonify(retorno)
+            return jsonify(_patch_panel_registro(pp))
         else:
-            conn = sqlite3.connect(db_file)
+            conn = _sqlite_connect(db_file)
             cursor = conn.cursor()
             
             cursor.execute("""
@@ -4782,7 +8118,7 @@ def get_patch_panel(id):
     if not db_file:
         return jsonify({'erro': 'Nenhuma empresa selecionada!'}), 400
     
-    conn = sqlite3.connect(db_file)
+    conn = _sqlite_connect(db_file)
     cur = conn.cursor()
     
     try:
@@ -4889,7 +8225,7 @@ def get_equipamento_patch_panel_info(equipamento_id):
             
             return jsonify(equipamento_info)
         else:
-            conn = sqlite3.connect(db_file)
+            conn = _sqlite_connect(db_file)
             cur = conn.cursor()
             
             # Buscar informações do equipamento e sua conexão com patch panel
@@ -4937,6 +8273,18 @@ def get_equipamento_patch_panel_info(equipamento_id):
 
 
 
+@app.route('/debug/json-cache', methods=['GET'])
+@admin_required
+def debug_json_cache():
+    """Estatísticas do cache de tabelas JSON (hits/misses por empresa)"""
+    return jsonify(_json_cache_estatisticas())
+
+@app.route('/debug/sqlite-pool', methods=['GET'])
+@admin_required
+def debug_sqlite_pool():
+    """Estatísticas do pool de conexões SQLite"""
+    return jsonify(_sqlite_pool_estatisticas())
+
 @app.route('/debug/equipamento/<int:equipamento_id>', methods=['GET'])
 @login_required
 def debug_equipamento(equipamento_id):
@@ -4946,7 +8294,7 @@ def debug_equipamento(equipamento_id):
         if not db_file:
             return jsonify({'erro': 'Banco de dados não selecionado'}), 400
         
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         
         # Buscar informações detalhadas do equipamento
@@ -5177,63 +8525,9 @@ def listar_idfs():
         resultado.sort(key=lambda x: (x.get('data_criacao') or ''), reverse=True)
         return jsonify(resultado)
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         
-        # Criar tabelas de IDFs se não existirem
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS idfs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                nome TEXT NOT NULL,
-                andar_id INTEGER NOT NULL,
-                descricao TEXT,
-                foto TEXT,
-                status TEXT DEFAULT 'ativo',
-                data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (andar_id) REFERENCES andares (id)
-            )
-        ''')
-        
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS idf_equipamentos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                idf_id INTEGER NOT NULL,
-                equipamento_id INTEGER NOT NULL,
-                funcao TEXT,
-                posicao_rack TEXT,
-                tipo_alocacao TEXT DEFAULT 'exclusivo',
-                sala_origem_id INTEGER,
-                FOREIGN KEY (idf_id) REFERENCES idfs (id),
-                FOREIGN KEY (equipamento_id) REFERENCES equipamentos (id),
-                FOREIGN KEY (sala_origem_id) REFERENCES salas (id)
-            )
-        ''')
-        
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS idf_sala_conexoes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                idf_id INTEGER NOT NULL,
-                sala_id INTEGER NOT NULL,
-                tipo_conexao TEXT,
-                capacidade TEXT,
-                status TEXT DEFAULT 'ativo',
-                FOREIGN KEY (idf_id) REFERENCES idfs (id),
-                FOREIGN KEY (sala_id) REFERENCES salas (id)
-            )
-        ''')
-        
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS andar_switches (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                andar_id INTEGER NOT NULL,
-                switch_id INTEGER NOT NULL,
-                idf_responsavel_id INTEGER,
-                FOREIGN KEY (andar_id) REFERENCES andares (id),
-                FOREIGN KEY (switch_id) REFERENCES switches (id),
-                FOREIGN KEY (idf_responsavel_id) REFERENCES idfs (id)
-            )
-        ''')
-        
         # Buscar IDFs com informações do andar
         cur.execute('''
             SELECT i.id,
@@ -5288,7 +8582,7 @@ def criar_idf():
         idfs = _json_read_table(db_file, 'idfs')
         if any((i.get('andar_id') == dados.get('andar_id') and (i.get('nome') or '').lower() == (dados.get('nome') or '').lower()) for i in idfs):
             return jsonify({'status': 'erro', 'mensagem': 'Já existe um IDF com esse nome neste andar!'}), 400
-        idf_id = _json_next_id(idfs)
+        idf_id = _json_proximo_id(db_file, 'idfs')
         idfs.append({
             'id': idf_id,
             'nome': dados.get('nome'),
@@ -5300,7 +8594,7 @@ def criar_idf():
         })
         _json_write_table(db_file, 'idfs', idfs)
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         
         # Verificar se já existe IDF com o mesmo nome no mesmo andar
@@ -5390,7 +8684,7 @@ def get_idf(id):
         }
         return jsonify(retorno)
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         
         # Buscar IDF
@@ -5507,7 +8801,7 @@ def get_switches_andar_idf(id):
         resultado.sort(key=lambda x: x.get('nome') or '')
         return jsonify(resultado)
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         
         # Buscar andar do IDF
@@ -5586,7 +8880,7 @@ def vincular_switch_a_andar(andar_id):
         # remover existente do mesmo andar_id e switch_id
         links = [l for l in links if not (l.get('andar_id') == andar_id and l.get('switch_id') == switch_id)]
         links.append({
-            'id': _json_next_id(links),
+            'id': _json_proximo_id(db_file, 'andar_switches'),
             'andar_id': andar_id,
             'switch_id': switch_id,
             'idf_responsavel_id': idf_responsavel_id
@@ -5594,22 +8888,9 @@ def vincular_switch_a_andar(andar_id):
         _json_write_table(db_file, 'andar_switches', links)
         return jsonify({'status': 'ok'})
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         
-        # Garantir tabela
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS andar_switches (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                andar_id INTEGER NOT NULL,
-                switch_id INTEGER NOT NULL,
-                idf_responsavel_id INTEGER,
-                UNIQUE(andar_id, switch_id),
-                FOREIGN KEY (andar_id) REFERENCES andares (id),
-                FOREIGN KEY (switch_id) REFERENCES switches (id)
-            )
-        ''')
-        
         # Upsert simples: tentar inserir, se já existir atualizar idf_responsavel
         try:
             cur.execute('''
@@ -5639,7 +8920,7 @@ def desvincular_switch_de_andar(andar_id, switch_id):
         _json_write_table(db_file, 'andar_switches', links)
         return jsonify({'status': 'ok'})
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         cur.execute('DELETE FROM andar_switches WHERE andar_id=? AND switch_id=?', (andar_id, switch_id))
         conn.commit()
@@ -5666,7 +8947,7 @@ def adicionar_equipamento_idf(id):
         if any(x.get('idf_id') == id and x.get('equipamento_id') == dados.get('equipamento_id') for x in ie):
             return jsonify({'status': 'erro', 'mensagem': 'Equipamento já está neste IDF!'}), 400
         ie.append({
-            'id': _json_next_id(ie),
+            'id': _json_proximo_id(db_file, 'idf_equipamentos'),
             'idf_id': id,
             'equipamento_id': dados.get('equipamento_id'),
             'funcao': dados.get('funcao'),
@@ -5676,7 +8957,7 @@ def adicionar_equipamento_idf(id):
         })
         _json_write_table(db_file, 'idf_equipamentos', ie)
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         
         # Verificar se o IDF existe
@@ -5743,7 +9024,7 @@ def listar_equipamentos_disponiveis_idf(id):
         disponiveis.sort(key=lambda x: x.get('nome') or '')
         return jsonify(disponiveis)
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         
         try:
@@ -5799,7 +9080,7 @@ def adicionar_conexao_sala_idf(id):
         if any(x.get('idf_id') == id and x.get('sala_id') == dados.get('sala_id') for x in isc):
             return jsonify({'status': 'erro', 'mensagem': 'Já existe conexão entre este IDF e esta sala!'}), 400
         isc.append({
-            'id': _json_next_id(isc),
+            'id': _json_proximo_id(db_file, 'idf_sala_conexoes'),
             'idf_id': id,
             'sala_id': dados.get('sala_id'),
             'tipo_conexao': dados.get('tipo_conexao'),
@@ -5808,7 +9089,7 @@ def adicionar_conexao_sala_idf(id):
         })
         _json_write_table(db_file, 'idf_sala_conexoes', isc)
     else:
-        conn = sqlite3.connect(db_file)
+        conn = _sqlite_connect(db_file)
         cur = conn.cursor()
         
         # Verificar se já existe conexão
@@ -5886,5 +9167,112 @@ def listar_andares():
     
     return jsonify(andares)
 
+def _json_diretorios_empresas(empresas=None):
+    base = os.path.join(os.path.dirname(__file__), 'static', 'data', 'empresas')
+    if not os.path.isdir(base):
+        return []
+    return [os.path.join(base, nome) for nome in sorted(os.listdir(base))
+            if os.path.isdir(os.path.join(base, nome)) and (not empresas or nome in empresas)]
+
+def _json_migrar_codec(codec, empresas=None):
+    """Converte os snapshots de todas as empresas (ou das informadas) para o codec indicado."""
+    if not _codec_disponivel(codec):
+        print(f"Codec '{codec}' indisponível: instale o pacote correspondente")
+        return False
+    extensao, serializar, _ = _CODECS[codec]
+    for empresa_dir in _json_diretorios_empresas(empresas):
+        with _json_trava(empresa_dir):
+            # Incorpora o journal antes, para os snapshots estarem completos
+            _jornal_compactar(empresa_dir)
+            for arquivo in sorted(os.listdir(empresa_dir)):
+                tabela, ext = os.path.splitext(arquivo)
+                if ext not in _EXTENSOES_SNAPSHOT or tabela.startswith('_'):
+                    continue
+                origem = os.path.join(empresa_dir, arquivo)
+                with open(origem, 'rb') as f:
+                    rows = _json_decodificar(origem, f.read())
+                destino = os.path.join(empresa_dir, tabela + extensao)
+                conteudo = serializar(rows)
+                _gravar_arquivo_atomico(destino, conteudo)
+                if destino != origem:
+                    os.remove(origem)
+                print(f"{os.path.basename(empresa_dir)}/{arquivo} -> {os.path.basename(destino)} ({len(conteudo)} bytes)")
+        _json_cache_invalidar()
+    print(f"Migração concluída. Use JSON_CODEC={codec} para o servidor gravar nesse formato.")
+    return True
+
+def _json_benchmark_codecs(escala=1, repeticoes=20):
+    """Mede serialização/desserialização de cada codec disponível sobre as tabelas reais."""
+    tabelas = {}
+    for empresa_dir in _json_diretorios_empresas():
+        for arquivo in sorted(os.listdir(empresa_dir)):
+            tabela, ext = os.path.splitext(arquivo)
+            if ext not in _EXTENSOES_SNAPSHOT or tabela.startswith('_'):
+                continue
+            path = os.path.join(empresa_dir, arquivo)
+            with open(path, 'rb') as f:
+                rows = _json_decodificar(path, f.read())
+            if isinstance(rows, list):
+                tabelas.setdefault(tabela, []).extend(rows)
+    if not tabelas:
+        print("Nenhuma tabela encontrada em static/data/empresas")
+        return
+    codecs = [nome for nome in _CODECS if _codec_disponivel(nome)]
+    print(f"Codecs disponíveis: {', '.join(codecs)} (ativo: {_codec_ativo()}); escala x{escala}, {repeticoes} repetições")
+    print(f"{'tabela':<22}{'linhas':>8}  {'codec':<8}{'bytes':>10}{'dumps ms':>10}{'loads ms':>10}")
+    for tabela, rows in sorted(tabelas.items()):
+        rows = rows * escala
+        for nome in codecs:
+            _, serializar, desserializar = _CODECS[nome]
+            inicio = time.perf_counter()
+            for _ in range(repeticoes):
+                conteudo = serializar(rows)
+            t_dumps = (time.perf_counter() - inicio) * 1000 / repeticoes
+            inicio = time.perf_counter()
+            for _ in range(repeticoes):
+                desserializar(conteudo)
+            t_loads = (time.perf_counter() - inicio) * 1000 / repeticoes
+            print(f"{tabela:<22}{len(rows):>8}  {nome:<8}{len(conteudo):>10}{t_dumps:>10.3f}{t_loads:>10.3f}")
+
 if __name__ == '__main__':
-    app.run(debug=False, host='0.0.0.0', port=8080)
+    import argparse
+    parser = argparse.ArgumentParser(description='Servidor do sistema de gerenciamento de salas')
+    parser.add_argument('--migrar-codec', choices=sorted(_CODECS), help='converte os snapshots JSON das empresas para o codec informado e sai')
+    parser.add_argument('--empresa', action='append', help='limita a migração a esta pasta (ex.: empresa_1); pode repetir')
+    parser.add_argument('--migrar-sqlite', action='append', metavar='ARQUIVO', help='aplica as migrações de schema pendentes ao banco SQLite e sai; pode repetir')
+    parser.add_argument('--verificar-planos', metavar='ARQUIVO', help='confere no EXPLAIN QUERY PLAN se as consultas quentes usam índice; sai com erro se alguma varrer a tabela')
+    parser.add_argument('--benchmark-codecs', action='store_true', help='compara os codecs disponíveis sobre as tabelas reais e sai')
+    parser.add_argument('--escala', type=int, default=1, help='multiplica as linhas das tabelas no benchmark')
+    parser.add_argument('--monitor', action='store_true', help='roda só o monitor contínuo (coletores de MONITOR_COLETORES), sem o servidor web')
+    args = parser.parse_args()
+    if args.migrar_codec:
+        _json_migrar_codec(args.migrar_codec, args.empresa)
+    elif args.verificar_planos:
+        # Somente leitura e sem migrar: confere o banco como ele está
+        if not os.path.exists(args.verificar_planos):
+            print(f"Banco {args.verificar_planos} não encontrado")
+            raise SystemExit(1)
+        conn = sqlite3.connect(f'file:{quote(os.path.abspath(args.verificar_planos))}?mode=ro', uri=True)
+        try:
+            versao = conn.execute('PRAGMA user_version').fetchone()[0]
+            problemas = _sqlite_verificar_planos(conn)
+        finally:
+            conn.close()
+        if versao < SQLITE_VERSAO_SCHEMA:
+            print(f"Schema na versão {versao}, esperado {SQLITE_VERSAO_SCHEMA}: rode --migrar-sqlite antes")
+            raise SystemExit(1)
+        for nome, detalhe in problemas:
+            print(f"PROBLEMA em '{nome}': {detalhe}")
+        print('Planos OK' if not problemas else f'{len(problemas)} consulta(s) com problema')
+        raise SystemExit(1 if problemas else 0)
+    elif args.migrar_sqlite:
+        for db_file in args.migrar_sqlite:
+            conn = _sqlite_abrir(db_file)
+            print(f"{db_file}: schema na versão {_sqlite_migrar(conn, db_file)}")
+            conn.close()
+    elif args.benchmark_codecs:
+        _json_benchmark_codecs(args.escala)
+    elif args.monitor:
+        _monitor_principal()
+    else:
+        app.run(debug=False, host='0.0.0.0', port=8080)
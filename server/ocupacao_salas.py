@@ -1,79 +1,295 @@
-import time
-import pandas as pd
 import json
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.edge.service import Service
-from selenium.webdriver.edge.options import Options
-
-# Configurar o Edge WebDriver para modo headless
-options = Options()
-options.add_argument('--headless')
-options.add_argument('--disable-gpu')
-
-service = Service('C:\\WebDriver\\msedgedriver.exe')
-driver = webdriver.Edge(service=service, options=options)
-
-# Carregar o JSON dos andares
-with open('audio-e-video.json', encoding='utf-8') as f:
-    andares_json = json.load(f)
-
-# Extrair sensores do JSON
-# Extrair sensores do JSON
-sensores = []
-for andar in andares_json['andares'].values():
-    for sala in andar.get('salas', []):
-        nome_sala = sala.get('nome', '')
-        for eq in sala.get('equipamentos', []):
-            if eq.get('nome', '').lower() == 'sensor':
-                dados = eq.get('dados', {})
-                ip = dados.get('ip')
-                if ip:
-                    if nome_sala == "Sala 02":
-                        url = "http://10.12.187.121/#/stage/(child:status)"
-                        xpath = './/div[@class="ui-grid-col-8 breakword ng-star-inserted"]'
-                    else:
-                        url = f"http://{ip}/#/stage/(child:status)"
-                        xpath = './/div[@class="ui-grid-col-8 ng-star-inserted"]'
-                    nome = f"{nome_sala} - Sensor"
-                    sensores.append({'Nome': nome, 'URL': url, 'XPath': xpath})
-
-# Lista para armazenar os dados
-data = []
-
-for entry in sensores:
-    nome = entry['Nome'].replace(' - Sensor', '')  # Remove o sufixo
-    url = entry['URL']
-    xpath = entry['XPath']
-    print(f"Processando URL: {url} com XPath: {xpath}")
-    driver.get(url)
+import os
+import ssl
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from urllib.error import URLError
+from urllib.parse import urlparse
+from urllib.request import Request, urlopen
+
+# Os sensores são consultados em paralelo. Primeiro pela API HTTP/JSON do
+# firmware (CresNext), que responde em milissegundos quando existe; se não
+# houver API, pela página de status num navegador headless, com um pool de
+# até OCUPACAO_NAVEGADORES instâncias reaproveitadas entre os sensores.
+# salas_ocupadas.json é regravado a cada sensor concluído, então um sensor
+# lento não segura o resultado dos demais.
+CONCORRENCIA = int(os.environ.get("OCUPACAO_CONCORRENCIA", "16"))
+NAVEGADORES = int(os.environ.get("OCUPACAO_NAVEGADORES", "4"))
+TIMEOUT = float(os.environ.get("OCUPACAO_TIMEOUT", "15"))
+TIMEOUT_API = float(os.environ.get("OCUPACAO_TIMEOUT_API", "3"))
+# auto (API e, se falhar, navegador) | api | navegador
+MODO = os.environ.get("OCUPACAO_MODO", "auto")
+CAMINHOS_API = [c for c in os.environ.get("OCUPACAO_CAMINHOS_API", "/Device/OccupancySensor,/Device").split(",") if c.strip()]
+EDGE_DRIVER = os.environ.get("EDGE_DRIVER", "C:\\WebDriver\\msedgedriver.exe")
+ARQUIVO_SAIDA = "salas_ocupadas.json"
+
+# Valor do status na página; a classe breakword só aparece em alguns firmwares
+XPATH_STATUS = './/div[contains(@class, "ui-grid-col-8") and contains(@class, "ng-star-inserted")]'
+
+# Chaves de ocupação conhecidas na API, em ordem de preferência
+_CHAVES_OCUPACAO = ("IsRoomOccupied", "IsOccupied", "Occupied", "OccupancyState", "RoomOccupancyState")
+
+# Sensores que não responderam pela API: vão direto ao navegador até o
+# próximo teste, SEM_API_REVALIDAR segundos depois (coletor contínuo)
+SEM_API_REVALIDAR = 3600
+_sem_api = {}
+
+# Os sensores usam certificado autoassinado
+_contexto_ssl = ssl.create_default_context()
+_contexto_ssl.check_hostname = False
+_contexto_ssl.verify_mode = ssl.CERT_NONE
+
+
+def sensores_do_json(caminho="audio-e-video.json"):
+    """Sensores (Nome, Host, URL, XPath) das salas de audio-e-video.json."""
+    with open(caminho, encoding="utf-8") as f:
+        andares_json = json.load(f)
+    sensores = []
+    for andar in andares_json["andares"].values():
+        for sala in andar.get("salas", []):
+            nome_sala = sala.get("nome", "")
+            for eq in sala.get("equipamentos", []):
+                if eq.get("nome", "").lower() == "sensor":
+                    ip = (eq.get("dados") or {}).get("ip")
+                    if ip:
+                        sensores.append(_sensor_legado(nome_sala, ip))
+    return sensores
+
+
+def _sensor_legado(nome_sala, ip):
+    """Entrada de audio-e-video.json. O sensor da Sala 02 responde num IP que
+    o arquivo não tem e usa outra classe na página."""
+    if nome_sala == "Sala 02":
+        return sensor(nome_sala, "10.12.187.121", './/div[@class="ui-grid-col-8 breakword ng-star-inserted"]')
+    return sensor(nome_sala, ip, './/div[@class="ui-grid-col-8 ng-star-inserted"]')
+
+
+def sensor(nome_sala, ip, xpath=XPATH_STATUS):
+    url = f"http://{ip}/#/stage/(child:status)"
+    return {"Nome": nome_sala, "Host": urlparse(url).hostname, "URL": url, "XPath": xpath}
+
+
+def _status_da_api(dados):
+    """Procura o estado de ocupação no JSON devolvido pelo firmware."""
+    if isinstance(dados, dict):
+        for chave in _CHAVES_OCUPACAO:
+            valor = dados.get(chave)
+            if isinstance(valor, bool):
+                return "Occupied" if valor else "Vacant"
+            if isinstance(valor, str) and valor.strip():
+                return valor.strip()
+        filhos = dados.values()
+    elif isinstance(dados, list):
+        filhos = dados
+    else:
+        return None
+    for filho in filhos:
+        status = _status_da_api(filho)
+        if status is not None:
+            return status
+    return None
+
+
+def consultar_api(host, timeout=TIMEOUT_API):
+    """Status pela API HTTP/JSON do sensor, ou None se ela não existir."""
+    if time.monotonic() - _sem_api.get(host, -SEM_API_REVALIDAR) < SEM_API_REVALIDAR:
+        return None
+    for caminho in CAMINHOS_API:
+        for esquema in ("https", "http"):
+            url = f"{esquema}://{host}{caminho.strip()}"
+            try:
+                with urlopen(Request(url, headers={"Accept": "application/json"}), timeout=timeout,
+                             context=_contexto_ssl if esquema == "https" else None) as resposta:
+                    dados = json.loads(resposta.read())
+            except (URLError, OSError, ValueError):
+                continue
+            status = _status_da_api(dados)
+            if status is not None:
+                return status
+    _sem_api[host] = time.monotonic()
+    return None
+
+
+def novo_navegador():
+    # Selenium só é necessário quando algum sensor não tem API
+    from selenium import webdriver
+    from selenium.webdriver.edge.options import Options
+    from selenium.webdriver.edge.service import Service
+
+    options = Options()
+    options.add_argument("--headless")
+    options.add_argument("--disable-gpu")
+    # Sem o driver no caminho configurado, o Selenium Manager localiza um
+    service = Service(EDGE_DRIVER) if os.path.exists(EDGE_DRIVER) else Service()
+    driver = webdriver.Edge(service=service, options=options)
+    driver.set_page_load_timeout(TIMEOUT)
+    return driver
+
+
+class PoolNavegadores:
+    """Até `tamanho` navegadores headless, criados sob demanda por `fabrica` e reaproveitados.
+
+    O semáforo conta os empréstimos em andamento (inclusive os que ainda estão
+    abrindo o navegador): quem espera é liberado tanto quando um navegador
+    volta quanto quando a criação falha. Um navegador que levanta exceção
+    durante o empréstimo fica em estado desconhecido e é fechado, não reaproveitado."""
+
+    def __init__(self, tamanho=NAVEGADORES, fabrica=None):
+        self.tamanho = max(1, tamanho)
+        self.fabrica = fabrica or novo_navegador
+        self._vagas = threading.Semaphore(self.tamanho)
+        self._livres = []
+        self._todos = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def emprestar(self):
+        self._vagas.acquire()
+        try:
+            with self._lock:
+                driver = self._livres.pop() if self._livres else None
+            if driver is None:
+                driver = self.fabrica()
+                with self._lock:
+                    self._todos.append(driver)
+            try:
+                yield driver
+            except BaseException:
+                self._descartar(driver)
+                raise
+            with self._lock:
+                if driver in self._todos:  # fechar() pode ter rodado no meio
+                    self._livres.append(driver)
+        finally:
+            self._vagas.release()
+
+    def _descartar(self, driver):
+        with self._lock:
+            if driver in self._todos:
+                self._todos.remove(driver)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def fechar(self):
+        with self._lock:
+            drivers, self._todos, self._livres = self._todos, [], []
+        for driver in drivers:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+
+
+def consultar_navegador(driver, entry, timeout=TIMEOUT):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    driver.get(entry["URL"])
+    wait = WebDriverWait(driver, timeout)
+    cabecalho = (By.XPATH, '//p-accordiontab[@id="statusOccupancy"]//a')
+    # O aviso inicial (okBtn) só aparece na primeira visita de cada navegador
+    elemento = wait.until(EC.any_of(
+        EC.element_to_be_clickable((By.XPATH, '//*[@id="okBtn"]')),
+        EC.element_to_be_clickable(cabecalho),
+    ))
+    if elemento.get_attribute("id") == "okBtn":
+        elemento.click()
+        elemento = wait.until(EC.element_to_be_clickable(cabecalho))
+    driver.execute_script("arguments[0].click();", elemento)
+
+    accordion_tab = wait.until(EC.visibility_of_element_located((By.ID, "statusOccupancy")))
+
+    # Espera o valor ser preenchido pelo Angular em vez de um sleep fixo
+    def valor_preenchido(_):
+        divs = accordion_tab.find_elements(By.XPATH, entry["XPath"])
+        return divs[0].text.strip() if divs and divs[0].text.strip() else False
+
+    try:
+        return wait.until(valor_preenchido)
+    except Exception:
+        if not accordion_tab.find_elements(By.XPATH, entry["XPath"]):
+            return "Tag div não encontrada"
+        raise
+
+
+def consultar_sensor(entry, navegadores, modo=MODO):
+    if modo in ("auto", "api"):
+        status = consultar_api(entry["Host"])
+        if status is not None or modo == "api":
+            return status or "Indefinido"
+    with navegadores.emprestar() as driver:
+        return consultar_navegador(driver, entry)
+
+
+def gravar_json(caminho, dados):
+    # Temporário + replace: quem lê o arquivo durante a coleta nunca o vê pela metade
+    diretorio = os.path.dirname(os.path.abspath(caminho))
+    fd, tmp = tempfile.mkstemp(prefix=".ocupacao.", suffix=".tmp", dir=diretorio)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(dados, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, caminho)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def coletar(sensores, concorrencia=CONCORRENCIA, ao_concluir=None, modo=MODO, navegadores=None):
+    """Consulta todos os sensores em paralelo. ao_concluir(indice, resultado)
+    é chamado a cada sensor terminado; devolve os resultados na ordem de sensores."""
+    proprio_pool = navegadores is None
+    navegadores = navegadores or PoolNavegadores()
+    resultados = [None] * len(sensores)
+
+    def processar(i):
+        entry = sensores[i]
+        inicio = time.monotonic()
+        try:
+            status = consultar_sensor(entry, navegadores, modo)
+        except Exception as e:
+            print(f"Erro ao processar a URL {entry['URL']}: {e}")
+            status = "Indefinido"
+        print(f"{entry['Nome']}: {status} ({time.monotonic() - inicio:.1f}s)")
+        return i, {"Nome": entry["Nome"], "Status": status}
 
     try:
-        wait = WebDriverWait(driver, 15)
-        accept_button = wait.until(EC.element_to_be_clickable((By.XPATH, '//*[@id="okBtn"]')))
-        accept_button.click()
-
-        section_header = wait.until(EC.element_to_be_clickable((By.XPATH, '//p-accordiontab[@id="statusOccupancy"]//a')))
-        driver.execute_script("arguments[0].click();", section_header)
-
-        accordion_tab = wait.until(EC.visibility_of_element_located((By.ID, 'statusOccupancy')))
-        time.sleep(5)
-
-        div_tags = accordion_tab.find_elements(By.XPATH, xpath)
-        if div_tags:
-            div_value = div_tags[0].text.strip()
-            data.append({'Nome': nome, 'Status': div_value})
-        else:
-            data.append({'Nome': nome, 'Status': 'Tag div não encontrada'})
-    except Exception as e:
-        print(f"Erro ao processar a URL {url}: {e}")
-        data.append({'Nome': nome, 'Status': 'Indefinido'})
-
-# Salva apenas Nome e Status no JSON, sem o sufixo
-df = pd.DataFrame(data)
-df.to_json('salas_ocupadas.json', orient='records', force_ascii=False, indent=2)
-
-driver.quit()
-time.sleep(3)
\ No newline at end of file
+        with ThreadPoolExecutor(max_workers=max(1, min(concorrencia, len(sensores) or 1))) as executor:
+            for futuro in as_completed([executor.submit(processar, i) for i in range(len(sensores))]):
+                i, resultado = futuro.result()
+                resultados[i] = resultado
+                if ao_concluir:
+                    ao_concluir(i, resultado)
+    finally:
+        if proprio_pool:
+            navegadores.fechar()
+    return resultados
+
+
+def main():
+    sensores = sensores_do_json()
+    concluidos = [None] * len(sensores)
+    trava = threading.Lock()
+
+    # Salva apenas Nome e Status, na ordem dos sensores, à medida que chegam
+    def salvar_parcial(i, resultado):
+        with trava:
+            concluidos[i] = resultado
+            gravar_json(ARQUIVO_SAIDA, [r for r in concluidos if r is not None])
+
+    inicio = time.monotonic()
+    coletar(sensores, ao_concluir=salvar_parcial)
+    gravar_json(ARQUIVO_SAIDA, [r for r in concluidos if r is not None])
+    print(f"{len(sensores)} sensores verificados em {time.monotonic() - inicio:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,87 +1,104 @@
-import json
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.edge.service import Service as EdgeService
-from selenium.webdriver.edge.options import Options as EdgeOptions
-from selenium.webdriver.chrome.service import Service as ChromeService
-from selenium.webdriver.chrome.options import Options as ChromeOptions
-from datetime import datetime
-import time
-import tempfile
-import shutil
 import os
+import shutil
+import tempfile
+from datetime import datetime
+
+from ocupacao_salas import PoolNavegadores, gravar_json
+
+# Escolha do navegador: "edge" ou "chrome"
+NAVEGADOR = os.environ.get("UPS_NAVEGADOR", "edge")
+EDGE_DRIVER = os.environ.get("EDGE_DRIVER", "C:\\WebDriver\\msedgedriver.exe")
+CHROME_DRIVER = os.environ.get("CHROME_DRIVER", "C:\\WebDriver\\chromedriver.exe")
+TIMEOUT = float(os.environ.get("UPS_TIMEOUT", "30"))
+HOST_PADRAO = "10.12.65.151"
+ARQUIVO_SAIDA = "dados_ups.json"
+
+
+def novo_navegador():
+    # Selenium só é importado quando há UPS a ler
+    from selenium import webdriver
+
+    if NAVEGADOR == "chrome":
+        from selenium.webdriver.chrome.options import Options
+        from selenium.webdriver.chrome.service import Service
+        user_data_dir = tempfile.mkdtemp()
+        options = Options()
+        options.add_argument(f"--user-data-dir={user_data_dir}")
+        options.add_argument("--headless")
+        options.add_argument("--disable-gpu")
+        # Sem o driver no caminho configurado, o Selenium Manager localiza um
+        service = Service(CHROME_DRIVER) if os.path.exists(CHROME_DRIVER) else Service()
+        driver = webdriver.Chrome(service=service, options=options)
+        quit_original = driver.quit
+
+        def quit():
+            try:
+                quit_original()
+            finally:
+                shutil.rmtree(user_data_dir, ignore_errors=True)
+        driver.quit = quit
+    else:
+        from selenium.webdriver.edge.options import Options
+        from selenium.webdriver.edge.service import Service
+        options = Options()
+        options.add_argument("--headless")
+        options.add_argument("--disable-gpu")
+        service = Service(EDGE_DRIVER) if os.path.exists(EDGE_DRIVER) else Service()
+        driver = webdriver.Edge(service=service, options=options)
+    driver.set_page_load_timeout(TIMEOUT)
+    return driver
+
+
+def ler_ups(driver, host=HOST_PADRAO, timeout=TIMEOUT):
+    """Tensões, correntes e estado do UPS, lidos da página web do equipamento."""
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    driver.get(f"http://{host}/")
+    wait = WebDriverWait(driver, timeout)
+    try:
+        wait.until(EC.frame_to_be_available_and_switch_to_it((By.ID, "showpage")))
+
+        # Espera cada valor ser preenchido pelo script da página em vez de um sleep fixo
+        def texto(id_):
+            return wait.until(lambda d: d.find_element(By.ID, id_).text.strip() or False)
+
+        def get_value(id_):
+            return float(texto(id_))
+
+        l1, l2, l3 = get_value("inputVoltage"), get_value("inputVoltageS"), get_value("inputVoltageT")
+        l1o, l2o, l3o = get_value("outputVoltage"), get_value("outputVoltageS"), get_value("outputVoltageT")
+        l1c, l2c, l3c = get_value("outputCurrent"), get_value("outputCurrentS"), get_value("outputCurrentT")
+
+        return {
+            "timestamp": datetime.now().strftime("%d-%m-%Y %H:%M:%S"),
+            "ups_mode": texto("upsMode"),
+            "ups_temp": texto("upsTemp"),
+            "ups_battery": texto("batteryCapacity"),
+            "ups_backup": texto("backupTime"),
+            "entrada": [l1, l2, l3],
+            "saida": [l1o, l2o, l3o],
+            "corrente": [l1c, l2c, l3c]
+        }
+    finally:
+        driver.switch_to.default_content()
+
+
+def main():
+    navegadores = PoolNavegadores(1, novo_navegador)
+    try:
+        with navegadores.emprestar() as driver:
+            dados = ler_ups(driver)
+        gravar_json(ARQUIVO_SAIDA, dados)
+        print(f"Dados salvos como '{ARQUIVO_SAIDA}'")
+    except Exception as e:
+        import traceback
+        print(f"Ocorreu um erro: {e}")
+        traceback.print_exc()
+    finally:
+        navegadores.fechar()
 
-# Escolha do navegador
-navegador = "edge"  # ou "edge"
-
-user_data_dir = tempfile.mkdtemp() 
-
-# Configurar WebDriver
-if navegador == "chrome":
-    options = ChromeOptions()
-    options.add_argument(f'--user-data-dir={user_data_dir}')
-    options.add_argument("--headless")
-    options.add_argument("--disable-gpu")
-    service = ChromeService("C:\\WebDriver\\chromedriver.exe")  # atualize o caminho
-    driver = webdriver.Chrome(service=service, options=options)
-
-elif navegador == "edge":
-    options = EdgeOptions()
-    options.add_argument("--headless")
-    options.add_argument("--disable-gpu")
-    service = EdgeService("C:\\WebDriver\\msedgedriver.exe")  # atualize o caminho
-    driver = webdriver.Edge(service=service, options=options)
-
-try:
-    driver.get("http://10.12.65.151/")
-    wait = WebDriverWait(driver, 30)
-    iframe = wait.until(EC.presence_of_element_located((By.ID, "showpage")))
-    driver.switch_to.frame(iframe)
-    time.sleep(10)
-
-    # Captura de dados
-    def get_value(id_):
-        return float(wait.until(EC.presence_of_element_located((By.ID, id_))).text)
-
-    l1, l2, l3 = get_value("inputVoltage"), get_value("inputVoltageS"), get_value("inputVoltageT")
-    l1o, l2o, l3o = get_value("outputVoltage"), get_value("outputVoltageS"), get_value("outputVoltageT")
-    l1c, l2c, l3c = get_value("outputCurrent"), get_value("outputCurrentS"), get_value("outputCurrentT")
-
-    ups_mode = wait.until(EC.presence_of_element_located((By.ID, "upsMode"))).text
-    ups_temp = wait.until(EC.presence_of_element_located((By.ID, "upsTemp"))).text
-    ups_battery = wait.until(EC.presence_of_element_located((By.ID, "batteryCapacity"))).text
-    ups_backup = wait.until(EC.presence_of_element_located((By.ID, "backupTime"))).text
-
-    # Timestamp
-    now = datetime.now()
-    timestamp = now.strftime("%d-%m-%Y %H:%M:%S")
-
-    # Dados em JSON
-    dados = {
-        "timestamp": timestamp,
-        "ups_mode": ups_mode,
-        "ups_temp": ups_temp,
-        "ups_battery": ups_battery,
-        "ups_backup": ups_backup,
-        "entrada": [l1, l2, l3],
-        "saida": [l1o, l2o, l3o],
-        "corrente": [l1c, l2c, l3c]
-    }
-
-    # Salvar JSON
-    with open("dados_ups.json", "w", encoding="utf-8") as f:
-        json.dump(dados, f, ensure_ascii=False, indent=4)
-
-    print("Dados salvos como 'dados_ups.json'")
-
-except Exception as e:
-    import traceback
-    print(f"Ocorreu um erro: {e}")
-    traceback.print_exc()
-
-finally:
-    driver.quit()
-    shutil.rmtree(user_data_dir, ignore_errors=True)
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def srv():
+    return server
+
+
+@pytest.fixture
+def empresa(tmp_path, monkeypatch):
+    """db_file de uma empresa em modo JSON cujo diretório de dados é
+    tmp_path/static/data/empresas/empresa_1, com cache limpo e sem a thread
+    de compactação (os testes compactam quando querem)."""
+    base = tmp_path / 'static' / 'data' / 'empresas'
+
+    def data_dir(db_file):
+        path = base / server._empresa_dir_from_db(db_file)
+        path.mkdir(parents=True, exist_ok=True)
+        return str(path)
+
+    monkeypatch.setattr(server, '_empresa_data_dir', data_dir)
+    monkeypatch.setattr(server, '_jornal_agendar_compactacao', lambda empresa_dir, urgente=False: None)
+    server._json_cache_invalidar()
+    yield 'json:empresa_1'
+    server._json_cache_invalidar()
+
+
+@pytest.fixture
+def cliente(srv, empresa):
+    """Cliente HTTP logado como admin na empresa JSON temporária."""
+    srv.app.testing = True
+    c = srv.app.test_client()
+    with c.session_transaction() as s:
+        s['user_id'] = 1
+        s['username'] = 'teste'
+        s['nivel'] = 'admin'
+        s['db'] = empresa
+    return c
+
+
+@pytest.fixture
+def banco(tmp_path):
+    """Arquivo SQLite temporário, ainda sem schema."""
+    db_file = str(tmp_path / 'empresa.db')
+    yield db_file
+    server._sqlite_migrados.discard(db_file)
+
+
+# Tabelas do banco original das empresas, que as migrações pressupõem e não criam
+_SCHEMA_ORIGINAL = [
+    'CREATE TABLE salas (id INTEGER PRIMARY KEY, nome, tipo, descricao, foto, fotos, andar_id, data_criacao)',
+    'CREATE TABLE equipamentos (id INTEGER PRIMARY KEY, nome, tipo, marca, modelo, descricao, foto, icone, sala_id, defeito, keystone, status)',
+    'CREATE TABLE equipamento_dados (id INTEGER PRIMARY KEY, equipamento_id INTEGER, chave TEXT, valor TEXT)',
+    # patch panels como a rota antiga os criava (server_backup.py)
+    'CREATE TABLE patch_panels (id INTEGER PRIMARY KEY AUTOINCREMENT, codigo TEXT UNIQUE NOT NULL, nome TEXT NOT NULL, andar INTEGER NOT NULL, '
+    "prefixo_keystone TEXT NOT NULL, porta_inicial INTEGER NOT NULL DEFAULT 1, num_portas INTEGER NOT NULL DEFAULT 500, status TEXT DEFAULT 'ativo', "
+    'descricao TEXT, data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP)',
+    'CREATE TABLE patch_panel_portas (id INTEGER PRIMARY KEY AUTOINCREMENT, patch_panel_id INTEGER NOT NULL, numero_porta INTEGER NOT NULL, '
+    "switch_id INTEGER, porta_switch INTEGER, status TEXT DEFAULT 'livre', equipamento_id INTEGER, data_conexao TIMESTAMP, "
+    'UNIQUE(patch_panel_id, numero_porta))',
+    'CREATE TABLE cabos (id INTEGER PRIMARY KEY, codigo_unico, tipo, comprimento, marca, modelo, descricao, foto, status, data_criacao, data_modificacao)',
+    'CREATE TABLE conexoes_cabos (id INTEGER PRIMARY KEY, cabo_id, equipamento_origem_id, equipamento_destino_id, porta_origem, porta_destino, sala_id, observacao, data_conexao, data_desconexao, tipo_destino)',
+    'CREATE TABLE ping_logs (id INTEGER PRIMARY KEY AUTOINCREMENT, equipamento_id INTEGER, nome_equipamento TEXT, ip TEXT, resultado TEXT, sucesso INTEGER, timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)',
+]
+
+
+@pytest.fixture
+def banco_original(banco):
+    """Banco temporário com as tabelas originais da empresa, ainda sem migrar."""
+    conn = sqlite3.connect(banco)
+    for sql in _SCHEMA_ORIGINAL:
+        conn.execute(sql)
+    conn.commit()
+    conn.close()
+    return banco
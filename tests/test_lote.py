@@ -0,0 +1,17 @@
+def test_lote_na_ordem_pedida_com_ids_em_string(srv, cliente, empresa):
+    srv._json_write_table(empresa, 'cabos', [{'id': 1, 'codigo_unico': 'C1', 'tipo': 'utp'},
+                                             {'id': '2', 'codigo_unico': 'C2', 'tipo': 'fibra'}])
+    r = cliente.post('/cabos/batch', json={'ids': [2, 9, 1], 'fields': ['codigo_unico']})
+    assert r.status_code == 200
+    assert r.get_json() == [{'id': '2', 'codigo_unico': 'C2'}, {'id': 1, 'codigo_unico': 'C1'}]
+
+
+def test_lote_copia_so_as_linhas_pedidas_sem_trava_da_requisicao(srv, cliente, empresa, monkeypatch):
+    srv._json_write_table(empresa, 'cabos', [{'id': i, 'codigo_unico': f'C{i}'} for i in range(1, 101)])
+    copiadas = []
+    copiar = srv._json_copiar_linha
+    monkeypatch.setattr(srv, '_json_copiar_linha', lambda entrada, row: copiadas.append(row['id']) or copiar(entrada, row))
+    monkeypatch.setattr(srv, '_json_trava', lambda empresa_dir: (_ for _ in ()).throw(AssertionError('travou')))
+    r = cliente.post('/api/batch', json={'cabos': [3, 50]})
+    assert [c['codigo_unico'] for c in r.get_json()['cabos']] == ['C3', 'C50']
+    assert copiadas == [3, 50]
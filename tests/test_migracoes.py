@@ -0,0 +1,48 @@
+import sqlite3
+
+
+def _schema(conn):
+    return sorted(conn.execute('SELECT type, name, sql FROM sqlite_master').fetchall(), key=repr)
+
+
+def test_migracao_leva_banco_original_a_versao_atual(srv, banco_original):
+    conn = sqlite3.connect(banco_original)
+    assert srv._sqlite_migrar(conn, banco_original) == srv.SQLITE_VERSAO_SCHEMA
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == srv.SQLITE_VERSAO_SCHEMA
+    colunas = [linha[1] for linha in conn.execute('PRAGMA table_info(ping_logs)')]
+    assert 'latencia_ms' in colunas
+    conn.close()
+
+
+def test_migracao_idempotente(srv, banco_original):
+    conn = sqlite3.connect(banco_original)
+    srv._sqlite_migrar(conn, banco_original)
+    antes = _schema(conn)
+    assert srv._sqlite_migrar(conn, banco_original) == srv.SQLITE_VERSAO_SCHEMA
+    assert _schema(conn) == antes
+    conn.close()
+
+    # Outra conexão (outro worker) encontra a versão atual e não refaz nada
+    conn = sqlite3.connect(banco_original)
+    assert srv._sqlite_migrar(conn, banco_original) == srv.SQLITE_VERSAO_SCHEMA
+    assert _schema(conn) == antes
+    conn.close()
+
+
+def test_migracao_retoma_de_versao_intermediaria(srv, banco_original):
+    conn = sqlite3.connect(banco_original)
+    srv._sqlite_migrar(conn, banco_original)
+    esperado = _schema(conn)
+    # Banco parado na versão 1 com parte dos objetos já criados
+    conn.execute('PRAGMA user_version = 1')
+    assert srv._sqlite_migrar(conn, banco_original) == srv.SQLITE_VERSAO_SCHEMA
+    assert _schema(conn) == esperado
+    conn.close()
+
+
+def test_migracao_de_arquivo_vazio(srv, banco):
+    conn = sqlite3.connect(banco)
+    assert srv._sqlite_migrar(conn, banco) == srv.SQLITE_VERSAO_SCHEMA
+    tabelas = {linha[0] for linha in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    assert {'switches', 'switch_portas', 'conexoes', 'andar_switches'} <= tabelas
+    conn.close()
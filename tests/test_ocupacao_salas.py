@@ -0,0 +1,110 @@
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def ocupacao(srv):
+    return srv._coletor_modulo('ocupacao_salas')
+
+
+class _Driver:
+    def __init__(self):
+        self.fechado = False
+
+    def quit(self):
+        self.fechado = True
+
+
+def test_falha_ao_criar_navegador_nao_trava_quem_espera(ocupacao):
+    def fabrica():
+        time.sleep(0.5)
+        raise RuntimeError('navegador não abriu')
+
+    sensores = [ocupacao.sensor(f'Sala {i}', f'10.0.0.{i}') for i in range(6)]
+    pool = ocupacao.PoolNavegadores(1, fabrica)
+    resultado = []
+    t = threading.Thread(target=lambda: resultado.extend(ocupacao.coletar(sensores, modo='navegador', navegadores=pool)),
+                         daemon=True)
+    t.start()
+    t.join(10)
+    assert not t.is_alive(), 'coletar() travou esperando um navegador'
+    assert [r['Status'] for r in resultado] == ['Indefinido'] * 6
+
+
+def test_navegador_com_erro_e_fechado_e_substituido(ocupacao):
+    criados = []
+
+    def fabrica():
+        criados.append(_Driver())
+        return criados[-1]
+
+    pool = ocupacao.PoolNavegadores(1, fabrica)
+    with pytest.raises(RuntimeError):
+        with pool.emprestar():
+            raise RuntimeError('sessão do WebDriver perdida')
+    assert criados[0].fechado
+    with pool.emprestar() as driver:
+        assert driver is criados[1]
+    # Sem erro o navegador volta ao pool e é reaproveitado
+    with pool.emprestar() as driver:
+        assert driver is criados[1]
+    pool.fechar()
+    assert criados[1].fechado
+
+
+def test_pool_nao_passa_do_tamanho(ocupacao):
+    pool = ocupacao.PoolNavegadores(2, _Driver)
+    em_uso = []
+    maximo = []
+    trava = threading.Lock()
+
+    def usar():
+        with pool.emprestar() as driver:
+            with trava:
+                em_uso.append(driver)
+                maximo.append(len(em_uso))
+            time.sleep(0.02)
+            with trava:
+                em_uso.remove(driver)
+
+    threads = [threading.Thread(target=usar) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert max(maximo) <= 2
+    assert len(pool._todos) <= 2
+
+
+def test_sensor_usa_o_ip_cadastrado(ocupacao):
+    entrada = ocupacao.sensor('Sala 02', '10.0.0.5')
+    assert entrada['Host'] == '10.0.0.5'
+    assert entrada['URL'] == 'http://10.0.0.5/#/stage/(child:status)'
+
+
+def test_ajuste_da_sala_02_so_no_json_legado(ocupacao, tmp_path):
+    caminho = tmp_path / 'audio-e-video.json'
+    caminho.write_text('{"andares": {"1": {"salas": ['
+                       '{"nome": "Sala 02", "equipamentos": [{"nome": "Sensor", "dados": {"ip": "10.0.0.5"}}]},'
+                       '{"nome": "Sala 03", "equipamentos": [{"nome": "Sensor", "dados": {"ip": "10.0.0.6"}}]}]}}}',
+                       encoding='utf-8')
+    sala02, sala03 = ocupacao.sensores_do_json(str(caminho))
+    assert sala02['Host'] == '10.12.187.121'
+    assert 'breakword' in sala02['XPath']
+    assert sala03['Host'] == '10.0.0.6'
+
+
+def test_coletor_de_ocupacao_consulta_o_ip_do_datastore(srv, ocupacao, monkeypatch):
+    consultados = []
+
+    def consultar(entry, navegadores, modo=None):
+        consultados.append(entry)
+        return 'Occupied'
+
+    monkeypatch.setattr(ocupacao, 'consultar_sensor', consultar)
+    monkeypatch.setattr(srv, '_coletor_pool', lambda nome, tamanho, fabrica: None)
+    r = srv._coletor_ocupacao((7, 'Sensor', '10.0.0.5', 'Sala 02'))
+    assert consultados[0]['Host'] == '10.0.0.5'
+    assert r['sucesso'] and r['dados'] == {'status': 'Occupied', 'ocupada': True}
@@ -0,0 +1,49 @@
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def sondas(srv, monkeypatch):
+    """Sondas falsas que registram (backend, ip); ICMP sem privilégio disponível."""
+    chamadas = []
+
+    def sonda(nome):
+        def sondar(ip, timeout, portas=None):
+            chamadas.append((nome, ip))
+            return 1, 'ok', 1.0
+        return sondar
+
+    monkeypatch.setattr(srv, '_SONDAS', {nome: sonda(nome) for nome in srv._SONDAS})
+    monkeypatch.setattr(srv, '_icmp_disponivel', lambda: True)
+    monkeypatch.setattr(srv, 'PING_BACKEND', 'auto')
+    return chamadas
+
+
+def test_ipv6_nao_vai_para_o_socket_icmp(srv, sondas):
+    srv._ping_executar('::1', 1)
+    srv._ping_executar('10.0.0.1', 1)
+    srv._ping_executar('fe80::1', 1, 'icmp')
+    assert sondas == [('sistema', '::1'), ('icmp', '10.0.0.1'), ('sistema', 'fe80::1')]
+
+
+def test_monitor_resolve_o_backend_uma_vez_por_ciclo(srv, sondas, monkeypatch):
+    resolucoes = []
+
+    def preparar():
+        resolucoes.append(1)
+        return srv._ping_backend()
+
+    gravados = []
+    monkeypatch.setattr(srv, '_monitor_empresas', lambda: ['json:empresa_1'])
+    monkeypatch.setitem(srv._COLETORES, 'ping', {
+        **srv._COLETORES['ping'],
+        'intervalo': 0,
+        'alvos': lambda db_file: [(1, 'A', '10.0.0.1'), (2, 'B', '::1'), (3, 'C', '10.0.0.3')],
+        'preparar': preparar,
+        'gravar': lambda db_file, registros, validos=None: gravados.extend(registros),
+    })
+    assert srv._monitor_ciclo('ping', threading.Event()) == 3
+    assert resolucoes == [1]
+    assert sorted(sondas) == [('icmp', '10.0.0.1'), ('icmp', '10.0.0.3'), ('sistema', '::1')]
+    assert len(gravados) == 3
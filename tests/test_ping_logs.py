@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+
+def _registros(dias):
+    """Três logs por dia, com dois no mesmo instante para testar o desempate pelo id."""
+    registros = []
+    for dia in dias:
+        for hora in ('08:00:00', '09:00:00', '09:00:00'):
+            registros.append({'equipamento_id': 1, 'nome_equipamento': 'PC', 'ip': '10.0.0.1',
+                              'resultado': 'ok', 'sucesso': True, 'timestamp': f'{dia} {hora}'})
+    return registros
+
+
+@pytest.fixture
+def logs(srv, empresa):
+    hoje = datetime.now()
+    dias = [(hoje - timedelta(days=n)).strftime('%Y-%m-%d') for n in (2, 1, 0)]
+    registros = _registros(dias)
+    srv._ping_logs_gravar(empresa, registros)  # atribui os ids nos próprios registros
+    return sorted(registros, key=srv._ping_log_chave, reverse=True)
+
+
+def test_pagina_mais_recentes_primeiro(srv, empresa, logs):
+    assert len(logs) == 9
+    assert srv._ping_logs_pagina(empresa, 4) == logs[:4]
+
+
+def test_cursor_percorre_todos_os_segmentos(srv, empresa, logs):
+    vistos = []
+    antes = None
+    while True:
+        pagina = srv._ping_logs_pagina(empresa, 2, antes)
+        if not pagina:
+            break
+        vistos.extend(pagina)
+        antes = pagina[-1]['id']
+    assert vistos == logs
+
+
+def test_cursor_inexistente(srv, empresa, logs):
+    with pytest.raises(LookupError):
+        srv._ping_logs_pagina(empresa, 10, 9999)
+
+
+def test_tabela_antiga_migrada_para_segmentos(srv, empresa):
+    dia = datetime.now().strftime('%Y-%m-%d')
+    antigos = [dict(r, id=i) for i, r in enumerate(_registros([dia]), start=1)]
+    srv._json_write_table(empresa, 'ping_logs', antigos)
+    pagina = srv._ping_logs_pagina(empresa, 10)
+    assert [p['id'] for p in pagina] == [3, 2, 1]
+    assert srv._json_read_table(empresa, 'ping_logs') == []
+    # Novos logs recebem ids acima dos migrados
+    srv._ping_logs_gravar(empresa, _registros([dia])[:1])
+    assert max(p['id'] for p in srv._ping_logs_pagina(empresa, 10)) > 3
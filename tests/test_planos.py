@@ -0,0 +1,52 @@
+import sqlite3
+import subprocess
+import sys
+
+
+def test_banco_novo_migrado_usa_indices(srv, banco_original):
+    conn = sqlite3.connect(banco_original)
+    srv._sqlite_migrar(conn, banco_original)
+    assert srv._sqlite_verificar_planos(conn) == []
+    conn.close()
+
+
+def test_banco_sem_indices_tem_varredura(srv, banco_original):
+    conn = sqlite3.connect(banco_original)
+    srv._sqlite_migrar(conn, banco_original)
+    conn.execute('DROP INDEX ix_equipamento_dados_equip_chave')
+    nomes = {nome for nome, _ in srv._sqlite_verificar_planos(conn)}
+    assert 'dados do equipamento' in nomes
+    conn.close()
+
+
+def test_consulta_que_nao_compila_e_problema(srv, banco):
+    # Só as tabelas criadas pelas migrações: as consultas quentes não compilam
+    conn = sqlite3.connect(banco)
+    srv._sqlite_migrar(conn, banco)
+    problemas = srv._sqlite_verificar_planos(conn)
+    assert problemas
+    assert all('no such table' in detalhe for _, detalhe in problemas)
+    conn.close()
+
+
+def _verificar_planos(srv, db_file):
+    return subprocess.run([sys.executable, srv.__file__, '--verificar-planos', db_file],
+                          capture_output=True, text=True, timeout=60)
+
+
+def test_cli_nao_migra_e_falha_em_schema_antigo(srv, banco_original):
+    resultado = _verificar_planos(srv, banco_original)
+    assert resultado.returncode == 1
+    assert 'Planos OK' not in resultado.stdout
+    conn = sqlite3.connect(banco_original)
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == 0
+    conn.close()
+
+
+def test_cli_aprova_banco_migrado(srv, banco_original):
+    conn = sqlite3.connect(banco_original)
+    srv._sqlite_migrar(conn, banco_original)
+    conn.close()
+    resultado = _verificar_planos(srv, banco_original)
+    assert resultado.returncode == 0, resultado.stdout
+    assert 'Planos OK' in resultado.stdout
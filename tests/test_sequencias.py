@@ -0,0 +1,37 @@
+import json
+import os
+import threading
+
+
+def test_ids_consecutivos_e_persistidos(srv, empresa):
+    assert list(srv._json_reservar_ids(empresa, 'salas', 3)) == [1, 2, 3]
+    assert srv._json_proximo_id(empresa, 'salas') == 4
+    path = os.path.join(srv._empresa_data_dir(empresa), srv._SEQUENCIAS_ARQUIVO)
+    with open(path, encoding='utf-8') as f:
+        assert json.load(f) == {'salas': 4}
+
+
+def test_sequencia_nunca_fica_abaixo_do_maior_id(srv, empresa):
+    srv._json_write_table(empresa, 'salas', [{'id': 10}, {'id': '25'}])
+    assert srv._json_proximo_id(empresa, 'salas') == 26
+    # Tabela editada à mão depois da última reserva
+    srv._json_atualizar_linhas(empresa, 'salas', [{'id': 40}])
+    assert srv._json_proximo_id(empresa, 'salas') == 41
+
+
+def test_reservas_concorrentes_nao_repetem_id(srv, empresa):
+    obtidos = []
+    trava = threading.Lock()
+
+    def reservar():
+        for _ in range(50):
+            i = srv._json_proximo_id(empresa, 'equipamentos')
+            with trava:
+                obtidos.append(i)
+
+    threads = [threading.Thread(target=reservar) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(obtidos) == list(range(1, 201))
@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def switches(srv, empresa):
+    srv._json_write_table(empresa, 'switches', [{'id': 1, 'nome': 'SW1'}, {'id': 2, 'nome': 'SW2'}])
+    srv._json_write_table(empresa, 'switch_portas', [
+        {'id': 10 + n, 'switch_id': sw, 'numero_porta': n, 'status': 'livre'} for sw in (1, 2) for n in (1, 2)
+    ])
+    return [1, 2]
+
+
+def test_todas_as_portas_iguais_a_rota_de_um_switch(cliente, switches):
+    tudo = cliente.get('/switch-portas?all=1').get_json()
+    assert list(tudo) == ['1', '2']
+    for sw in switches:
+        assert tudo[str(sw)] == cliente.get(f'/switch-portas/{sw}').get_json()
+    assert cliente.get('/switch-portas?switch_ids=2,999').get_json()['999'] == []
+
+
+def test_falha_no_primeiro_switch_responde_500(srv, cliente, switches, monkeypatch):
+    def falhar(db_file, switch_ids):
+        raise OSError('banco indisponível')
+        yield
+
+    monkeypatch.setattr(srv, '_switch_portas', falhar)
+    r = cliente.get('/switch-portas?all=1')
+    assert r.status_code == 500
+    assert r.get_json()['status'] == 'erro'
+
+
+def test_falha_no_meio_fecha_o_json_com_erro(srv, cliente, switches, monkeypatch):
+    def falhar_no_segundo(db_file, switch_ids):
+        yield switch_ids[0], []
+        raise OSError('banco indisponível')
+
+    monkeypatch.setattr(srv, '_switch_portas', falhar_no_segundo)
+    r = cliente.get('/switch-portas?all=1')
+    corpo = json.loads(r.get_data())
+    assert corpo['1'] == []
+    assert 'banco indisponível' in corpo['erro']
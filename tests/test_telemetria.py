@@ -0,0 +1,80 @@
+import time
+
+import pytest
+
+
+@pytest.fixture
+def telemetria(srv, empresa, tmp_path, monkeypatch):
+    monkeypatch.setattr(srv, '_TELEMETRIA_DIR', str(tmp_path / 'telemetria'))
+    return empresa
+
+
+@pytest.fixture
+def amostras(srv, telemetria):
+    """Equipamento 1: rtt 1..100 ms, um por segundo, e 10 falhas no meio; tudo
+    dentro do mesmo minuto alinhado de uma hora atrás."""
+    base = int(time.time()) - 3600
+    base -= base % 3600
+    registros = [{'equipamento_id': 1, 'quando': base + i, 'sucesso': True, 'latencia_ms': float(i + 1)} for i in range(50)]
+    registros += [{'equipamento_id': 1, 'quando': base + 50 + i, 'sucesso': False, 'latencia_ms': None} for i in range(10)]
+    registros += [{'equipamento_id': 1, 'quando': base + 60 + i, 'sucesso': True, 'latencia_ms': float(i + 51)} for i in range(50)]
+    srv._telemetria_registrar(telemetria, registros)
+    return base
+
+
+def test_percentis_exatos_das_amostras(srv, telemetria, amostras):
+    r = srv._telemetria_disponibilidade(telemetria, [(1, 'PC')], amostras, amostras + 3600)
+    assert r['fonte'] == 'amostras'
+    assert r['amostras'] == 110
+    assert r['uptime_pct'] == round(100 * 100 / 110, 2)
+    assert r['latencia_ms'] == {'p50': 50.0, 'p95': 95.0, 'media': 50.5, 'min': 1.0, 'max': 100.0}
+    [queda] = r['equipamentos'][0]['quedas']
+    assert queda['duracao_s'] == 10 and not queda['em_andamento']
+
+
+def test_agregados_e_percentis_do_histograma(srv, telemetria, amostras, monkeypatch):
+    # Sem amostras brutas retidas, o período sai dos agregados de 1 min
+    monkeypatch.setattr(srv, 'TELEMETRIA_BRUTA_DIAS', 0)
+    r = srv._telemetria_disponibilidade(telemetria, [(1, 'PC')], amostras, amostras + 3600, serie=True)
+    assert r['fonte'] == 'agregados de 60s'
+    assert r['amostras'] == 110
+    latencia = r['latencia_ms']
+    assert (latencia['media'], latencia['min'], latencia['max']) == (50.5, 1.0, 100.0)
+    # Histograma com classes de 25%: erro do ponto médio abaixo de 12%
+    assert latencia['p50'] == pytest.approx(50, rel=0.12)
+    assert latencia['p95'] == pytest.approx(95, rel=0.12)
+    assert [p['amostras'] for p in r['serie']['pontos']] == [60, 50]
+
+
+def test_percentil_do_histograma_fica_entre_minimo_e_maximo(srv, telemetria, monkeypatch):
+    quando = int(time.time()) - 120
+    srv._telemetria_registrar(telemetria, [{'equipamento_id': 2, 'quando': quando + i, 'sucesso': True, 'latencia_ms': 10.0}
+                                           for i in range(5)])
+    monkeypatch.setattr(srv, 'TELEMETRIA_BRUTA_DIAS', 0)
+    r = srv._telemetria_disponibilidade(telemetria, [(2, 'PC')], quando - quando % 60, quando + 60)
+    assert r['latencia_ms']['p50'] == 10.0
+    assert r['latencia_ms']['p95'] == 10.0
+
+
+def test_amostra_repetida_no_mesmo_segundo_conta_uma_vez(srv, telemetria, amostras):
+    srv._telemetria_registrar(telemetria, [{'equipamento_id': 1, 'quando': amostras, 'sucesso': True, 'latencia_ms': 999.0}])
+    r = srv._telemetria_disponibilidade(telemetria, [(1, 'PC')], amostras, amostras + 3600)
+    assert r['amostras'] == 110
+    assert r['latencia_ms']['max'] == 100.0
+
+
+def test_periodo_respeita_fuso_explicito(srv):
+    with srv.app.test_request_context('/?inicio=2024-01-01T03:00:00%2B03:00&fim=2024-01-01T01:00:00Z'):
+        inicio, fim = srv._telemetria_periodo()
+    assert inicio == 1704067200  # 2024-01-01T00:00:00Z
+    assert fim == inicio + 3600
+    with srv.app.test_request_context('/?inicio=2024-01-01T00:00:00&periodo=1h'):
+        assert srv._telemetria_periodo()[0] == 1704067200
+
+
+def test_bancos_com_mesmo_nome_nao_colidem(srv, tmp_path, monkeypatch):
+    monkeypatch.setattr(srv, '_TELEMETRIA_DIR', str(tmp_path / 'telemetria'))
+    a = srv._telemetria_db(str(tmp_path / 'filial_a' / 'empresa.db'))
+    b = srv._telemetria_db(str(tmp_path / 'filial_b' / 'empresa.db'))
+    assert a != b
+    assert a == srv._telemetria_db(str(tmp_path / 'filial_a' / 'empresa.db'))
@@ -0,0 +1,84 @@
+import pytest
+
+
+@pytest.fixture
+def rede(srv, empresa):
+    """Switch 1 com duas portas. O PC 100 chega pela porta 1 do patch panel 5
+    (mapeada na porta 1 do switch), o PC 101 direto na porta 2 e o PC 102 por
+    um cabo até a mesma porta do patch panel. Alguns ids vêm como string."""
+    tabelas = {
+        'switches': [{'id': 1, 'nome': 'SW1'}],
+        'switch_portas': [{'id': 10, 'switch_id': 1, 'numero_porta': 1}, {'id': 11, 'switch_id': '1', 'numero_porta': 2}],
+        'patch_panels': [{'id': 5, 'nome': 'PP5'}],
+        'patch_panel_portas': [{'id': 50, 'patch_panel_id': 5, 'numero_porta': 1, 'switch_id': '1',
+                                'porta_switch': '1', 'equipamento_id': '100'}],
+        'equipamentos': [{'id': 100, 'nome': 'PC100'}, {'id': 101, 'nome': 'PC101'}, {'id': 102, 'nome': 'PC102'}],
+        'conexoes': [{'id': 1, 'porta_id': '11', 'equipamento_id': 101, 'status': 'ativa'}],
+        'cabos': [{'id': 7, 'codigo_unico': 'C7'}],
+        'conexoes_cabos': [{'id': 1, 'cabo_id': 7, 'equipamento_origem_id': '102', 'equipamento_destino_id': 5,
+                            'tipo_destino': 'patch_panel', 'porta_destino': '1'}],
+    }
+    for tabela, rows in tabelas.items():
+        srv._json_write_table(empresa, tabela, rows)
+    return empresa
+
+
+def _caminho(cliente, equipamento_id):
+    r = cliente.get(f'/api/topologia/caminho/{equipamento_id}').get_json()
+    return [(p['elemento'], p['id']) for p in r['caminho']] if r['conectado'] else None
+
+
+def _impacto(cliente, tipo, item_id):
+    return sorted(e['id'] for e in cliente.get(f'/api/topologia/impacto/{tipo}/{item_id}').get_json()['equipamentos'])
+
+
+def test_caminhos_com_ids_em_string(cliente, rede):
+    assert _caminho(cliente, 100) == [('equipamento', 100), ('porta_patch_panel', 50), ('porta_switch', 10), ('switch', 1)]
+    assert _caminho(cliente, 101) == [('equipamento', 101), ('porta_switch', 11), ('switch', 1)]
+    assert _caminho(cliente, 102) == [('equipamento', 102), ('cabo', 7), ('porta_patch_panel', 50),
+                                      ('porta_switch', 10), ('switch', 1)]
+    assert cliente.get('/api/topologia/caminho/999').status_code == 404
+
+
+def test_impacto(cliente, rede):
+    assert _impacto(cliente, 'switch', 1) == [100, 101, 102]
+    assert _impacto(cliente, 'patch-panel', 5) == [100, 102]
+    assert _impacto(cliente, 'cabo', 7) == [102]
+    assert _impacto(cliente, 'porta-switch', 11) == [101]
+
+
+def test_grafo_acompanha_gravacoes_sem_reler_as_tabelas(srv, cliente, rede, monkeypatch):
+    assert _impacto(cliente, 'patch-panel', 5) == [100, 102]
+
+    def reler(*args):
+        raise AssertionError('tabela relida inteira')
+
+    monkeypatch.setattr(srv, '_topologia_tabela', reler)
+    # Desliga o PC 100 do patch panel e liga direto na porta 1
+    srv._json_atualizar_linhas(rede, 'patch_panel_portas', [{'id': 50, 'patch_panel_id': 5, 'numero_porta': 1,
+                                                             'switch_id': 1, 'porta_switch': 1, 'equipamento_id': None}])
+    srv._json_atualizar_linhas(rede, 'conexoes', [{'id': 2, 'porta_id': 10, 'equipamento_id': 100, 'status': 'ativa'}])
+    assert _caminho(cliente, 100) == [('equipamento', 100), ('porta_switch', 10), ('switch', 1)]
+    assert _impacto(cliente, 'patch-panel', 5) == [102]
+
+    # Cabo desconectado: o PC 102 fica sem caminho
+    srv._json_atualizar_linhas(rede, 'conexoes_cabos', [{'id': 1, 'cabo_id': 7, 'equipamento_origem_id': 102,
+                                                         'equipamento_destino_id': 5, 'tipo_destino': 'patch_panel',
+                                                         'porta_destino': 1, 'data_desconexao': '2024-01-01'}])
+    assert _caminho(cliente, 102) is None
+    assert _impacto(cliente, 'switch', 1) == [100, 101]
+
+
+def test_grafo_igual_ao_montado_do_zero(srv, rede):
+    with srv._topologia_trava(rede):
+        srv._topologia_grafo(rede)
+    srv._json_write_table(rede, 'conexoes', [])
+    srv._json_atualizar_linhas(rede, 'equipamentos', [{'id': 103, 'nome': 'PC103'}])
+    with srv._topologia_trava(rede):
+        incremental = srv._topologia_grafo(rede)
+        adj, info = incremental['adj'], dict(incremental['info'])
+    srv._topologia.pop(rede)
+    with srv._topologia_trava(rede):
+        do_zero = srv._topologia_grafo(rede)
+    assert adj == do_zero['adj']
+    assert info == do_zero['info']
@@ -0,0 +1,36 @@
+import pytest
+
+
+def test_transacao_confirma_varias_tabelas_juntas(srv, empresa):
+    with srv._json_transacao(empresa) as tx:
+        tx.gravar('salas', [{'id': 1, 'nome': 'A'}])
+        assert tx.ler('salas') == [{'id': 1, 'nome': 'A'}]
+        tx.gravar('equipamentos', [{'id': 1, 'sala_id': 1}])
+    srv._json_cache_invalidar()
+    assert srv._json_read_table(empresa, 'salas') == [{'id': 1, 'nome': 'A'}]
+    assert srv._json_read_table(empresa, 'equipamentos') == [{'id': 1, 'sala_id': 1}]
+
+
+def test_transacao_com_excecao_nao_grava_nada(srv, empresa):
+    srv._json_write_table(empresa, 'salas', [{'id': 1, 'nome': 'A'}])
+    with pytest.raises(RuntimeError):
+        with srv._json_transacao(empresa) as tx:
+            salas = tx.ler('salas')
+            salas[0]['nome'] = 'alterada'
+            tx.gravar('salas', salas)
+            tx.gravar('equipamentos', [{'id': 1, 'sala_id': 1}])
+            raise RuntimeError('falha no meio da transação')
+    assert srv._json_read_table(empresa, 'salas') == [{'id': 1, 'nome': 'A'}]
+    assert srv._json_read_table(empresa, 'equipamentos') == []
+    srv._json_cache_invalidar()
+    assert srv._json_read_table(empresa, 'salas') == [{'id': 1, 'nome': 'A'}]
+    assert srv._json_read_table(empresa, 'equipamentos') == []
+
+
+def test_leitura_da_transacao_nao_altera_o_cache(srv, empresa):
+    srv._json_write_table(empresa, 'salas', [{'id': 1, 'nome': 'A'}])
+    with pytest.raises(ValueError):
+        with srv._json_transacao(empresa) as tx:
+            tx.ler('salas')[0]['nome'] = 'vazou'
+            raise ValueError
+    assert srv._json_get(empresa, 'salas', 1) == {'id': 1, 'nome': 'A'}